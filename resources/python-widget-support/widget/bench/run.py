@@ -0,0 +1,327 @@
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from widget.bench.workspace_stub import MEDIA_OBJECT_ID, PROTEIN_STRUCTURES_OBJECT_ID
+
+#
+# Benchmarks the widget runtime: requests are made to each built-in widget, served as by
+# a service, with the Workspace replaced by a local stand-in, and the throughput,
+# latency and memory use of the widget server are measured.
+#
+# The stand-in and the widget server each run in their own process, so that neither
+# they nor the requests made compete with each other for the interpreter, and the
+# memory measured is that of the widget server alone.
+#
+# Run from the directory containing the widget package, e.g. lib/ in a service:
+#
+#   python -m widget.bench.run --concurrency 8 --requests 500 --output results.json
+#
+
+RESULTS_VERSION = 1
+
+#
+# The request made for each widget; "{ref}" is replaced by the refs of objects of the
+# type the widget shows, so that requests may be for distinct objects.
+#
+SCENARIOS = OrderedDict([
+    ('assets', '/widgets/assets/css/style.css'),
+    ('media_viewer', '/widgets/media_viewer/index.html'),
+    ('media_viewer_py', '/widgets/media_viewer_py?ref={ref}'),
+    ('protein_structures_viewer', '/widgets/protein_structures_viewer?ref={ref}'),
+    ('demos', '/widgets/demos?demo=home'),
+])
+
+# The Workspace stand-in's object id for the objects shown by each widget.
+SCENARIO_OBJECT_IDS = {
+    'media_viewer_py': MEDIA_OBJECT_ID,
+    'protein_structures_viewer': PROTEIN_STRUCTURES_OBJECT_ID,
+}
+
+# The directory containing the widget package, from which the servers are run.
+PACKAGE_PARENT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Server did not start listening on port {port}")
+
+
+def start_server(module, args, stdout=None):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [PACKAGE_PARENT, env.get('PYTHONPATH')]))
+    return subprocess.Popen([sys.executable, '-m', module] + args, cwd=PACKAGE_PARENT, env=env, stdout=stdout)
+
+
+def get_rss(pid):
+    """
+    The resident set size of a process, in bytes, or None where /proc is not
+    available.
+    """
+    try:
+        with open(f"/proc/{pid}/status", 'r', encoding='utf-8') as fin:
+            for line in fin:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class RSSSampler(object):
+    """
+    Samples the resident set size of a process while a scenario runs, to find its
+    peak.
+    """
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        return self.peak
+
+    def run(self):
+        while True:
+            rss = get_rss(self.pid)
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+            if self.stopped.wait(self.interval):
+                return
+
+
+def percentile(sorted_values, percent):
+    if len(sorted_values) == 0:
+        return None
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))
+    return sorted_values[index]
+
+
+def get_workspace_calls(port):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    try:
+        connection.request('GET', '/')
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+
+def request(port, path, headers, timeout):
+    """
+    Makes a request, reading the whole response, and returns the status, size and
+    duration in seconds.
+    """
+    started = time.perf_counter()
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        connection.request('GET', path, headers=headers)
+        response = connection.getresponse()
+        size = len(response.read())
+        return response.status, size, time.perf_counter() - started
+    except (OSError, http.client.HTTPException):
+        return None, 0, time.perf_counter() - started
+    finally:
+        connection.close()
+
+
+def run_scenario(name, path_template, options, server_port, server_pid, workspace_port):
+    headers = {
+        'Cookie': f"kbase_session={options.token}",
+        'Accept-Encoding': 'gzip' if options.gzip else 'identity'
+    }
+    if options.refs:
+        refs = options.refs
+    else:
+        object_id = SCENARIO_OBJECT_IDS.get(name)
+        refs = [f"{index + 1}/{object_id}/1" for index in range(options.distinct_objects)]
+    paths = [path_template.format(ref=ref) for ref in refs]
+
+    for index in range(options.warmup):
+        request(server_port, paths[index % len(paths)], headers, options.timeout)
+
+    workspace_calls_before = get_workspace_calls(workspace_port)
+    rss_before = get_rss(server_pid)
+
+    counter = itertools.count()
+    results = []
+    results_lock = threading.Lock()
+
+    def worker():
+        while True:
+            index = next(counter)
+            if index >= options.requests:
+                return
+            result = request(server_port, paths[index % len(paths)], headers, options.timeout)
+            with results_lock:
+                results.append(result)
+
+    sampler = RSSSampler(server_pid)
+    sampler.start()
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(options.concurrency)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    rss_peak = sampler.stop()
+
+    workspace_calls_after = get_workspace_calls(workspace_port)
+
+    durations = sorted(duration for _, _, duration in results)
+    statuses = {}
+    for status, _, _ in results:
+        key = 'error' if status is None else str(status)
+        statuses[key] = statuses.get(key, 0) + 1
+    ok = [size for status, size, _ in results if status is not None and status < 400]
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 2)
+
+    return OrderedDict([
+        ('scenario', name),
+        ('path', path_template),
+        ('requests', len(results)),
+        ('concurrency', options.concurrency),
+        ('statuses', statuses),
+        ('errors', len(results) - len(ok)),
+        ('elapsed_s', round(elapsed, 3)),
+        ('throughput_rps', round(len(results) / elapsed, 2) if elapsed > 0 else None),
+        ('latency_ms', OrderedDict([
+            ('mean', ms(sum(durations) / len(durations)) if durations else None),
+            ('p50', ms(percentile(durations, 50))),
+            ('p90', ms(percentile(durations, 90))),
+            ('p99', ms(percentile(durations, 99))),
+            ('max', ms(durations[-1]) if durations else None),
+        ])),
+        ('response_bytes_mean', round(sum(ok) / len(ok)) if ok else None),
+        ('rss_bytes', OrderedDict([
+            ('before', rss_before),
+            ('after', get_rss(server_pid)),
+            ('peak', rss_peak),
+        ])),
+        ('workspace_calls', {
+            method: count - workspace_calls_before.get(method, 0)
+            for method, count in workspace_calls_after.items()
+            if count - workspace_calls_before.get(method, 0) > 0
+        }),
+    ])
+
+
+def print_summary(scenarios):
+    print(f"{'scenario':<28}{'req/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'errors':>8}{'peak RSS MiB':>14}")
+    for result in scenarios:
+        latency = result['latency_ms']
+        peak = result['rss_bytes']['peak']
+        print(f"{result['scenario']:<28}{result['throughput_rps']:>10}{latency['p50']:>10}{latency['p90']:>10}"
+              f"{latency['p99']:>10}{result['errors']:>8}{'-' if peak is None else round(peak / 1048576, 1):>14}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the widget runtime against a local Workspace stand-in.')
+    parser.add_argument('--scenarios', nargs='*', choices=list(SCENARIOS.keys()), default=list(SCENARIOS.keys()),
+                        help='the widgets to benchmark; all by default')
+    parser.add_argument('--concurrency', type=int, default=4, help='requests made at the same time')
+    parser.add_argument('--requests', type=int, default=200, help='requests measured per scenario')
+    parser.add_argument('--warmup', type=int, default=10, help='requests made before measuring each scenario')
+    parser.add_argument('--distinct-objects', type=int, default=1,
+                        help='distinct objects requested in turn, to measure uncached requests')
+    parser.add_argument('--refs', nargs='*',
+                        help='refs of the objects to request, in turn, e.g. those recorded in a replayed fixture')
+    parser.add_argument('--rows', type=int, default=100, help='rows in each Workspace object')
+    parser.add_argument('--latency', type=float, default=20, help='milliseconds added to each Workspace call')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for each response')
+    parser.add_argument('--token', default='benchmark-token', help='the auth token sent in the session cookie')
+    parser.add_argument('--no-gzip', dest='gzip', action='store_false', help='do not accept gzip responses')
+    parser.add_argument('--replay', help='a fixture file of recorded Workspace calls to use instead of the stand-in')
+    parser.add_argument('--replay-latency', help='milliseconds added to each replayed call, or "recorded"')
+    parser.add_argument('--server-log', help='file for the widget request log; discarded by default')
+    parser.add_argument('--output', default='widget-bench-results.json', help='file for the results, as JSON')
+    options = parser.parse_args()
+
+    workspace_port = get_free_port()
+    server_port = get_free_port()
+
+    workspace = start_server('widget.bench.workspace_stub', [
+        '--port', str(workspace_port),
+        '--rows', str(options.rows),
+        '--latency', str(options.latency)
+    ], stdout=subprocess.DEVNULL)
+
+    server_log = open(options.server_log, 'w', encoding='utf-8') if options.server_log else subprocess.DEVNULL
+    server_args = [
+        '--port', str(server_port),
+        '--workspace-url', f"http://127.0.0.1:{workspace_port}"
+    ]
+    if options.replay is not None:
+        server_args += ['--replay', os.path.abspath(options.replay)]
+        if options.replay_latency is not None:
+            server_args += ['--replay-latency', options.replay_latency]
+    server = start_server('widget.bench.server', server_args, stdout=server_log)
+
+    try:
+        wait_for_port(workspace_port, workspace)
+        wait_for_port(server_port, server)
+        rss_started = get_rss(server.pid)
+
+        scenarios = []
+        for name in options.scenarios:
+            print(f"Running {name}...", file=sys.stderr, flush=True)
+            scenarios.append(run_scenario(name, SCENARIOS[name], options, server_port, server.pid, workspace_port))
+    finally:
+        server.terminate()
+        workspace.terminate()
+        server.wait()
+        workspace.wait()
+        if options.server_log:
+            server_log.close()
+
+    results = OrderedDict([
+        ('version', RESULTS_VERSION),
+        ('created', time.strftime('%Y-%m-%dT%H:%M:%S%z')),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('runtime_mode', 'DEVELOPMENT' if (os.environ.get('DEV') or '').lower().startswith('t') else 'PRODUCTION'),
+        ('options', OrderedDict((key, value) for key, value in sorted(vars(options).items()) if key != 'token')),
+        ('rss_bytes_started', rss_started),
+        ('scenarios', scenarios),
+    ])
+    with open(options.output, 'w', encoding='utf-8') as fout:
+        json.dump(results, fout, indent=2)
+
+    print_summary(scenarios)
+    print(f"Results written to {options.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
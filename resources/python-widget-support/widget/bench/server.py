@@ -0,0 +1,73 @@
+import argparse
+import socketserver
+import sys
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from widget.lib.rpc_fixtures import RECORDED_LATENCY, RpcRecorder, RpcReplay
+from widget.lib.widget_support import WidgetSupport, handle_widget_request
+
+#
+# Serves widgets alone, as the service's server does, for benchmarks: widget support is
+# created as by the service's Impl, and requests are handled as by the code injected
+# into the service's Server.
+#
+
+
+def application(environ, start_response):
+    response = handle_widget_request(environ)
+    if response is None:
+        start_response('404 Not Found', [('content-type', 'text/plain; charset=utf-8')])
+        return [b'Not Found']
+    status, response_headers, content = response
+    start_response(status, response_headers)
+    if isinstance(content, bytes):
+        return [content]
+    return content
+
+
+def parse_latency(value):
+    if value is None or value == RECORDED_LATENCY:
+        return value
+    return float(value)
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serves widgets for benchmarks.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5100)
+    parser.add_argument('--workspace-url', default='http://127.0.0.1:5101')
+    parser.add_argument('--kbase-endpoint', default='https://ci.kbase.us/services')
+    parser.add_argument('--service-package-name', default='BenchmarkService')
+    parser.add_argument('--record', help='fixture file to which service calls are recorded')
+    parser.add_argument('--replay', help='fixture file from which service calls are answered')
+    parser.add_argument('--replay-latency', help=f'milliseconds added to each replayed call, or "{RECORDED_LATENCY}"')
+    args = parser.parse_args()
+
+    service_config = {
+        'kbase-endpoint': args.kbase_endpoint,
+        'workspace-url': args.workspace_url
+    }
+    widget_support = WidgetSupport(service_config, args.service_package_name, 'benchmark')
+    if args.replay is not None:
+        widget_support.rpc_replay = RpcReplay(args.replay, latency=parse_latency(args.replay_latency))
+    elif args.record is not None:
+        widget_support.rpc_recorder = RpcRecorder(args.record)
+    widget_support.set_global()
+
+    server = make_server(args.host, args.port, application,
+                         server_class=ThreadingWSGIServer, handler_class=QuietRequestHandler)
+    print(f"Widgets at http://{args.host}:{server.server_address[1]}/widgets", file=sys.stderr, flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+import argparse
+import json
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+#
+# A stand-in for the Workspace, for benchmarks: it answers the JSON-RPC calls made by
+# widgets with synthetic objects, after a configurable delay.
+#
+# Any ref of the form WS/OBJ/VER exists; the object id selects the type of the object,
+# and the workspace id may be varied to obtain distinct objects of the same type.
+#
+
+MEDIA_OBJECT_ID = 1
+PROTEIN_STRUCTURES_OBJECT_ID = 2
+GENOME_OBJECT_ID = 3
+
+OBJECT_TYPES = {
+    MEDIA_OBJECT_ID: 'KBaseBiochem.Media-4.0',
+    PROTEIN_STRUCTURES_OBJECT_ID: 'KBaseStructure.ProteinStructures-2.0',
+    GENOME_OBJECT_ID: 'KBaseGenomes.Genome-17.0',
+}
+
+SAVE_DATE = '2024-01-01T00:00:00+0000'
+
+
+def make_media(rows):
+    return {
+        'id': 'bench_media',
+        'name': 'Benchmark Media',
+        'source_id': 'bench_media',
+        'isMinimal': 0,
+        'isDefined': 1,
+        'mediacompounds': [
+            {
+                'id': f"cpd{index:05d}",
+                'compound_ref': f"489/6/6/compounds/id/cpd{index:05d}",
+                'name': f"Compound {index}",
+                'formula': 'C6H12O6',
+                'charge': index % 3 - 1,
+                'concentration': 0.001,
+                'minFlux': -100,
+                'maxFlux': 100
+            }
+            for index in range(rows)
+        ]
+    }
+
+
+def make_protein_structures(rows):
+    return {
+        'name': 'Benchmark Protein Structures',
+        'source_id': 'bench_protein_structures',
+        'pdb_infos': [
+            {
+                'structure_name': f"structure_{index}",
+                'file_extension': '.pdb',
+                'genome_ref': '1/3/1',
+                'feature_id': f"feature_{index}",
+                'chain_ids': ['A', 'B'],
+                'sequence_identities': ['100%', '98.5%'],
+                'model_ids': [0],
+                'is_model': 1
+            }
+            for index in range(rows)
+        ]
+    }
+
+
+def make_genome(rows):
+    return {
+        'id': 'bench_genome',
+        'scientific_name': 'Benchmarkia syntheticus',
+        'domain': 'Bacteria',
+        'dna_size': rows * 1000,
+        'gc_content': 0.5,
+        'source': 'RefSeq',
+        'source_id': 'NC_000000',
+        'features': [
+            {
+                'id': f"feature_{index}",
+                'type': 'gene',
+                'location': [['contig_1', index * 1000, '+', 900]],
+                'function': 'hypothetical protein',
+                'protein_translation': 'M' + 'A' * 299
+            }
+            for index in range(rows)
+        ]
+    }
+
+
+OBJECT_MAKERS = {
+    MEDIA_OBJECT_ID: make_media,
+    PROTEIN_STRUCTURES_OBJECT_ID: make_protein_structures,
+    GENOME_OBJECT_ID: make_genome,
+}
+
+
+def parse_ref(ref):
+    """
+    The workspace id, object id and version of a ref, or None if it does not name a
+    stand-in object.
+    """
+    try:
+        parts = [int(part) for part in ref.split('/')]
+    except ValueError:
+        return None
+    if len(parts) == 2:
+        parts.append(1)
+    if len(parts) != 3 or parts[1] not in OBJECT_TYPES:
+        return None
+    return parts
+
+
+def project(data, included):
+    """
+    The parts of the data selected by top level object paths, e.g. "/scientific_name";
+    deeper paths select the whole of their top level key.
+    """
+    projected = {}
+    for path in included:
+        key = path.strip('/').split('/')[0]
+        if key in data:
+            projected[key] = data[key]
+    return projected
+
+
+class WorkspaceStub(object):
+    """
+    The synthetic objects, and the calls made for them.
+
+    Rows is the number of rows in each object: compounds in media, structures in
+    protein structures, and features in genomes. Latency, in milliseconds, is added to
+    every call.
+    """
+    METHODS = ('get_object_info3', 'get_workspace_info', 'get_objects2')
+
+    def __init__(self, rows=100, latency=0):
+        self.rows = rows
+        self.latency = latency
+        self.objects = {}
+        self.sizes = {}
+        for object_id, make_object in OBJECT_MAKERS.items():
+            data = make_object(rows)
+            self.objects[object_id] = data
+            self.sizes[object_id] = len(json.dumps(data))
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def count_call(self, method):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+    def get_info(self, workspace_id, object_id, version):
+        return [
+            object_id, f"object_{object_id}", OBJECT_TYPES[object_id], SAVE_DATE, version,
+            'bench', workspace_id, f"workspace_{workspace_id}", 'checksum',
+            self.sizes[object_id], {'Is Minimal': '0', 'Is Defined': '1', 'Number compounds': str(self.rows)}
+        ]
+
+    def get_infostruct(self, info):
+        keys = ['objid', 'name', 'type', 'save_date', 'version', 'saved_by', 'wsid', 'wsname', 'chsum', 'size', 'meta']
+        return dict(zip(keys, info))
+
+    def get_object_info3(self, params):
+        infos = []
+        paths = []
+        for spec in params['objects']:
+            parts = parse_ref(spec['ref'])
+            if parts is None:
+                infos.append(None)
+                paths.append(None)
+            else:
+                infos.append(self.get_info(*parts))
+                paths.append([spec['ref']])
+        return [{'infos': infos, 'paths': paths}]
+
+    def get_workspace_info(self, params):
+        workspace_id = params['id']
+        return [[
+            workspace_id, f"workspace_{workspace_id}", 'bench', SAVE_DATE, len(OBJECT_TYPES),
+            'r', 'n', 'unlocked', {'narrative_nice_name': 'Benchmark Narrative'}
+        ]]
+
+    def get_objects2(self, params):
+        data = []
+        for spec in params['objects']:
+            parts = parse_ref(spec['ref'])
+            if parts is None:
+                data.append(None)
+                continue
+            info = self.get_info(*parts)
+            object_data = self.objects[parts[1]]
+            if 'included' in spec:
+                object_data = project(object_data, spec['included'])
+            data.append({
+                'info': info,
+                'infostruct': self.get_infostruct(info),
+                'data': object_data,
+                'provenance': [],
+                'created': SAVE_DATE,
+                'creator': 'bench'
+            })
+        return [{'data': data}]
+
+    def call(self, method, params):
+        """
+        The result of a call, or None for an unknown method.
+        """
+        self.count_call(method)
+        if self.latency:
+            time.sleep(self.latency / 1000)
+        if method not in self.METHODS:
+            return None
+        return getattr(self, method)(params[0])
+
+
+class WorkspaceStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and content are written separately; without this, the delayed ack of
+    # the headers would add tens of milliseconds to each call.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_POST(self):
+        rpc = json.loads(self.rfile.read(int(self.headers['content-length'])))
+        method = rpc['method'].split('.')[-1]
+        result = self.server.stub.call(method, rpc.get('params') or [{}])
+        if result is None:
+            self.send_json(500, {
+                'version': '1.1',
+                'id': rpc.get('id'),
+                'error': {'name': 'JSONRPCError', 'code': -32601, 'message': f"Method not found: {method}"}
+            })
+        else:
+            self.send_json(200, {'version': '1.1', 'id': rpc.get('id'), 'result': result})
+
+    def do_GET(self):
+        # The number of calls of each method, so a benchmark can report them.
+        with self.server.stub.lock:
+            calls = dict(self.server.stub.calls)
+        self.send_json(200, calls)
+
+
+class WorkspaceStubServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, stub):
+        self.stub = stub
+        super().__init__(address, WorkspaceStubHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='A Workspace stand-in, for benchmarks.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5101)
+    parser.add_argument('--rows', type=int, default=100, help='rows in each object')
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds added to each call')
+    args = parser.parse_args()
+
+    server = WorkspaceStubServer((args.host, args.port), WorkspaceStub(rows=args.rows, latency=args.latency))
+    print(f"Workspace stand-in at http://{args.host}:{server.server_address[1]}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
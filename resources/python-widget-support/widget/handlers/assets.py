@@ -2,6 +2,7 @@ import os
 from pathlib import Path
 
 from widget.lib.handler_utils import handle_static_file
+from widget.lib.static_index import StaticIndex
 
 #
 # Static widgets are mapped to the filesystem.
@@ -16,13 +17,17 @@ class WidgetError(Exception):
 
 
 class Assets(object):
-    def __init__(self, service_package_name, name, service_config, widget_config, path, title):
+    WIDGET_TYPE = "assets"
+
+    def __init__(self, service_package_name, name, service_config, widget_config, path, title, cache_control=None, static_index_options=None):
         self.service_package_name = service_package_name
         self.name = name
         self.title = title
         self.service_config = service_config
         self.path = path
         self.widget_config = widget_config
+        # The Cache-Control header value for all files served by this widget.
+        self.cache_control = cache_control
 
         current_dir = os.path.dirname(os.path.realpath(__file__))
 
@@ -35,6 +40,11 @@ class Assets(object):
 
         self.root_path = root_path
 
+        # All files are indexed up front, so requests need not touch the filesystem
+        # to find them. Assets are also indexed by content-hashed path, which forms the
+        # asset manifest used by widgets to create long-lived asset urls.
+        self.static_index = StaticIndex(root_path, content_hashes=True, **(static_index_options or {}))
+
     def handle(self, rest_path, request_env):
         """
         This is called when a path is being handled by the server which corresponds to a
@@ -47,8 +57,8 @@ class Assets(object):
         The implementation is split into two
         """
 
-        def handler(_request_env):
+        def handler(request_env):
             # Now we can offload to the shared static file handler.
-            return handle_static_file(self.root_path, rest_path)
+            return handle_static_file(self.static_index, rest_path, request_env, self.cache_control)
 
         return handler(request_env)
@@ -0,0 +1,14 @@
+class MetricsWidget(object):
+    """
+    Serves the metrics of the widget router, at /widgets/_metrics, in the Prometheus
+    text format.
+    """
+    WIDGET_TYPE = "metrics"
+
+    def __init__(self, name, widget_support):
+        self.name = name
+        self.widget_support = widget_support
+
+    def handle(self, rest_path, request_env):
+        content = self.widget_support.render_metrics().encode('utf-8')
+        return "200 OK", "text/plain; version=0.0.4; charset=utf-8", content, [('cache-control', 'no-store')]
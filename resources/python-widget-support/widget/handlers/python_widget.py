@@ -1,14 +1,28 @@
+import hashlib
 import importlib
+import importlib.util
+import os
+import tempfile
+import threading
+import time
+import traceback
 from http import cookies
 from urllib.parse import parse_qs
 
+from widget.lib.compression import accepts_gzip, gzip_bytes, gzip_chunks
+from widget.lib.handler_utils import is_not_modified
+from widget.lib.profiling import PROFILE_MODES, profile_cpu, profile_memory
+from widget.lib.timing import RequestTiming
+
 
 class WidgetError(Exception):
     pass
 
 
 class PythonWidget(object):
-    def __init__(self, service_package_name, name, title, description, service_config, widget_config, widget_package_name, path):
+    WIDGET_TYPE = "python"
+
+    def __init__(self, service_package_name, name, title, description, service_config, widget_config, widget_package_name, path, widget_support, included=None, streaming=False, gzip_min_bytes=None, output_cache=None):
         self.service_package_name = service_package_name
         self.name = name
         self.title = title
@@ -17,8 +31,72 @@ class PythonWidget(object):
         self.widget_package_name = widget_package_name
         self.widget_config = widget_config
         self.path = path
-        self.widget_mod = importlib.import_module(f"widget.widgets.{widget_package_name}.widget")
+        self.widget_support = widget_support
+        self.included = included
+        # Whether the page is sent as it is rendered, rather than after the whole page
+        # has been rendered.
+        self.streaming = streaming
+        # Rendered pages of at least this size are compressed if the browser accepts
+        # it; None disables compression. A streamed page, whose size is not known, is
+        # always compressed.
+        self.gzip_min_bytes = gzip_min_bytes
+        # An LRUCache of rendered pages, by the widget's cache key, or None if the
+        # widget's output is not cached.
+        self.output_cache = output_cache
+        # The widget's module is imported, and its templates compiled, on the first
+        # request, or at startup if the widget is warmed up, so that the service may
+        # start without importing every widget's dependencies.
+        self.widget_mod = None
+        self.load_lock = threading.Lock()
+        # The seconds taken to import the module and compile the templates, once
+        # loaded.
+        self.load_times = None
+
+    def load(self):
+        """
+        Imports the widget's module and compiles its templates, if not already done,
+        returning the module.
+        """
+        if self.widget_mod is not None:
+            return self.widget_mod
+
+        with self.load_lock:
+            if self.widget_mod is None:
+                started = time.perf_counter()
+                widget_mod = importlib.import_module(self.get_module_name())
+                imported = time.perf_counter()
+                self.widget_support.template_registry.register(self.widget_package_name)
+                self.load_times = {
+                    'import': imported - started,
+                    'templates': time.perf_counter() - imported
+                }
+                self.widget_mod = widget_mod
+
+        return self.widget_mod
 
+    def get_module_name(self):
+        return f"widget.widgets.{self.widget_package_name}.widget"
+
+    def has_module(self):
+        """
+        Whether the widget's module can be found, without importing it, so that a
+        widget which is not loaded at startup may still be checked then.
+        """
+        try:
+            return importlib.util.find_spec(self.get_module_name()) is not None
+        except (ImportError, ValueError):
+            return False
+
+    def load_error(self, ex):
+        """
+        The response when the widget could not be loaded, e.g. as its module or one of
+        its templates has an error; the error is logged in full. Loading is tried
+        again on the next request.
+        """
+        print(f"!! Widget {self.name} could not be loaded: {ex}", flush=True)
+        traceback.print_exc()
+        message = f"The widget {self.name} could not be loaded"
+        return "500 Internal Server Error", "text/plain; charset=utf-8", message.encode('utf-8'), []
 
     def handle(self, rest_path, request_env):
         """
@@ -31,44 +109,235 @@ class PythonWidget(object):
         """
 
         def handler(request_env):
+            timing = self.get_timing(request_env)
+
+            with timing.phase('token'):
+                #
+                # Parameters are extracted from the query string; the resource_path (the
+                # path after the module name) may also carry parameterization, but that
+                # is up to the widget itself.
+                #
+                query_string = request_env.get('QUERY_STRING')
+                if query_string is None:
+                    params = {}
+                else:
+                    params = parse_qs(query_string)
+
+                #
+                # The auth token comes from the cookie, either `kbase_session`, available
+                # for services in all environments but not in prod, in which services run on
+                # kbase.us and front ends on narrative.kbase.us. In prod, the cookie
+                # 'kbase_session_backup` is used.
+                #
+                browser_cookie = request_env.get('HTTP_COOKIE') or ''
+                cookie = cookies.SimpleCookie()
+                cookie.load(browser_cookie)
+                if 'kbase_session' in cookie:
+                    token = cookie['kbase_session'].value
+                elif self.widget_config.get('deploy_environment') == 'prod' and 'kbase_session_backup' in cookie:
+                    token = cookie['kbase_session_backup'].value
+                else:
+                    token = None
+
+            if self.widget_mod is None:
+                with timing.phase('load'):
+                    try:
+                        self.load()
+                    except Exception as ex:
+                        return self.load_error(ex)
+
+            with timing.phase('construct'):
+                widget = self.widget_mod.Widget(
+                    service_package_name=self.service_package_name,
+                    widget_package_name=self.widget_package_name, 
+                    token=token, 
+                    params=params, 
+                    rest_path=rest_path, 
+                    service_config=self.service_config,
+                    widget_config=self.widget_config,
+                    widget_support=self.widget_support,
+                    included=self.included,
+                    timing=timing)
+
             #
-            # Parameters are extracted from the query string; the resource_path (the path
-            # after the module name) may also carry parameterization, but that is up to the
-            # widget itself.
+            # A widget which supplies a validator gets an ETag, so that the browser may
+            # revalidate its copy of the page. The validator usually needs just the
+            # object info, so an unchanged page costs neither fetching the object nor
+            # rendering the template.
             #
-            query_string = request_env.get('QUERY_STRING')
-            if query_string is None:
-                params = {}
+            with timing.phase('etag'):
+                etag = self.get_etag(widget)
+            if etag is None:
+                response_headers = []
             else:
-                params = parse_qs(query_string)
+                # The page depends upon the user's auth cookie, so it may only be cached
+                # by the browser, and must be revalidated each time.
+                response_headers = [('etag', f"W/{etag}"), ('cache-control', 'private, no-cache')]
+                if is_not_modified(request_env, etag, None):
+                    if self.gzip_min_bytes is not None:
+                        response_headers.append(('vary', 'Accept-Encoding'))
+                    return "304 Not Modified", "text/html; charset=utf-8", b'', response_headers
 
-            #
-            # The auth token comes from the cookie, either `kbase_session`, available
-            # for services in all environments but not in prod, in which services run on
-            # kbase.us and front ends on narrative.kbase.us. In prod, the cookie
-            # 'kbase_session_backup` is used.
-            #
-            browser_cookie = request_env.get('HTTP_COOKIE') or ''
-            cookie = cookies.SimpleCookie()
-            cookie.load(browser_cookie)
-            if 'kbase_session' in cookie:
-                token = cookie['kbase_session'].value
-            elif self.widget_config.get('deploy_environment') == 'prod' and 'kbase_session_backup' in cookie:
-                token = cookie['kbase_session_backup'].value
+            with timing.phase('cache_key'):
+                cache_key = self.get_cache_key(widget)
+            if cache_key is not None:
+                return self.render_cached(widget, cache_key, request_env, response_headers)
+
+            if self.streaming:
+                content = widget.render_stream()
             else:
-                token = None
+                content = widget.render()
+            if widget.failed:
+                # An error page does not get the ETag, so it is not kept by the browser.
+                return self.respond(content, request_env)
 
-            widget = self.widget_mod.Widget(
-                service_package_name=self.service_package_name,
-                widget_package_name=self.widget_package_name, 
-                token=token, 
-                params=params, 
-                rest_path=rest_path, 
-                service_config=self.service_config,
-                widget_config=self.widget_config)
+            return self.respond(content, request_env, response_headers=response_headers)
 
+        profile_mode = self.get_profile_mode(request_env)
+        if profile_mode is not None:
+            return self.profile(profile_mode, handler, request_env)
+
+        return handler(request_env)
+
+    def get_profile_mode(self, request_env):
+        """
+        The profile requested with the "_profile" query param, which is honored only
+        in DEVELOPMENT mode.
+        """
+        if self.widget_config.get('runtime_mode') != "DEVELOPMENT":
+            return None
+        query_string = request_env.get('QUERY_STRING')
+        if query_string is None:
+            return None
+        profile_modes = parse_qs(query_string).get('_profile')
+        if profile_modes is None:
+            return None
+        return profile_modes[0]
+
+    def profile(self, profile_mode, handler, request_env):
+        """
+        Handles the request under a CPU ("cpu") or memory ("mem") profiler, responding
+        with the profile report rather than the page. Reports are also saved, in the
+        "profiling.report_dir" setting or the temp directory, for other tools.
+        """
+        if profile_mode not in PROFILE_MODES:
+            message = f"Unknown profile \"{profile_mode}\"; expected one of {', '.join(PROFILE_MODES)}"
+            return "400 Bad Request", "text/plain; charset=utf-8", message.encode('utf-8'), []
+
+        def call():
+            content = handler(request_env)[2]
+            # A streamed page is rendered as it is sent, so it is rendered in full here
+            # to be included in the profile.
+            if not isinstance(content, bytes):
+                b''.join(content)
+
+        report_dir = self.widget_support.get_setting(
+            'profiling.report_dir',
+            os.path.join(tempfile.gettempdir(), 'widget-profiles')
+        )
+        if profile_mode == 'cpu':
+            report = profile_cpu(call, self.name, report_dir)
+        else:
+            report = profile_memory(call, self.name, report_dir)
+
+        return "200 OK", "text/plain; charset=utf-8", report.encode('utf-8'), [('cache-control', 'no-store')]
+
+    def get_timing(self, request_env):
+        """
+        The timing for the request, which is provided by the router; a request
+        handled directly is timed on its own.
+        """
+        timing = request_env.get('widget.timing')
+        if timing is None:
+            timing = RequestTiming()
+            request_env['widget.timing'] = timing
+        return timing
+
+    def get_etag(self, widget):
+        """
+        The entity tag for the widget's page, from the widget's validator, the service
+        version and the templates' modification time, or None if the widget has no
+        validator.
+
+        ETags are not used in DEVELOPMENT mode, in which assets, and so the asset urls
+        in the page, may change without any of these changing.
+        """
+        if self.widget_config.get('runtime_mode') == "DEVELOPMENT":
+            return None
+        try:
+            validator = widget.validator()
+        except Exception:
+            return None
+        if validator is None:
+            return None
+
+        version = (
+            validator,
+            self.widget_support.service_instance_hash,
+            self.widget_support.template_registry.get_templates_mtime(self.widget_package_name)
+        )
+        digest = hashlib.sha256(repr(version).encode('utf-8')).hexdigest()
+        return f'"{digest[:32]}"'
+
+    def get_cache_key(self, widget):
+        """
+        The widget's cache key for this request, or None if its output is not to be
+        cached. An error determining the key, such as an inaccessible object, is left
+        to the normal render to report.
+        """
+        if self.output_cache is None:
+            return None
+        try:
+            return widget.cache_key()
+        except Exception:
+            return None
+
+    def render_cached(self, widget, cache_key, request_env, response_headers=None):
+        """
+        Responds with the cached page for the cache key, rendering and caching it
+        first if need be. The gzip variant is cached alongside, so a hit requires no
+        work other than the cache key. Error pages are not cached.
+        """
+        entry = self.output_cache.get(cache_key)
+        if entry is None:
             content = widget.render()
+            if widget.failed:
+                return self.respond(content, request_env)
 
-            return "200 OK", "text/html; charset=utf-8", content
+            gzip_content = None
+            if self.gzip_min_bytes is not None and len(content) >= self.gzip_min_bytes:
+                with self.get_timing(request_env).phase('gzip'):
+                    gzip_content = gzip_bytes(content)
 
-        return handler(request_env)
+            entry = (content, gzip_content)
+            self.output_cache.set(cache_key, entry, len(content) + len(gzip_content or b''))
+
+        content, gzip_content = entry
+        return self.respond(content, request_env, gzip_content=gzip_content, response_headers=response_headers)
+
+    def respond(self, content, request_env, gzip_content=None, response_headers=None):
+        """
+        The response for rendered content, which is either bytes or an iterable of
+        bytes chunks, compressed if the browser accepts it and compression is
+        enabled. A precompressed variant of bytes content may be given.
+        """
+        response_headers = list(response_headers or [])
+
+        if self.gzip_min_bytes is None:
+            return "200 OK", "text/html; charset=utf-8", content, response_headers
+
+        response_headers.append(('vary', 'Accept-Encoding'))
+        if accepts_gzip(request_env):
+            if gzip_content is not None:
+                content = gzip_content
+                response_headers.append(('content-encoding', 'gzip'))
+            elif isinstance(content, bytes):
+                if len(content) >= self.gzip_min_bytes:
+                    with self.get_timing(request_env).phase('gzip'):
+                        content = gzip_bytes(content)
+                    response_headers.append(('content-encoding', 'gzip'))
+            else:
+                content = gzip_chunks(content)
+                response_headers.append(('content-encoding', 'gzip'))
+
+        return "200 OK", "text/html; charset=utf-8", content, response_headers
@@ -2,6 +2,7 @@ import os
 from pathlib import Path
 
 from widget.lib.handler_utils import handle_static_file
+from widget.lib.static_index import StaticIndex
 
 #
 # Static widgets are mapped to the filesystem.
@@ -16,7 +17,9 @@ class WidgetError(Exception):
 
 
 class StaticWidget(object):
-    def __init__(self, service_package_name, name, title, description, service_config, widget_config, path):
+    WIDGET_TYPE = "static"
+
+    def __init__(self, service_package_name, name, title, description, service_config, widget_config, path, cache_control=None, static_index_options=None):
         self.service_package_name = service_package_name
         self.name = name
         self.title = title
@@ -24,6 +27,8 @@ class StaticWidget(object):
         self.service_config = service_config
         self.path = path
         self.widget_config = widget_config
+        # The Cache-Control header value for all files served by this widget.
+        self.cache_control = cache_control
 
         current_dir = os.path.dirname(os.path.realpath(__file__))
 
@@ -41,6 +46,10 @@ class StaticWidget(object):
 
         self.widget_path = widget_path
 
+        # All files are indexed up front, so requests need not touch the filesystem
+        # to find them.
+        self.static_index = StaticIndex(widget_path, **(static_index_options or {}))
+
     def handle(self, rest_path, request_env):
         """
         This is called when a path is being handled by the server which corresponds to a
@@ -53,14 +62,14 @@ class StaticWidget(object):
         The implementation is split into two
         """
 
-        def handler(_request_env):
+        def handler(request_env):
             if rest_path is None:
                 resource_path = 'index.html'
             else:
                 resource_path = rest_path
 
             # Now we can offload to the shared static file handler.
-            return handle_static_file(self.widget_path, resource_path)
+            return handle_static_file(self.static_index, resource_path, request_env, self.cache_control)
 
         return handler(request_env)
 
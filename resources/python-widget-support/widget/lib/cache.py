@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    A thread-safe, least-recently-used cache bounded by the total size, in bytes, of
+    the cached values.
+
+    The size of each value is provided by the caller, as it usually knows it more
+    cheaply and accurately than we could measure it (e.g. the Workspace object size).
+    Values are shared between all callers, so they must be treated as read-only.
+
+    If a ttl, in seconds, is given, entries also expire that long after being set.
+    """
+    def __init__(self, max_bytes, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at is not None and time.monotonic() >= expires_at:
+                del self.entries[key]
+                self.total_bytes -= size
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size):
+        # A value which could never fit is simply not cached.
+        if size > self.max_bytes:
+            return
+
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+
+        with self.lock:
+            existing = self.entries.pop(key, None)
+            if existing is not None:
+                self.total_bytes -= existing[1]
+
+            self.entries[key] = (value, size, expires_at)
+            self.total_bytes += size
+
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class TTLCache(object):
+    """
+    A thread-safe cache whose entries expire a fixed number of seconds after being
+    set. Suitable for mutable data which may be a little stale, such as workspace info.
+
+    The number of entries is bounded; when full, the oldest entry is dropped.
+    """
+    def __init__(self, ttl, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if now >= expires_at:
+                del self.entries[key]
+                self.misses += 1
+                return None
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, expires_at)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
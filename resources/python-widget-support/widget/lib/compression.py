@@ -0,0 +1,93 @@
+import hashlib
+import zlib
+
+from widget.lib.cache import LRUCache
+
+#
+# Media types worth compressing; images we serve are already compressed.
+#
+COMPRESSIBLE_MEDIA_TYPES = {
+    "text/html",
+    "text/plain",
+    "text/css",
+    "text/csv",
+    "application/javascript",
+    "application/json",
+}
+
+GZIP_LEVEL = 6
+
+#
+# Compressed content, by the hash of the uncompressed content, so that content which
+# has not changed (e.g. when a static index is rescanned) is not compressed again.
+# It is bounded, as content which has changed is never asked for again; the gzip
+# variants in use are held by the static index itself.
+#
+GZIP_CACHE = LRUCache(max_bytes=10_000_000)
+
+
+def is_compressible(media_type):
+    if media_type is None:
+        return False
+    return media_type.split(';')[0].strip() in COMPRESSIBLE_MEDIA_TYPES
+
+
+def accepts_gzip(request_env):
+    """
+    Determines whether the browser accepts a gzip response, from the Accept-Encoding
+    header; "gzip;q=0" is a refusal.
+    """
+    accept_encoding = request_env.get('HTTP_ACCEPT_ENCODING')
+    if accept_encoding is None:
+        return False
+
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() not in ('gzip', '*'):
+            continue
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+
+    return False
+
+
+def gzip_cached(content):
+    """
+    Compresses content, reusing the result for identical content.
+    """
+    content_hash = hashlib.sha256(content).hexdigest()
+    compressed = GZIP_CACHE.get(content_hash)
+    if compressed is None:
+        compressed = gzip_bytes(content)
+        GZIP_CACHE.set(content_hash, compressed, len(compressed))
+    return compressed
+
+
+def create_compressor():
+    # The wbits offset of 16 produces the gzip format; zlib writes a zero mtime, so the
+    # output depends only on the content.
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def gzip_bytes(content):
+    compressor = create_compressor()
+    return compressor.compress(content) + compressor.flush()
+
+
+def gzip_chunks(chunks):
+    """
+    Compresses an iterable of bytes chunks, such as a streaming render, as it is
+    produced. Each chunk is flushed, so the browser receives output as soon as it would
+    have without compression.
+    """
+    compressor = create_compressor()
+    for chunk in chunks:
+        compressed = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if len(compressed) > 0:
+            yield compressed
+    yield compressor.flush()
@@ -1,57 +1,314 @@
+import concurrent.futures
+import json
+import time
 import uuid
 
 import requests
-from requests.exceptions import RequestException, Timeout
+from requests.exceptions import ConnectionError, RequestException, Timeout
 
+from widget.lib.json_stream import (BoundedReader, can_stream_path, get_path,
+                                    loads, stream_result_path, too_big)
 from widget.lib.widget_error import WidgetError
+from widget.lib.widget_utils import token_identity
+
+#
+# Methods which only read, by the KBase naming conventions; calling them more than once
+# has no further effect.
+#
+READ_METHOD_PREFIXES = ('get_', 'list_')
+READ_METHODS = {'ver', 'status'}
+
+
+#
+# Errors which indicate that the service could not be reached, or could not handle the
+# call; a read call which failed with one of these may be retried.
+#
+RETRYABLE_ERRORS = {'connection-error', 'service-unavailable'}
+
+UNAVAILABLE_STATUS_CODES = {502, 503, 504}
+
+RESPONSE_CHUNK_SIZE = 65536
+
+
+def is_read_method(func_name):
+    return func_name.startswith(READ_METHOD_PREFIXES) or func_name in READ_METHODS
+
+
+def is_retryable(error):
+    return isinstance(error, WidgetError) and error.code in RETRYABLE_ERRORS
 
 
 class GenericClient(object):
-    def __init__(self, module_name, url, timeout=1000, token=None):
+    def __init__(self, module_name, url, timeout=1000, token=None, session=None, single_flight=None,
+                 retry_policy=None, upstream=None, deadline=None, hedge_executor=None,
+                 max_response_bytes=None, timing=None, metrics=None, recorder=None, replay=None):
         self.module_name = module_name
         self.url = url
         self.timeout = timeout
         self.token = token
+        # An optional requests session, typically a pooled keep-alive session from
+        # the SessionPool; without one, each call opens a new connection.
+        self.session = session
+        # An optional SingleFlight, shared by all clients, with which identical read
+        # calls made at the same time are coalesced into one.
+        self.single_flight = single_flight
+        # An optional RetryPolicy, for retrying and hedging read calls; without one,
+        # each call is made once.
+        self.retry_policy = retry_policy
+        # An optional Upstream for the url, whose circuit breaker fails calls fast
+        # while the service is down, and whose latencies determine when a call is
+        # hedged.
+        self.upstream = upstream
+        # An optional deadline, as a time.monotonic() value, such as the end of a
+        # widget's render budget; each call, including retries, must complete by
+        # then.
+        self.deadline = deadline
+        # The executor on which hedged requests are sent; hedging requires it.
+        self.hedge_executor = hedge_executor
+        # The default limit on the size of a response body; None for no limit.
+        self.max_response_bytes = max_response_bytes
+        # An optional RequestTiming, in which each request is timed as "rpc.METHOD".
+        self.timing = timing
+        # Optional Metrics, in which each request is counted and timed.
+        self.metrics = metrics
+        # An optional RpcRecorder, to which each call and its response is recorded.
+        self.recorder = recorder
+        # An optional RpcReplay, from which responses are served instead of the
+        # service.
+        self.replay = replay
+
+    def call_func(self, func_name, params, timeout=None, max_response_bytes=None, result_path=None, with_size=False):
+        """
+        Calls a JSON-RPC method, returning the result list.
+
+        If max_response_bytes is given, a response body larger than that raises a
+        WidgetError with the code "response-too-big" as soon as that is known, rather
+        than being read and parsed; otherwise the client's limit applies.
+
+        If a result path is given, a sequence of keys and indexes such as [0, "data"],
+        just that part of the result is returned; if ijson is installed, it is
+        extracted as the response is read, without building the rest of the result.
+
+        If with_size is true, the result is returned with the size, in bytes, of the
+        response body it was read from, as (result, size), so that the size need not
+        be measured again.
+
+        A read method called with the same params and token as a call already in
+        progress waits for, and returns, the result of that call; the result must
+        then be treated as read-only.
+        """
+        if self.single_flight is None or not is_read_method(func_name):
+            return self.call_with_retries(func_name, params, timeout, max_response_bytes, result_path, with_size)
+
+        key = (
+            self.url,
+            f"{self.module_name}.{func_name}",
+            json.dumps(params, sort_keys=True),
+            token_identity(self.token),
+            max_response_bytes,
+            None if result_path is None else tuple(result_path),
+            with_size
+        )
+        return self.single_flight.do(
+            key,
+            lambda: self.call_with_retries(func_name, params, timeout, max_response_bytes, result_path, with_size),
+            timeout=None if self.deadline is None else max(0, self.deadline - time.monotonic())
+        )
+
+    def call_with_retries(self, func_name, params, timeout=None, max_response_bytes=None, result_path=None, with_size=False):
+        """
+        Makes the call; a read call which fails because the service could not be
+        reached or was unavailable is retried after a backoff, within the deadline.
+        """
+        if self.retry_policy is not None and is_read_method(func_name):
+            max_retries = self.retry_policy.max_retries
+        else:
+            max_retries = 0
+
+        attempt = 0
+        while True:
+            try:
+                return self.attempt_call(func_name, params, timeout, max_response_bytes, result_path, with_size)
+            except WidgetError as werr:
+                if not is_retryable(werr) or attempt >= max_retries:
+                    raise
+                attempt += 1
+                delay = self.retry_policy.get_backoff(attempt)
+                if self.deadline is not None and time.monotonic() + delay >= self.deadline:
+                    raise
+            time.sleep(delay)
+
+    def get_attempt_timeout(self, timeout=None):
+        """
+        The timeout, in seconds, for a request: the call's timeout, or the client's,
+        but no later than the deadline.
+        """
+        timeout = (timeout or self.timeout) / 1000
+        if self.deadline is None:
+            return timeout
+
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise WidgetError(
+                title = 'Timeout Error',
+                code = 'timeout-error',
+                message = 'The time allowed for the request ran out before the call could be made'
+            )
+        return min(timeout, remaining)
+
+    def attempt_call(self, func_name, params, timeout=None, max_response_bytes=None, result_path=None, with_size=False):
+        """
+        Makes a single attempt at the call, unless the circuit breaker for the service
+        is open; the outcome is reported to the circuit breaker.
+        """
+        attempt_timeout = self.get_attempt_timeout(timeout)
+
+        breaker = None if self.upstream is None else self.upstream.breaker
+        if breaker is not None and not breaker.allow():
+            raise WidgetError(
+                title = 'Service Unavailable',
+                code = 'circuit-open',
+                message = f'Calls to {self.url} are suspended after repeated failures'
+            )
 
-    def call_func(self, func_name, params, timeout=None):
         try:
-            rpc = {
-                "version": "1.1",
-                "id": str(uuid.uuid4()),
-                "params": params,
-                "method": f"{self.module_name}.{func_name}"
-            }
-            timeout = (timeout or self.timeout) / 1000
-            header = {}
-            if self.token:
-                header['authorization'] = self.token
-            response = requests.post(self.url, json=rpc, timeout=timeout, headers=header)
+            hedge_delay = self.get_hedge_delay(func_name)
+            if hedge_delay is None:
+                result = self.send_timed(func_name, params, attempt_timeout, max_response_bytes, result_path, with_size)
+            else:
+                result = self.send_hedged(func_name, params, attempt_timeout, max_response_bytes, result_path, with_size,
+                                          hedge_delay)
+        except Exception as ex:
+            if breaker is not None:
+                # Any other error means the service is up, if not happy with us.
+                if is_retryable(ex):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            raise
+
+        if breaker is not None:
+            breaker.record_success()
+        return result
 
-            rpc_response = response.json()
+    def get_hedge_delay(self, func_name):
+        """
+        The time, in seconds, after which a read call is sent again if it has not
+        completed: the configured percentile of the method's recent latency. None if
+        hedging is not enabled, or too few calls have been made to know.
+        """
+        if (self.retry_policy is None or self.retry_policy.hedge_percentile is None or
+                self.upstream is None or self.hedge_executor is None or
+                not is_read_method(func_name)):
+            return None
+        return self.upstream.get_latency(func_name).percentile(
+            self.retry_policy.hedge_percentile,
+            self.retry_policy.hedge_min_samples
+        )
 
-            if 'error' in rpc_response:
-                print('ERROR in call', rpc_response)
+    def send_hedged(self, func_name, params, timeout, max_response_bytes, result_path, with_size, hedge_delay):
+        """
+        Sends the call and, if it has not completed after hedge_delay seconds, sends
+        it again; the first successful response is used, so a single slow server
+        does not hold up the call. The slower request is left to complete on its own.
+        """
+        def send():
+            return self.send_timed(func_name, params, timeout, max_response_bytes, result_path, with_size)
+
+        started = time.monotonic()
+        done, pending = concurrent.futures.wait([self.hedge_executor.submit(send)], timeout=hedge_delay)
+        if len(done) == 0:
+            pending.add(self.hedge_executor.submit(send))
+
+        error = None
+        while True:
+            for future in done:
+                try:
+                    return future.result()
+                except Exception as ex:
+                    error = error or ex
+
+            if len(pending) == 0:
+                raise error
+
+            remaining = max(0, timeout - (time.monotonic() - started))
+            done, pending = concurrent.futures.wait(
+                pending,
+                timeout=remaining,
+                return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            if len(done) == 0:
                 raise WidgetError(
-                    title = 'Call Error',
-                    code = 'call-error',
-                    message = str(rpc['error']['message'])
+                    title = 'Connection Error',
+                    code = 'connection-error',
+                    message = f'No response within {timeout}s'
                 )
 
-            if 'result' not in rpc_response:
-                return None
+    def send_timed(self, func_name, params, timeout, max_response_bytes=None, result_path=None, with_size=False):
+        started = time.monotonic()
+        outcome = 'ok'
+        try:
+            result = self.send_call(func_name, params, timeout, max_response_bytes, result_path, with_size)
+        except WidgetError as werr:
+            outcome = werr.code
+            raise
+        except Exception:
+            outcome = 'error'
+            raise
+        finally:
+            duration = time.monotonic() - started
+            if self.timing is not None:
+                self.timing.add(f"rpc.{func_name}", duration)
+            if self.metrics is not None:
+                labels = (('method', f"{self.module_name}.{func_name}"),)
+                self.metrics.inc('widget_rpc_requests_total', labels + (('outcome', outcome),))
+                self.metrics.observe('widget_rpc_duration_seconds', labels, duration)
+        if self.upstream is not None:
+            self.upstream.get_latency(func_name).record(time.monotonic() - started)
+        return result
 
-            result = rpc_response['result']
+    def send_call(self, func_name, params, timeout, max_response_bytes=None, result_path=None, with_size=False):
+        """
+        Sends a single request for the call; the timeout is in seconds. When
+        replaying, the recorded response is used instead.
 
-            if result is None:
-                return None
-            elif isinstance(result, list):
-                return result
+        The response is read as it arrives, and abandoned as soon as it exceeds the
+        size limit, so an oversized response is never held in memory.
+        """
+        try:
+            rpc = {
+                "version": "1.1",
+                "id": str(uuid.uuid4()),
+                "params": params,
+                "method": f"{self.module_name}.{func_name}"
+            }
+            if self.replay is not None:
+                response = self.replay.get_response(rpc['method'], params, self.token)
             else:
-                raise WidgetError(
-                    title = 'Incorrect Result Error',
-                    code = 'incorrect-result-error',
-                    message = 'The result is not a list or null'
-                )
+                header = {}
+                if self.token:
+                    header['authorization'] = self.token
+                http = self.session or requests
+                started = time.monotonic()
+                response = http.post(self.url, json=rpc, timeout=timeout, headers=header, stream=True)
+                if self.recorder is not None:
+                    response = self.recorder.record(
+                        rpc['method'], params, self.token, response, started,
+                        max_bytes=self.max_response_bytes if max_response_bytes is None else max_response_bytes
+                    )
+
+            # Closing a response which has not been read to the end discards the
+            # connection rather than returning it to the pool.
+            try:
+                if response.status_code in UNAVAILABLE_STATUS_CODES:
+                    raise WidgetError(
+                        title = 'Service Unavailable',
+                        code = 'service-unavailable',
+                        message = f'The service responded with status {response.status_code}'
+                    )
+                return self.read_result(response, max_response_bytes, result_path, with_size)
+            finally:
+                response.close()
 
         except ConnectionError as cerr:
             raise WidgetError(
@@ -71,3 +328,71 @@ class GenericClient(object):
                 code = 'request-error',
                 message = str(reqex)
             ) from reqex
+
+    def read_result(self, response, max_response_bytes=None, result_path=None, with_size=False):
+        """
+        Reads the result from a JSON-RPC response, or the part of it at the result
+        path, if given, with the number of bytes read if with_size is true.
+        """
+        if max_response_bytes is None:
+            max_response_bytes = self.max_response_bytes
+
+        # The size may be known before reading anything.
+        content_length = response.headers.get('content-length')
+        if (max_response_bytes is not None and content_length is not None and
+                content_length.isdigit() and int(content_length) > max_response_bytes):
+            raise too_big(content_length, max_response_bytes)
+
+        reader = BoundedReader(response.iter_content(RESPONSE_CHUNK_SIZE), max_response_bytes)
+        result = self.parse_result(reader, response.status_code, result_path)
+        if with_size:
+            return result, reader.size
+        return result
+
+    def parse_result(self, reader, status_code, result_path=None):
+        """
+        Parses the result, or the part of it at the result path, from the reader of a
+        JSON-RPC response body.
+        """
+        # An error response does not have the result, so is parsed whole; it is small.
+        if result_path is not None and status_code == 200 and can_stream_path(result_path):
+            return stream_result_path(reader, result_path)
+
+        try:
+            rpc_response = loads(reader.read())
+        except ValueError as verr:
+            raise WidgetError(
+                title = 'Incorrect Result Error',
+                code = 'incorrect-result-error',
+                message = f'The response is not valid JSON: {verr}'
+            ) from verr
+
+        if 'error' in rpc_response:
+            raise WidgetError(
+                title = 'Call Error',
+                code = 'call-error',
+                message = str(rpc_response['error'].get('message'))
+            )
+
+        result = rpc_response.get('result')
+
+        if result is None:
+            return None
+        elif not isinstance(result, list):
+            raise WidgetError(
+                title = 'Incorrect Result Error',
+                code = 'incorrect-result-error',
+                message = 'The result is not a list or null'
+            )
+
+        if result_path is None:
+            return result
+
+        try:
+            return get_path(result, result_path)
+        except (KeyError, IndexError, TypeError) as err:
+            raise WidgetError(
+                title = 'Incorrect Result Error',
+                code = 'incorrect-result-error',
+                message = f'The result has no value at {list(result_path)}'
+            ) from err
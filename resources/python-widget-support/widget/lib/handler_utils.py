@@ -1,9 +1,14 @@
+from email.utils import parsedate_to_datetime
+
+from widget.lib.compression import accepts_gzip
+
 MEDIA_TYPE_MAPPING = {
     "html": "text/html",
     "text": "text/plain",
     "css": "text/css",
     "js": "application/javascript",
     "json": "application/json",
+    "map": "application/json",
     "png": "image/png",
     "jpg": "image/jpg",
     "csv": "text/csv",
@@ -11,49 +16,238 @@ MEDIA_TYPE_MAPPING = {
 
 DEFAULT_MEDIA_TYPE = "application/octet-stream"
 
+# A file requested by its content-hashed path never changes.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# The size of each block read when streaming a file.
+FILE_BLOCK_SIZE = 65536
 
-def handle_static_file(container_path, resource_path):
+
+def make_etag(mtime_ns, size, encoding=None):
     """
-    Respond with the requested file within the container directory, or the appropriate
-    error response if something goes wrong.
+    A validator for a file, based on its modification time and size, as is common for
+    static file servers; it changes whenever the file is replaced or edited. An encoded
+    (e.g. gzip) variant of the file has a distinct validator.
     """
+    if encoding is not None:
+        return f'"{mtime_ns:x}-{size:x}-{encoding}"'
+    return f'"{mtime_ns:x}-{size:x}"'
 
-    #
-    if not container_path.is_dir():
-        response_status = '404 Not Found'
-        response_content_type = 'text/plain; charset=utf-8'
-        response_content = f"The container for the resource does not exist: {container_path}"
-        return (response_status, response_content_type, response_content.encode('utf-8'))
 
-    resource = container_path.joinpath(resource_path)
+def is_not_modified(request_env, etag, mtime):
+    """
+    Determines whether the browser's cached copy, as described by the conditional
+    request headers, is still current.
+
+    If-None-Match takes precedence over If-Modified-Since, as specified in RFC 9110.
+    Without an mtime, only If-None-Match is considered.
+    """
+    if_none_match = request_env.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        if if_none_match.strip() == '*':
+            return True
+        # The weak comparison is used for If-None-Match.
+        for candidate in if_none_match.split(','):
+            candidate = candidate.strip()
+            if candidate.startswith('W/'):
+                candidate = candidate[2:]
+            if candidate == etag:
+                return True
+        return False
+
+    if_modified_since = request_env.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since is not None and mtime is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since is None:
+            return False
+        # Http dates have a resolution of seconds.
+        return int(mtime) <= since.timestamp()
+
+    return False
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(range_header, size):
+    """
+    Parses a Range header for a file of the given size, returning the inclusive (start,
+    end) of the requested bytes, or None if the header is not a single byte range we
+    can honor, in which case the whole file is sent.
+
+    Raises RangeNotSatisfiable if the range lies outside of the file.
+    """
+    if not range_header.startswith('bytes='):
+        return None
+
+    range_spec = range_header[len('bytes='):].strip()
+
+    # Multiple ranges are allowed to be answered with the whole file.
+    if ',' in range_spec:
+        return None
+
+    start_text, separator, end_text = range_spec.partition('-')
+    if separator != '-':
+        return None
+
+    try:
+        if start_text == '':
+            # A suffix range, i.e. the last N bytes.
+            suffix_length = int(end_text)
+            if suffix_length <= 0:
+                raise RangeNotSatisfiable()
+            start = max(0, size - suffix_length)
+            end = size - 1
+        else:
+            start = int(start_text)
+            end = size - 1 if end_text == '' else min(int(end_text), size - 1)
+            if end_text != '' and int(end_text) < start:
+                return None
+    except ValueError:
+        return None
+
+    if start >= size:
+        raise RangeNotSatisfiable()
+
+    return start, end
 
-    # TODO: ensure that the full path is within container path
+
+def is_range_current(request_env, static_file):
+    """
+    A Range request may be conditional on the file being unchanged (If-Range); if it
+    has changed, the whole file is sent instead.
+    """
+    if_range = request_env.get('HTTP_IF_RANGE')
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    return if_range == static_file.etag or if_range == static_file.last_modified
+
+
+def read_file_chunks(path, start, length):
+    """
+    Reads part of a file in blocks, so that only one block is in memory at a time.
+    """
+    with open(path, 'rb') as fin:
+        fin.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = fin.read(min(FILE_BLOCK_SIZE, remaining))
+            if len(chunk) == 0:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_body(static_file, request_env):
+    """
+    A response body for a whole file. If the WSGI server provides a file wrapper, it is
+    used, as it may send the file directly from the kernel (sendfile); otherwise the
+    file is read in blocks.
+    """
+    file_wrapper = request_env.get('wsgi.file_wrapper')
+    if file_wrapper is not None:
+        return file_wrapper(open(static_file.path, 'rb'), FILE_BLOCK_SIZE)
+    return read_file_chunks(static_file.path, 0, static_file.size)
+
+
+def handle_static_file(static_index, resource_path, request_env=None, cache_control=None):
+    """
+    Respond with the requested file from the static file index of the container
+    directory, or the appropriate error response if something goes wrong.
+
+    Successful responses carry an ETag and Last-Modified, and the given Cache-Control,
+    or, if the file was requested by its content-hashed path, a long-lived immutable
+    Cache-Control; a conditional request for an unchanged file is answered with 304 Not Modified and
+    no content, without reading the file.
+    """
+    request_env = request_env or {}
+
+    # Only files within the container directory are indexed, so a path outside of it
+    # is never found.
+    static_file = static_index.get(resource_path)
 
     # Now we we can ensure the requested resource exists.
-    if not resource.is_file():
+    if static_file is None:
         response_status = '404 Not Found'
         response_content_type = 'text/plain; charset=utf-8'
         response_content = f"The file was not found: {resource_path}"
-        return (response_status, response_content_type, response_content.encode('utf-8'))
+        return (response_status, response_content_type, response_content.encode('utf-8'), [])
 
     # Get the extension, media type, return 415 if not supported:
-    if resource.suffix == '':
+    if static_file.extension is None:
         response_status = '404 Not Found'
         response_content_type = 'text/plain; charset=utf-8'
         response_content = "The requested resource must have an extension to serve it"
-        return (response_status, response_content_type, response_content.encode('utf-8'))
+        return (response_status, response_content_type, response_content.encode('utf-8'), [])
 
-    extension = resource.suffix[1:]
-    response_content_type = MEDIA_TYPE_MAPPING.get(extension)
+    response_content_type = static_file.media_type
 
     if response_content_type is None:
         response_status = '415 Unsupported Media Type'
         response_content_type = 'text/plain; charset=utf-8'
-        response_content = f"The requested resource with extension {extension} is not supported"
-        return (response_status, response_content_type, response_content.encode('utf-8'))
+        response_content = f"The requested resource with extension {static_file.extension} is not supported"
+        return (response_status, response_content_type, response_content.encode('utf-8'), [])
+
+    # A single byte range of the file may be requested, e.g. to resume a download.
+    byte_range = None
+    range_header = request_env.get('HTTP_RANGE')
+    if range_header is not None and is_range_current(request_env, static_file):
+        try:
+            byte_range = parse_range(range_header, static_file.size)
+        except RangeNotSatisfiable:
+            response_status = '416 Range Not Satisfiable'
+            response_content_type = 'text/plain; charset=utf-8'
+            response_content = f"The requested range is not satisfiable: {range_header}"
+            return (response_status, response_content_type, response_content.encode('utf-8'),
+                    [('content-range', f'bytes */{static_file.size}')])
+
+    # The gzip variant is used if there is one and the browser accepts it; ranges
+    # always refer to the file itself.
+    use_gzip = (byte_range is None and static_file.gzip_content is not None and
+                accepts_gzip(request_env))
+    etag = static_file.gzip_etag if use_gzip else static_file.etag
+
+    if resource_path == static_file.hashed_path:
+        cache_control = IMMUTABLE_CACHE_CONTROL
+
+    response_headers = [
+        ('etag', etag),
+        ('last-modified', static_file.last_modified),
+        ('accept-ranges', 'bytes')
+    ]
+    if cache_control is not None:
+        response_headers.append(('cache-control', cache_control))
+    if static_file.compressible:
+        response_headers.append(('vary', 'Accept-Encoding'))
+
+    if is_not_modified(request_env, etag, static_file.mtime):
+        return ('304 Not Modified', response_content_type, b'', response_headers)
+
+    if byte_range is not None:
+        start, end = byte_range
+        response_headers.append(('content-range', f'bytes {start}-{end}/{static_file.size}'))
+        if static_file.content is not None:
+            response_content = static_file.content[start:end + 1]
+        else:
+            response_content = read_file_chunks(static_file.path, start, end - start + 1)
+            response_headers.append(('content-length', str(end - start + 1)))
+        return ('206 Partial Content', response_content_type, response_content, response_headers)
 
-    response_content = resource.read_bytes()
+    if use_gzip:
+        response_headers.append(('content-encoding', 'gzip'))
+        response_content = static_file.gzip_content
+    elif static_file.content is not None:
+        response_content = static_file.content
+    else:
+        # Larger files are streamed, so memory use does not depend on the file size.
+        response_content = file_body(static_file, request_env)
+        response_headers.append(('content-length', str(static_file.size)))
 
     response_status = '200 OK'
 
-    return (response_status, response_content_type, response_content)
+    return (response_status, response_content_type, response_content, response_headers)
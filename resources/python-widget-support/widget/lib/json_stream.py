@@ -0,0 +1,129 @@
+import json
+
+from widget.lib.widget_error import WidgetError
+
+#
+# Faster JSON decoders are used if installed; none are required.
+#
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+#
+# With ijson installed, part of a response may be extracted as it is read, without
+# building the rest of it.
+#
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+def loads(content):
+    """
+    Decodes JSON bytes with the fastest decoder available.
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    if ujson is not None:
+        return ujson.loads(content)
+    return json.loads(content.decode('utf-8'))
+
+
+def too_big(size, max_bytes):
+    return WidgetError(
+        title = 'Response Too Big',
+        code = 'response-too-big',
+        message = f'The response size {size} exceeds the limit of {max_bytes}'
+    )
+
+
+class BoundedReader(object):
+    """
+    A file-like reader over an iterable of bytes chunks, such as a streamed response
+    body, which raises a "response-too-big" WidgetError as soon as more than
+    max_bytes have been read, rather than after the whole body has been received.
+    """
+    def __init__(self, chunks, max_bytes=None):
+        self.chunks = iter(chunks)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.buffer = b''
+
+    def next_chunk(self):
+        for chunk in self.chunks:
+            if len(chunk) == 0:
+                continue
+            self.size += len(chunk)
+            if self.max_bytes is not None and self.size > self.max_bytes:
+                raise too_big(f'at least {self.size}', self.max_bytes)
+            return chunk
+        return None
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            chunks = [self.buffer]
+            self.buffer = b''
+            chunk = self.next_chunk()
+            while chunk is not None:
+                chunks.append(chunk)
+                chunk = self.next_chunk()
+            return b''.join(chunks)
+
+        while len(self.buffer) < size:
+            chunk = self.next_chunk()
+            if chunk is None:
+                break
+            self.buffer += chunk
+
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return data
+
+
+def get_path(value, path):
+    """
+    Gets the part of a decoded value at a path, a sequence of dict keys and list
+    indexes, e.g. [0, "data"].
+    """
+    for step in path:
+        value = value[step]
+    return value
+
+
+def can_stream_path(path):
+    """
+    Whether the part of a JSON-RPC result at a path can be extracted as the response
+    is read. ijson prefixes do not address list elements by index, so only the first
+    element of a list may be selected.
+    """
+    return ijson is not None and all(step == 0 for step in path if isinstance(step, int))
+
+
+def stream_result_path(reader, path):
+    """
+    Extracts the part of a JSON-RPC response's result at a path as the response is
+    read, building only that part. Invalid JSON raises the same WidgetError as when
+    the response is parsed whole.
+    """
+    prefix = 'result' + ''.join('.item' if isinstance(step, int) else f'.{step}' for step in path)
+    try:
+        for value in ijson.items(reader, prefix, use_float=True):
+            return value
+    except ijson.JSONError as jerr:
+        raise WidgetError(
+            title = 'Incorrect Result Error',
+            code = 'incorrect-result-error',
+            message = f'The response is not valid JSON: {jerr}'
+        ) from jerr
+    raise WidgetError(
+        title = 'Incorrect Result Error',
+        code = 'incorrect-result-error',
+        message = f'The result has no value at {prefix}'
+    )
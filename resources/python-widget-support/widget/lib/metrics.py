@@ -0,0 +1,178 @@
+import threading
+import weakref
+
+#
+# The upper bounds, in seconds, of the latency histogram buckets, as commonly used by
+# Prometheus clients.
+#
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+#
+# The metrics collected, by name: their type and help text.
+#
+METRICS = {
+    'widget_requests_total': ('counter', 'Widget requests, by widget, type and status.'),
+    'widget_request_duration_seconds': ('histogram', 'Time to handle widget requests, including sending streamed content.'),
+    'widget_response_bytes_total': ('counter', 'Bytes sent in widget responses.'),
+    'widget_rpc_requests_total': ('counter', 'Requests to KBase services, by method and outcome.'),
+    'widget_rpc_duration_seconds': ('histogram', 'Time taken by requests to KBase services.'),
+}
+
+
+def format_labels(labels):
+    if len(labels) == 0:
+        return ''
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class ShardHolder(object):
+    """
+    Holds a thread's shard in its thread-local storage; it is discarded when the
+    thread ends, which retires the shard.
+    """
+    def __init__(self, shard):
+        self.shard = shard
+
+
+def add_shard(total, shard):
+    """
+    Adds the values of a shard to a total, which has the same form.
+    """
+    counters = total['counters']
+    for key, value in list(shard['counters'].items()):
+        counters[key] = counters.get(key, 0) + value
+    histograms = total['histograms']
+    for key, histogram in list(shard['histograms'].items()):
+        existing = histograms.get(key)
+        if existing is None:
+            histograms[key] = list(histogram)
+        else:
+            histograms[key] = [a + b for a, b in zip(existing, histogram)]
+
+
+class Metrics(object):
+    """
+    Counters and histograms describing the widget requests handled by this process,
+    rendered in the Prometheus text format.
+
+    Recording must cost as little as possible, as it happens several times for each
+    request. Each thread accumulates into its own shard, which only it writes, so no
+    lock is taken other than when a thread records its first value; the shards are
+    added together when the metrics are collected, which may see a value still being
+    recorded, but nothing is lost.
+
+    Servers may run each request on a new thread, so when a thread ends its shard is
+    added to the retired total and dropped, keeping the number of shards to the number
+    of live threads.
+    """
+    def __init__(self):
+        self.shards = []
+        self.retired = {'counters': {}, 'histograms': {}}
+        self.shards_lock = threading.Lock()
+        self.local = threading.local()
+
+    def get_shard(self):
+        holder = getattr(self.local, 'holder', None)
+        if holder is None:
+            shard = {'counters': {}, 'histograms': {}}
+            holder = ShardHolder(shard)
+            self.local.holder = holder
+            with self.shards_lock:
+                self.shards.append(shard)
+            weakref.finalize(holder, self.retire, shard)
+        return holder.shard
+
+    def retire(self, shard):
+        with self.shards_lock:
+            add_shard(self.retired, shard)
+            self.shards = [other for other in self.shards if other is not shard]
+
+    def inc(self, name, labels, value=1):
+        """
+        Adds to a counter; labels is a tuple of (name, value) pairs.
+        """
+        counters = self.get_shard()['counters']
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        """
+        Records a value, such as a duration in seconds, in a histogram.
+        """
+        histograms = self.get_shard()['histograms']
+        key = (name, labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            # A count per bucket, then the sum and count of all values.
+            histogram = [0] * (len(DURATION_BUCKETS) + 2)
+            histograms[key] = histogram
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                histogram[index] += 1
+                break
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    def collect(self):
+        """
+        The totals of all shards: a dict of counters and a dict of histograms, each by
+        (name, labels).
+        """
+        total = {'counters': {}, 'histograms': {}}
+        with self.shards_lock:
+            add_shard(total, self.retired)
+            shards = list(self.shards)
+
+        for shard in shards:
+            add_shard(total, shard)
+        counters = total['counters']
+        histograms = total['histograms']
+        return counters, histograms
+
+    def render(self, sampled=None):
+        """
+        The metrics in the Prometheus text exposition format.
+
+        Sampled metrics are those kept elsewhere and read at collection time, such as
+        cache statistics: a list of (name, type, help, samples), where samples is a
+        list of (labels, value).
+        """
+        counters, histograms = self.collect()
+        lines = []
+
+        for name, (metric_type, help_text) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if metric_type == 'counter':
+                for (metric_name, labels), value in sorted(counters.items(), key=repr):
+                    if metric_name == name:
+                        lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+            else:
+                for (metric_name, labels), histogram in sorted(histograms.items(), key=repr):
+                    if metric_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(DURATION_BUCKETS, histogram):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {histogram[-1]}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {format_value(float(histogram[-2]))}")
+                    lines.append(f"{name}_count{format_labels(labels)} {histogram[-1]}")
+
+        for name, metric_type, help_text, samples in sampled or []:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+
+        return '\n'.join(lines) + '\n'
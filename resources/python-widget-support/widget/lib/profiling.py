@@ -0,0 +1,142 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+#
+# Profiles of widget requests, available in DEVELOPMENT mode with the "_profile" query
+# param. Each produces a plain text report, and saves files for other tools in the
+# report directory.
+#
+
+PROFILE_MODES = ('cpu', 'mem')
+
+# The number of functions or allocation sites listed in a report.
+REPORT_LIMIT = 40
+
+
+class StackSampler(object):
+    """
+    Samples the stack of a thread at a regular interval, counting identical stacks,
+    for a flame graph. cProfile records only callers and callees, not whole stacks.
+    """
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='widget-profiler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        """
+        The sampled stacks in the "collapsed" format read by flamegraph.pl and
+        speedscope: one line per stack, with frames separated by ";" and the count.
+        """
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def get_report_path(report_dir, name):
+    """
+    The path, without an extension, for the files of a report.
+    """
+    os.makedirs(report_dir, exist_ok=True)
+    now = time.time()
+    timestamp = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{int(now * 1000) % 1000:03d}"
+    return os.path.join(report_dir, f"{name}-{timestamp}")
+
+
+def profile_cpu(call, name, report_dir):
+    """
+    Runs the call under cProfile and a stack sampler, returning the text report. The
+    pstats data (e.g. for snakeviz) and collapsed stacks are saved in the report
+    directory.
+    """
+    profiler = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident())
+
+    sampler.start()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        call()
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - started
+        sampler.stop()
+
+    report_path = get_report_path(report_dir, name)
+    pstats_path = f"{report_path}.pstats"
+    profiler.dump_stats(pstats_path)
+    collapsed_path = f"{report_path}.collapsed"
+    with open(collapsed_path, 'w', encoding='utf-8') as fout:
+        fout.write(sampler.collapsed())
+
+    output = io.StringIO()
+    stats = pstats.Stats(profiler, stream=output)
+    stats.sort_stats('cumulative').print_stats(REPORT_LIMIT)
+
+    return '\n'.join([
+        f"CPU profile of {name}: {elapsed * 1000:.1f}ms",
+        f"pstats: {pstats_path}",
+        f"collapsed stacks: {collapsed_path}",
+        '',
+        output.getvalue()
+    ])
+
+
+def profile_memory(call, name, report_dir):
+    """
+    Runs the call with tracemalloc, returning a text report of the peak memory and
+    the sites which allocated the most memory still held at the end of the call. The
+    snapshot is saved in the report directory.
+
+    Memory allocated by other requests at the same time is included too.
+    """
+    tracemalloc.start(25)
+    try:
+        call()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ])
+
+    snapshot_path = f"{get_report_path(report_dir, name)}.tracemalloc"
+    snapshot.dump(snapshot_path)
+
+    lines = [
+        f"Memory profile of {name}: {current / 1024:.1f}KiB held, {peak / 1024:.1f}KiB peak",
+        f"snapshot: {snapshot_path}",
+        '',
+    ]
+    for statistic in snapshot.statistics('lineno')[:REPORT_LIMIT]:
+        lines.append(str(statistic))
+    return '\n'.join(lines) + '\n'
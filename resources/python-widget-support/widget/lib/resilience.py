@@ -0,0 +1,140 @@
+import random
+import threading
+import time
+from collections import deque
+
+
+class RetryPolicy(object):
+    """
+    How calls to KBase services are retried and hedged; shared by all clients.
+
+    Only read methods are retried or hedged, as only they may be safely repeated.
+    Delays are in milliseconds.
+    """
+    def __init__(self, max_retries=2, backoff=100, max_backoff=2000, hedge_percentile=None, hedge_min_samples=20):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # The latency percentile of previous calls of the same method after which a
+        # second, hedged, request is sent; None disables hedging.
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+
+    def get_backoff(self, attempt):
+        """
+        The delay, in seconds, before the given retry (1 for the first), with "full
+        jitter", so that clients which failed together do not retry together.
+        """
+        ceiling = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return random.uniform(0, ceiling) / 1000
+
+
+class CircuitBreaker(object):
+    """
+    Fails calls fast, without waiting for a timeout, when a service appears to be
+    down.
+
+    After failure_threshold consecutive failures the circuit opens, and calls are
+    refused. After reset_timeout seconds a single trial call is allowed through; if it
+    succeeds the circuit closes again, otherwise it stays open for another period.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class LatencyTracker(object):
+    """
+    The durations, in seconds, of the most recent calls of a method.
+    """
+    def __init__(self, window=200):
+        self.durations = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, duration):
+        with self.lock:
+            self.durations.append(duration)
+
+    def percentile(self, percentile, min_samples=1):
+        """
+        The given percentile of the recent durations, or None if there are fewer than
+        min_samples of them.
+        """
+        with self.lock:
+            durations = sorted(self.durations)
+        if len(durations) < max(1, min_samples):
+            return None
+        index = min(len(durations) - 1, int(len(durations) * percentile / 100))
+        return durations[index]
+
+
+class Upstream(object):
+    """
+    What we know about a service, by its url: whether it is available, and how long
+    each of its methods takes.
+    """
+    def __init__(self, url, failure_threshold=5, reset_timeout=30):
+        self.url = url
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.latencies = {}
+        self.lock = threading.Lock()
+
+    def get_latency(self, method):
+        with self.lock:
+            latency = self.latencies.get(method)
+            if latency is None:
+                latency = LatencyTracker()
+                self.latencies[method] = latency
+            return latency
+
+
+class Upstreams(object):
+    """
+    Process-wide registry of the services called by widgets.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.upstreams = {}
+        self.lock = threading.Lock()
+
+    def list(self):
+        with self.lock:
+            return list(self.upstreams.values())
+
+    def get(self, url):
+        with self.lock:
+            upstream = self.upstreams.get(url)
+            if upstream is None:
+                upstream = Upstream(url, self.failure_threshold, self.reset_timeout)
+                self.upstreams[url] = upstream
+            return upstream
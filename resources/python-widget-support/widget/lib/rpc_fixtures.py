@@ -0,0 +1,139 @@
+import gzip
+import json
+import threading
+import time
+
+from widget.lib.generic_client import RESPONSE_CHUNK_SIZE
+from widget.lib.json_stream import BoundedReader
+from widget.lib.widget_error import WidgetError
+
+#
+# Recorded service calls, with which widgets may be run and benchmarked against real
+# data without any network.
+#
+# A fixture file is gzip compressed JSON lines, one per call, with the method, params,
+# response status, response body and duration. The auth token is never recorded: it is
+# sent only in a header, which is not kept, and is replaced with a placeholder wherever
+# it appears in the params or response.
+#
+
+TOKEN_PLACEHOLDER = '<token>'
+
+# Replay latency which reproduces the duration of each recorded call.
+RECORDED_LATENCY = 'recorded'
+
+
+def scrub(text, token):
+    if not token:
+        return text
+    return text.replace(token, TOKEN_PLACEHOLDER)
+
+
+def get_call_key(method, params, token):
+    """
+    The key by which a recorded call is found: the method and params, with the token
+    scrubbed so that a call made by any user matches.
+    """
+    return method, scrub(json.dumps(params, sort_keys=True), token)
+
+
+class RecordedResponse(object):
+    """
+    A response which has already been read, in place of a requests response.
+    """
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {'content-length': str(len(content))}
+
+    def iter_content(self, chunk_size):
+        for offset in range(0, len(self.content), chunk_size):
+            yield self.content[offset:offset + chunk_size]
+
+    def close(self):
+        pass
+
+
+class RpcRecorder(object):
+    """
+    Appends the calls made by clients to a fixture file, which may be shared by
+    several processes.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def record(self, method, params, token, response, started, max_bytes=None):
+        """
+        Reads the whole of a response and records the call, returning a response to
+        use in its place. A response larger than max_bytes is abandoned, as the client
+        would, and not recorded.
+        """
+        try:
+            content = BoundedReader(response.iter_content(RESPONSE_CHUNK_SIZE), max_bytes).read()
+        finally:
+            response.close()
+        duration = time.monotonic() - started
+        record = {
+            'method': method,
+            'params': json.loads(scrub(json.dumps(params), token)),
+            'status': response.status_code,
+            'duration': round(duration, 4),
+            'body': scrub(content.decode('utf-8', errors='replace'), token)
+        }
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+        with self.lock:
+            # Each append is a complete gzip member; a file of several members is read
+            # as one.
+            with gzip.open(self.path, 'ab') as fout:
+                fout.write(line)
+        return RecordedResponse(response.status_code, content)
+
+
+class RpcReplay(object):
+    """
+    Serves responses from a fixture file in place of the services.
+
+    Calls are found by method and params. A call recorded more than once is answered
+    with each response in turn, and then with the last one, so that replay is
+    deterministic. Latency, in milliseconds, may be added to each call, or the
+    duration of each recorded call reproduced with "recorded".
+    """
+    def __init__(self, path, latency=None):
+        self.path = path
+        self.latency = latency
+        self.calls = {}
+        self.served = {}
+        self.lock = threading.Lock()
+        with gzip.open(path, 'rt', encoding='utf-8') as fin:
+            for line in fin:
+                if line.strip() == '':
+                    continue
+                record = json.loads(line)
+                key = get_call_key(record['method'], record['params'], None)
+                self.calls.setdefault(key, []).append(record)
+
+    def get_response(self, method, params, token):
+        key = get_call_key(method, params, token)
+        with self.lock:
+            records = self.calls.get(key)
+            if records is None:
+                record = None
+            else:
+                index = self.served.get(key, 0)
+                self.served[key] = index + 1
+                record = records[min(index, len(records) - 1)]
+
+        if record is None:
+            raise WidgetError(
+                title = 'Replay Error',
+                code = 'replay-missing-call',
+                message = f'No call to {method} with these params was recorded in {self.path}'
+            )
+
+        if self.latency == RECORDED_LATENCY:
+            time.sleep(record['duration'])
+        elif self.latency:
+            time.sleep(self.latency / 1000)
+
+        return RecordedResponse(record['status'], record['body'].encode('utf-8'))
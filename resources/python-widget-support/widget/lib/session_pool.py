@@ -0,0 +1,71 @@
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class SessionPool(object):
+    """
+    Keep-alive http sessions, one per service url, shared by all requests and widgets.
+
+    Each session mounts an adapter with a bounded, thread-safe urllib3 connection pool,
+    so that calls to the same service (e.g. the Workspace) reuse open TCP+TLS
+    connections rather than paying for a new handshake on each call.
+
+    As a session serves the calls of every user, it keeps no cookies; and it makes
+    no retries of its own, which are left to the client's RetryPolicy, so that retries
+    of a call are counted and delayed in one place.
+
+    A session which has not been used for longer than the idle timeout is closed and
+    replaced on next use, as the server (or a proxy) will likely have dropped its
+    connections by then.
+    """
+    def __init__(self, pool_size=10, idle_timeout=60):
+        self.pool_size = pool_size
+        # In seconds
+        self.idle_timeout = idle_timeout
+
+        # url -> [session, last used time]
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def create_session(self):
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            max_retries=0
+        )
+        session = requests.Session()
+        # Cookies set by a service in response to one user's call must not be sent
+        # with another's.
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def get_session(self, url):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.sessions.get(url)
+            if entry is not None:
+                session, last_used = entry
+                if now - last_used > self.idle_timeout:
+                    session.close()
+                    entry = None
+
+            if entry is None:
+                session = self.create_session()
+                entry = [session, now]
+                self.sessions[url] = entry
+            else:
+                entry[1] = now
+
+            return entry[0]
+
+    def close(self):
+        with self.lock:
+            for session, _ in self.sessions.values():
+                session.close()
+            self.sessions = {}
@@ -0,0 +1,78 @@
+import threading
+
+from widget.lib.widget_error import WidgetError
+
+
+class Flight(object):
+    """
+    A call in progress, which other callers of the same call may wait for.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesces identical calls made at the same time, such as the bursts of identical
+    Workspace calls made when a Narrative with many viewers is opened, or a shared
+    Narrative is opened by several users at once.
+
+    The first caller for a key makes the call; callers arriving while it is in
+    progress wait for it, and all receive its result or its error. Once the call
+    completes, the next caller for the key makes a new call, so nothing is cached.
+
+    The result is shared between all of the callers, so must be treated as read-only.
+    """
+    def __init__(self):
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, call, timeout=None):
+        """
+        Makes the call, or waits for an identical call already in progress, for at
+        most timeout seconds.
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = Flight()
+                self.flights[key] = flight
+                leader = True
+                self.calls += 1
+            else:
+                leader = False
+                self.coalesced += 1
+
+        if not leader:
+            if not flight.done.wait(timeout):
+                raise WidgetError(
+                    title='Connection Error',
+                    code='connection-error',
+                    message=f'Timed out after {timeout}s waiting for an identical call in progress'
+                )
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = call()
+            return flight.result
+        except Exception as ex:
+            flight.error = ex
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'in_flight': len(self.flights),
+                'calls': self.calls,
+                'coalesced': self.coalesced,
+            }
@@ -0,0 +1,230 @@
+import hashlib
+import os
+import threading
+from email.utils import formatdate
+from pathlib import Path
+
+from widget.lib.compression import gzip_cached, is_compressible
+from widget.lib.handler_utils import MEDIA_TYPE_MAPPING, make_etag
+
+
+# The number of hex digits of the content hash used in hashed paths.
+HASH_LENGTH = 12
+
+
+def make_hashed_path(relative_path, content_hash):
+    """
+    Inserts the content hash before the file's extension, e.g. "js/lib.js" becomes
+    "js/lib.0123456789ab.js", so that the media type is unchanged.
+    """
+    head, dot, extension = relative_path.rpartition('.')
+    if dot == '' or '/' in extension:
+        return f"{relative_path}.{content_hash}"
+    return f"{head}.{content_hash}.{extension}"
+
+
+class StaticFile(object):
+    """
+    What we need to know to serve a static file, gathered once when it is indexed.
+    """
+    def __init__(self, path, relative_path, stat, cache_max_file_bytes, gzip_min_bytes=None, content_hash=False, known_hash=None):
+        self.path = path
+        self.relative_path = relative_path
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.mtime_ns = stat.st_mtime_ns
+
+        # Files without a supported extension are indexed too, so that the proper
+        # error response may be given for them.
+        if path.suffix == '':
+            self.extension = None
+            self.media_type = None
+        else:
+            self.extension = path.suffix[1:]
+            self.media_type = MEDIA_TYPE_MAPPING.get(self.extension)
+
+        self.etag = make_etag(self.mtime_ns, self.size)
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+
+        # Small files are kept in memory, larger ones are read when requested.
+        if self.media_type is not None and self.size <= cache_max_file_bytes:
+            self.content = path.read_bytes()
+        else:
+            self.content = None
+
+        # A gzip variant is prepared for in-memory text files large enough to benefit;
+        # it has its own ETag, as it is a different representation of the file.
+        self.compressible = is_compressible(self.media_type)
+        self.gzip_content = None
+        self.gzip_etag = None
+        if (gzip_min_bytes is not None and self.compressible and
+                self.content is not None and self.size >= gzip_min_bytes):
+            gzip_content = gzip_cached(self.content)
+            if len(gzip_content) < self.size:
+                self.gzip_content = gzip_content
+                self.gzip_etag = make_etag(self.mtime_ns, self.size, 'gzip')
+
+        # A content-hashed path (e.g. "js/lib.0123456789ab.js") changes whenever the
+        # content does, so it may be cached by browsers indefinitely. The hash may be
+        # known already, from the widget manifest.
+        if content_hash:
+            self.hashed_path = make_hashed_path(relative_path, known_hash or self.hash_content())
+        else:
+            self.hashed_path = None
+
+    def hash_content(self):
+        digest = hashlib.sha256()
+        if self.content is not None:
+            digest.update(self.content)
+        else:
+            with open(self.path, 'rb') as fin:
+                for block in iter(lambda: fin.read(65536), b''):
+                    digest.update(block)
+        return digest.hexdigest()[:HASH_LENGTH]
+
+    def is_stale(self):
+        try:
+            stat = self.path.stat()
+        except OSError:
+            return True
+        return stat.st_mtime_ns != self.mtime_ns or stat.st_size != self.size
+
+
+class StaticIndex(object):
+    """
+    An immutable in-memory index of the files within a directory, keyed by their
+    relative path, as it appears in a request url (e.g. "js/lib.js"), and optionally
+    also by a content-hashed path (e.g. "js/lib.0123456789ab.js").
+
+    Looking up a file is a single dict probe, with no filesystem access. As only files
+    actually within the directory are indexed, a path which attempts to escape it
+    (e.g. "../widget.py") is simply not found.
+
+    In DEVELOPMENT mode (refresh), a miss causes the directory to be scanned again if
+    any directory within it has changed, and a hit is checked against the file's
+    current mtime and size, so that added and edited files are served without a
+    restart.
+
+    The files may be given, as indexed by the widget manifest when the service was
+    built, as [relative path, size, mtime_ns, content hash], so that the files need not
+    be read, nor hashed, again. Files added to the directory since are indexed too, and
+    listed in unindexed_paths.
+    """
+    def __init__(self, root_path, cache_max_file_bytes=65536, gzip_min_bytes=None, content_hashes=False, refresh=False, files=None):
+        self.root_path = Path(root_path)
+        # Whether files are also indexed by a content-hashed path.
+        self.content_hashes = content_hashes
+        self.cache_max_file_bytes = cache_max_file_bytes
+        # Files at least this size get a precompressed gzip variant; None disables it.
+        self.gzip_min_bytes = gzip_min_bytes
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        # The mtime of each directory when the files were last scanned, so that a miss
+        # need not scan them again if none has changed.
+        self.directory_mtimes = self.get_directory_mtimes() if refresh else None
+        # The relative paths of files found in the directory but not in the given files.
+        self.unindexed_paths = []
+        if files is None:
+            self.files = self.scan()
+        else:
+            self.files = self.load(files)
+
+    def add_file(self, files, path, relative_path, stat, known_hash=None):
+        static_file = StaticFile(
+            path,
+            relative_path,
+            stat,
+            self.cache_max_file_bytes,
+            gzip_min_bytes=self.gzip_min_bytes,
+            content_hash=self.content_hashes,
+            known_hash=known_hash
+        )
+        files[relative_path] = static_file
+        if static_file.hashed_path is not None:
+            files[static_file.hashed_path] = static_file
+
+    def scan(self):
+        files = {}
+        for dir_path, _, file_names in os.walk(self.root_path):
+            for file_name in file_names:
+                path = Path(dir_path).joinpath(file_name)
+                self.add_file(files, path, path.relative_to(self.root_path).as_posix(), path.stat())
+        return files
+
+    def get_directory_mtimes(self):
+        """
+        The mtime of each directory in the tree, which changes when a file is added to,
+        removed from or renamed within it.
+        """
+        mtimes = {}
+        for dir_path, _, _ in os.walk(self.root_path):
+            try:
+                mtimes[dir_path] = os.stat(dir_path).st_mtime_ns
+            except OSError:
+                continue
+        return mtimes
+
+    def load(self, indexed_files):
+        """
+        Indexes the given files; the content hash of a file which has changed since it
+        was indexed is computed again, and a file which no longer exists is left out.
+
+        The directory is still listed, as files may have been added since they were
+        indexed, e.g. by a later step of the image build; these are indexed as a scan
+        would.
+        """
+        indexed_files = {indexed_file[0]: indexed_file for indexed_file in indexed_files}
+        files = {}
+        for dir_path, _, file_names in os.walk(self.root_path):
+            for file_name in file_names:
+                path = Path(dir_path).joinpath(file_name)
+                relative_path = path.relative_to(self.root_path).as_posix()
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                indexed_file = indexed_files.get(relative_path)
+                if indexed_file is None:
+                    self.unindexed_paths.append(relative_path)
+                    content_hash = None
+                else:
+                    _, size, mtime_ns, content_hash = indexed_file
+                    if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+                        content_hash = None
+                self.add_file(files, path, relative_path, stat, known_hash=content_hash)
+        return files
+
+    def get_hashed_path(self, relative_path):
+        """
+        The content-hashed path for a file, or None if it is not indexed, or has no
+        hashed path.
+        """
+        static_file = self.get(relative_path)
+        if static_file is None:
+            return None
+        return static_file.hashed_path
+
+    def get(self, resource_path):
+        static_file = self.files.get(resource_path)
+
+        if not self.refresh:
+            return static_file
+
+        if static_file is not None and not static_file.is_stale():
+            return static_file
+
+        with self.lock:
+            # Another request may have scanned the files while this one waited.
+            if self.files.get(resource_path) is static_file:
+                # Scanning reads, and may compress and hash, every file, so a miss,
+                # which is routine for e.g. favicon.ico or source maps, only causes a
+                # scan if a file may have been added.
+                directory_mtimes = self.get_directory_mtimes()
+                if static_file is not None or directory_mtimes != self.directory_mtimes:
+                    # A new dict replaces the old one, so concurrent lookups are not
+                    # disturbed.
+                    self.directory_mtimes = directory_mtimes
+                    self.files = self.scan()
+            static_file = self.files.get(resource_path)
+
+        return static_file
@@ -0,0 +1,96 @@
+import os
+import threading
+
+from jinja2 import ChoiceLoader, Environment, FileSystemBytecodeCache, FileSystemLoader
+
+#
+# The root of all Python widget packages, i.e. lib/widget/widgets in the service.
+#
+WIDGETS_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../widgets'))
+
+
+class TemplateRegistry(object):
+    """
+    Process-wide registry of jinja2 environments, one per widget package.
+
+    Building an environment and compiling its templates is relatively expensive, so it
+    is done once, when the widget is loaded, rather than for each request. The
+    environment caches compiled templates itself; in DEVELOPMENT mode it is created with
+    `auto_reload` so that edited templates are recompiled when their mtime changes.
+    """
+    def __init__(self, auto_reload=False, bytecode_cache_dir=None):
+        self.auto_reload = auto_reload
+
+        if bytecode_cache_dir is not None:
+            os.makedirs(bytecode_cache_dir, exist_ok=True)
+            self.bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+        else:
+            self.bytecode_cache = None
+
+        self.environments = {}
+        # The latest template modification time for each widget package, as of when
+        # its templates were compiled.
+        self.templates_mtimes = {}
+        # Widgets are loaded on their first request, so may be registered by requests
+        # at the same time; each package is compiled only once.
+        self.lock = threading.Lock()
+
+    def create_environment(self, widget_package_name):
+        # We look for templates in the top level "templates" directory, to provide
+        # shared templates, and within the widget's "templates" directory as well. The
+        # widget templates take precedence, allowing a widget to override a global
+        # template
+        #
+        # Note: For some reason, the package loader is not working. It may be the jinja2
+        # version, or the old python.
+        # Note: this of course relies up on the standard kb-sdk directory layout, as
+        # well as that established by Dynamic Service Widgets.
+        global_loader = FileSystemLoader(os.path.join(WIDGETS_PATH, 'templates'))
+        widget_loader = FileSystemLoader(
+            os.path.join(WIDGETS_PATH, widget_package_name, 'templates')
+        )
+        loader = ChoiceLoader([widget_loader, global_loader])
+        return Environment(
+            loader=loader,
+            auto_reload=self.auto_reload,
+            bytecode_cache=self.bytecode_cache
+        )
+
+    def register(self, widget_package_name):
+        """
+        Creates the environment for a widget package, and compiles all of the templates
+        available to it, so that rendering need not.
+        """
+        env = self.environments.get(widget_package_name)
+        if env is not None:
+            return env
+
+        with self.lock:
+            env = self.environments.get(widget_package_name)
+            if env is not None:
+                return env
+
+            env = self.create_environment(widget_package_name)
+            templates_mtime = 0
+            for template_name in env.list_templates(extensions=['html']):
+                template = env.get_template(template_name)
+                templates_mtime = max(templates_mtime, os.path.getmtime(template.filename))
+
+            # The mtime is set first, as the environment marks the package registered.
+            self.templates_mtimes[widget_package_name] = templates_mtime
+            self.environments[widget_package_name] = env
+        return env
+
+    def get_templates_mtime(self, widget_package_name):
+        """
+        The latest modification time of the templates available to a widget package,
+        which may be used to tell whether its rendered output may have changed.
+        """
+        self.get_environment(widget_package_name)
+        return self.templates_mtimes[widget_package_name]
+
+    def get_environment(self, widget_package_name):
+        env = self.environments.get(widget_package_name)
+        if env is None:
+            return self.register(widget_package_name)
+        return env
@@ -0,0 +1,89 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class RequestTiming(object):
+    """
+    The time spent in each phase of handling a widget request, such as building the
+    context, each kind of service call, and rendering the template.
+
+    It is reported to the browser in a Server-Timing header, where it may be seen in
+    the browser's developer tools, and logged as a single JSON line when the response
+    has been sent.
+
+    Phases may be timed from several threads, as calls may be made concurrently; a
+    phase which occurs more than once accumulates its duration and count.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, name, duration):
+        with self.lock:
+            entry = self.phases.get(name)
+            if entry is None:
+                self.phases[name] = [duration, 1]
+            else:
+                entry[0] += duration
+                entry[1] += 1
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def get_phases(self):
+        with self.lock:
+            return [(name, duration, count) for name, (duration, count) in self.phases.items()]
+
+    def server_timing(self):
+        """
+        The value of the Server-Timing header, in milliseconds, e.g.
+        'route;dur=0.1, rpc.get_object_info3;dur=35.2, total;dur=50.3'.
+        """
+        metrics = []
+        for name, duration, count in self.get_phases():
+            metric = f"{name};dur={duration * 1000:.1f}"
+            if count > 1:
+                metric += f';desc="{count}x"'
+            metrics.append(metric)
+        metrics.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ', '.join(metrics)
+
+    def log(self, **fields):
+        """
+        Prints the phases and the given fields, such as the widget and status, as a
+        single line of JSON.
+        """
+        record = {'event': 'widget-request'}
+        record.update(fields)
+        record['total_ms'] = round(self.elapsed() * 1000, 1)
+        record['phases'] = {
+            name: {'ms': round(duration * 1000, 1), 'count': count}
+            for name, duration, count in self.get_phases()
+        }
+        print(json.dumps(record), flush=True)
+
+
+def when_sent(content, callback):
+    """
+    Passes through streamed content, calling the callback with the number of bytes
+    sent once it has all been sent, or the browser has gone away.
+    """
+    size = 0
+    try:
+        for chunk in content:
+            size += len(chunk)
+            yield chunk
+    finally:
+        callback(size)
@@ -1,19 +1,28 @@
+import concurrent.futures
 import json
 import os
 import re
-
-from jinja2 import ChoiceLoader, Environment, FileSystemLoader
+import time
 
 from widget.lib.generic_client import GenericClient
+from widget.lib.timing import RequestTiming
 from widget.lib.widget_error import WidgetError
-from widget.lib.widget_utils import object_info_to_dict, workspace_info_to_dict
+from widget.lib.widget_utils import (object_info_to_dict, object_ref,
+                                     token_identity, workspace_info_to_dict)
 
 
 class WidgetBase:
     """
     Base behavior for Python Widgets
     """
-    def __init__(self, service_package_name, widget_package_name, token, params, rest_path, service_config, widget_config):
+    # The largest object, in bytes, a widget may fetch. When only some paths of an
+    # object are included, the limit applies to the projected object instead.
+    MAX_OBJECT_SIZE = 1_000_000
+
+    # The minimum size, in bytes, of each chunk of a streamed render.
+    STREAM_CHUNK_SIZE = 16_384
+
+    def __init__(self, service_package_name, widget_package_name, token, params, rest_path, service_config, widget_config, widget_support, included=None, timing=None):
         # The module name for the service (directory name, first component of service
         # package path)
         self.service_package_name = service_package_name
@@ -39,21 +48,34 @@ class WidgetBase:
         # parameterization as well, or for any purpose.
         self.rest_path = rest_path
 
-        # We look for templates in the top level "templates" directory, to provide
-        # shared templates, and within the widget's "templates" directory as well. The
-        # widget templates take precedence, allowing a widget to override a global
-        # template
-        #
-        # Note: For some reason, the package loader is not working. It may be the jinja2
-        # version, or the old python.
-        # Note: this of course relies up on the standard kb-sdk directory layout, as
-        # well as that established by Dynamic Service Widgets.
-        global_loader = FileSystemLoader("./lib/widget/widgets/templates")
-        widget_loader = FileSystemLoader(
-           f"./lib/widget/widgets/{self.widget_package_name}/templates"
-        )
-        loader = ChoiceLoader([widget_loader, global_loader])
-        self.env = Environment(loader=loader)
+        # The object paths the widget requires, as configured in widgets.yml; only these
+        # are fetched by get_object(s), unless overridden in the call.
+        self.included = included
+
+        # The widget support instance owns process-wide resources, such as the
+        # compiled templates, which are shared by all requests.
+        self.widget_support = widget_support
+
+        # The jinja2 environment for this widget's package; templates are compiled when
+        # the widgets are initialized, not per request.
+        self.env = widget_support.template_registry.get_environment(self.widget_package_name)
+
+        # All calls made to render the widget must complete by this deadline.
+        if widget_support.render_budget is None:
+            self.deadline = None
+        else:
+            self.deadline = time.monotonic() + widget_support.render_budget / 1000
+
+        # The time spent in each phase of the request, including service calls.
+        self.timing = timing if timing is not None else RequestTiming()
+
+        # Object infos fetched during this request, by ref, so that an object resolved
+        # for the cache key is not looked up again to render it.
+        self.object_infos = {}
+
+        # Set when render or render_stream has rendered an error page instead of the
+        # widget's page, so that the page is not cached or given an ETag.
+        self.failed = False
 
     def extract_params(self, url_search_params):
         """
@@ -79,7 +101,6 @@ class WidgetBase:
         params = {}
         for key, value in url_search_params.items():
             if key == 'params':
-                print('PARAMS??', json.loads(value[0]))
                 params.update(json.loads(value[0]))
             else:
                 params[key] = value[0]
@@ -104,6 +125,46 @@ class WidgetBase:
         """
         return {}
 
+    def cache_key(self):
+        """
+        To be implemented, if need be, by a widget implementation whose output may be
+        cached (see "output_cache" in widgets.yml).
+
+        Returns a hashable value which identifies the rendered output, or None if it
+        should not be cached. The key must capture everything the output depends on,
+        typically the relevant params and, via object_cache_key, the resolved object
+        version and the user's permission for it.
+        """
+        return None
+
+    def validator(self):
+        """
+        To be implemented, if need be, by a widget implementation, to allow browsers
+        to revalidate its page with If-None-Match rather than fetching it again.
+
+        Returns a hashable value which changes whenever the rendered output would, or
+        None if there is none; the service version and template modification time are
+        added to it by the router. It defaults to the cache key, which identifies the
+        output in the same way.
+        """
+        return self.cache_key()
+
+    def object_cache_key(self, ref):
+        """
+        A cache key component for an object: its absolute ref, which changes when a
+        new version is saved, and the user's permission for its workspace and the
+        workspace's modification date, which the rendered output may reflect.
+
+        The object info lookup also enforces the user's access to the object; if it
+        is not accessible, None is returned, so the output is not cached.
+        """
+        info = self.get_object_infos([ref])[0]
+        if info is None:
+            return None
+        object_info = object_info_to_dict(info)
+        workspace_info = self.get_workspace_info(self.get_workspace_client(), object_info['workspace_id'])
+        return (object_ref(object_info), workspace_info['user_permission'], workspace_info['modified_at'])
+
     def get_context(self) -> dict:
         """
         Provides a "context dict" for the template. 
@@ -119,29 +180,102 @@ class WidgetBase:
             'base_path': self.widget_config.get('base_path'),
             'asset_url': self.get_asset_url(),
             'widget_asset_url': self.get_widget_asset_url(),
+            'asset': self.asset,
+            'widget_asset': self.widget_asset,
+            'bundle': self.bundle,
         }
         context.update(self.context())
         return context
 
-    def render(self) -> str:
+    def render(self) -> bytes:
         """
-        Render the widget, returning bytes
+        Render the widget, returning bytes; an error is rendered as the error page.
+
+        This is what the router calls to render the page, so a widget may override it,
+        though most need only provide the context.
         """
         try:
+            return self.render_page()
+        except Exception as ex:
+            self.failed = True
+            return self.render_error(self.get_error_context(ex))
+
+    def render_page(self) -> bytes:
+        """
+        Render the widget's page, raising any error rather than rendering it.
+        """
+        with self.timing.phase('context'):
             context = self.get_context()
-            template = self.env.get_template("index.html")
-            return template.render(context).encode('utf-8')
-        except WidgetError as ex:
-            template = self.env.get_template("error.html")
-            return template.render({"error": ex.get_context()}).encode("utf-8")
+        with self.timing.phase('render'):
+            text = self.env.get_template("index.html").render(context)
+        with self.timing.phase('encode'):
+            return text.encode('utf-8')
+
+    def render_stream(self):
+        """
+        Render the widget, returning an iterable of bytes chunks, which may be sent to
+        the browser as they are produced rather than after the whole page is built.
+
+        The context is created before any output, so that an error creating it is
+        still rendered as an error page. An error while generating the template itself
+        can only truncate the output, as the response will have already started.
+        """
+        try:
+            return self.stream_page()
         except Exception as ex:
-            context = {
-                "title": "Error",
-                "code": "error-generating-context",
-                "message": str(ex),
-            }
-            template = self.env.get_template("error.html")
-            return template.render(context).encode("utf-8")
+            self.failed = True
+            return [self.render_error(self.get_error_context(ex))]
+
+    def stream_page(self):
+        """
+        Render the widget's page as an iterable of bytes chunks, raising any error
+        creating the context rather than rendering it.
+        """
+        with self.timing.phase('context'):
+            context = self.get_context()
+        template = self.env.get_template("index.html")
+        return self.generate(template, context)
+
+    def generate(self, template, context):
+        """
+        Generates the template output, encoded, in chunks of at least
+        STREAM_CHUNK_SIZE bytes; jinja2 itself produces many small strings.
+        """
+        buffer = []
+        buffer_size = 0
+        # The time spent generating, not including the time spent sending chunks, which
+        # is only logged, as the headers have already been sent.
+        render_time = 0
+        started = time.perf_counter()
+        for text in template.generate(context):
+            chunk = text.encode('utf-8')
+            buffer.append(chunk)
+            buffer_size += len(chunk)
+            if buffer_size >= self.STREAM_CHUNK_SIZE:
+                render_time += time.perf_counter() - started
+                yield b''.join(buffer)
+                started = time.perf_counter()
+                buffer = []
+                buffer_size = 0
+
+        render_time += time.perf_counter() - started
+        self.timing.add('render', render_time)
+
+        if buffer_size > 0:
+            yield b''.join(buffer)
+
+    def get_error_context(self, ex):
+        if isinstance(ex, WidgetError):
+            return ex.get_context()
+        return {
+            "title": "Error",
+            "code": "error-generating-context",
+            "message": str(ex),
+        }
+
+    def render_error(self, error) -> bytes:
+        template = self.env.get_template("error.html")
+        return template.render({"error": error}).encode("utf-8")
 
     def get_base_path(self):
        return self.widget_config.get('base_path')
@@ -152,28 +286,250 @@ class WidgetBase:
     def get_widget_asset_url(self):
         return os.path.join(self.widget_config.get('service_url'), 'widgets', 'assets', 'widgets', self.widget_package_name)
 
-    def get_object(self, ref, allowed_types):
-        workspace = GenericClient(
-            module_name='Workspace',
-            url = self.service_config.get('workspace-url'),
-            token = self.token,
-            timeout=10000
+    def get_client(self, module_name, url, timeout=1000):
+        """
+        Creates a client for a KBase JSON-RPC service, authorized with the current
+        user's token, and using the shared, pooled http session for the service url.
+        Identical read calls in progress at the same time are coalesced, and read
+        calls are retried as configured, within the widget's render budget.
+        """
+        return GenericClient(
+            module_name=module_name,
+            url=url,
+            token=self.token,
+            timeout=timeout,
+            session=self.widget_support.session_pool.get_session(url),
+            single_flight=self.widget_support.single_flight,
+            retry_policy=self.widget_support.retry_policy,
+            upstream=self.widget_support.upstreams.get(url),
+            deadline=self.deadline,
+            timing=self.timing,
+            metrics=self.widget_support.metrics,
+            hedge_executor=self.widget_support.hedge_executor,
+            max_response_bytes=self.widget_support.max_response_bytes,
+            recorder=self.widget_support.rpc_recorder,
+            replay=self.widget_support.rpc_replay
         )
-        params = {
-            'includeMetadata': 1,
-            'objects': [{'ref': ref}]
-        }
+
+    def call_concurrently(self, calls, timeout=None):
+        """
+        Runs independent calls (functions without arguments) at the same time on the
+        thread pool shared by all widgets, returning their results in the same order.
+
+        The calling thread takes part: it runs the first call itself, and then any
+        call which no pool thread has yet started, rather than waiting for it behind
+        the calls of other requests. So calls may themselves call call_concurrently,
+        e.g. by way of get_objects, without waiting on the pool which is running them.
+
+        The timeout, in milliseconds, is the deadline for waiting on each call run by
+        the pool, measured from when they are submitted, though no later than the end
+        of the render budget; service calls are bounded by the render budget wherever
+        they run. If a call fails, the error from the first failed call is raised.
+        """
+        if len(calls) == 0:
+            return []
+
+        executor = self.widget_support.executor
+        futures = [executor.submit(call) for call in calls[1:]]
+
+        deadline = self.deadline
+        if timeout is not None:
+            call_deadline = time.monotonic() + timeout / 1000
+            deadline = call_deadline if deadline is None else min(deadline, call_deadline)
+
+        results = []
         try:
-            object_info = object_info_to_dict(workspace.call_func('get_object_info3', [params])[0]['infos'][0])
-        except WidgetError as werr:
-            raise werr
-        except Exception as ex:
+            results.append(calls[0]())
+            for call, future in zip(calls[1:], futures):
+                # A call still queued is taken back, and run here.
+                if future.cancel():
+                    results.append(call())
+                    continue
+                remaining = None if deadline is None else max(0, deadline - time.monotonic())
+                results.append(future.result(timeout=remaining))
+        except concurrent.futures.TimeoutError as terr:
             raise WidgetError(
-                title="Error",
-                code="error-fetching-object",
-                message=str(ex)) from ex
+                title="Timeout Error",
+                code="timeout-error",
+                message="A call did not complete in the time allowed"
+            ) from terr
+        finally:
+            for future in futures:
+                future.cancel()
+
+        return results
+
+    def get_workspace_client(self):
+        return self.get_client(
+            module_name='Workspace',
+            url=self.service_config.get('workspace-url'),
+            timeout=10000
+        )
+
+    def asset(self, path):
+        """
+        The url for a shared asset, given its path within widget/assets, e.g.
+        "js/lib.js". The url contains a hash of the asset's content, so may be cached
+        by the browser indefinitely; if the asset is not in the asset manifest, the
+        plain url is returned.
+        """
+        hashed_path = None
+        if self.widget_support.assets is not None:
+            hashed_path = self.widget_support.assets.static_index.get_hashed_path(path)
+        return os.path.join(self.get_asset_url(), hashed_path or path)
+
+    def widget_asset(self, path):
+        """
+        The content-hashed url for one of this widget's own assets, given its path
+        within widget/assets/widgets/WIDGET_PACKAGE_NAME.
+        """
+        return self.asset(f"widgets/{self.widget_package_name}/{path}")
+
+    def bundle(self, entry_point):
+        """
+        The url for a Javascript entry point, e.g. "js/lib.js", as a single bundled
+        module if a bundle has been built for it (see widget/scripts/bundle_assets.py),
+        otherwise for the entry point itself.
+        """
+        head, _, extension = entry_point.rpartition('.')
+        bundle_path = f"{head}.bundle.{extension}"
+        assets = self.widget_support.assets
+        if assets is not None and assets.static_index.get(bundle_path) is not None:
+            return self.asset(bundle_path)
+        return self.asset(entry_point)
+
+    def get_object(self, ref, allowed_types, included=None):
+        """
+        Gets a single object and its workspace info, raising a WidgetError if the
+        object is not available or not one of the allowed types.
 
-        if object_info['size'] > 1_000_000:
+        If included object paths are given, or configured for the widget, only those
+        parts of the object's data are fetched (see get_objects).
+        """
+        result = self.get_objects([ref], allowed_types, included=included)[0]
+
+        if result['error'] is not None:
+            raise result['error']
+
+        return [result['object'], result['workspace_info']]
+
+    def get_objects(self, refs, allowed_types, included=None):
+        """
+        Gets several objects, and their workspace info, with a constant number of
+        Workspace calls: one get_object_info3 for all refs, then, concurrently, one
+        get_objects2 for all objects and one get_workspace_info per distinct
+        workspace.
+
+        Returns a list, in the same order as the refs, of dicts with the keys "ref",
+        "object", "workspace_info" and "error". If an object could not be provided,
+        "error" is a WidgetError describing why, and the object and workspace info are
+        None. The Workspace does not say why an object is missing or inaccessible when
+        errors are ignored, so such an object has the "object-not-found" error.
+
+        Included is a list of object paths, in the form accepted by the Workspace, e.g.
+        "/scientific_name" or "/features/[*]/id"; it defaults to the widget's "included"
+        config. When provided, only those paths are fetched, and the size limit is
+        applied to the projected object rather than the whole object, which allows
+        widgets for very large objects.
+        """
+        workspace = self.get_workspace_client()
+
+        if included is None:
+            included = self.included
+
+        infos = self.get_object_infos(refs)
+
+        results = []
+        object_infos = []
+        for ref, info in zip(refs, infos):
+            result = {'ref': ref, 'object': None, 'workspace_info': None, 'error': None}
+            results.append(result)
+
+            if info is None:
+                result['error'] = WidgetError(
+                    title="Error",
+                    code="object-not-found",
+                    message=f"The object {ref} was not found, or is not accessible")
+                object_infos.append(None)
+                continue
+
+            object_info = object_info_to_dict(info)
+            try:
+                self.check_object_info(object_info, allowed_types, check_size=included is None)
+            except WidgetError as werr:
+                result['error'] = werr
+                object_infos.append(None)
+                continue
+
+            object_infos.append(object_info)
+
+        available_infos = [object_info for object_info in object_infos if object_info is not None]
+        if len(available_infos) == 0:
+            return results
+
+        # The workspace info and the objects do not depend on each other, so are
+        # fetched at the same time. Objects often share a workspace, so each
+        # workspace's info is fetched only once.
+        workspace_ids = list(dict.fromkeys(object_info['workspace_id'] for object_info in available_infos))
+        calls = [
+            lambda workspace_id=workspace_id: self.get_workspace_info(workspace, workspace_id)
+            for workspace_id in workspace_ids
+        ]
+        calls.append(lambda: self.get_objects_data(workspace, available_infos, included))
+        *workspace_infos, data_objects = self.call_concurrently(calls, timeout=10000)
+
+        workspace_infos = dict(zip(workspace_ids, workspace_infos))
+
+        for result, object_info in zip(results, object_infos):
+            if object_info is None:
+                continue
+            data_object = data_objects.get(object_ref(object_info))
+            if data_object is None:
+                result['error'] = WidgetError(
+                    title="Error",
+                    code="object-not-found",
+                    message=f"The object {result['ref']} could not be fetched")
+                continue
+            result['object'] = data_object
+            result['workspace_info'] = workspace_infos[object_info['workspace_id']]
+
+        return results
+
+    def get_object_infos(self, refs):
+        """
+        Gets the object infos for refs with a single get_object_info3 call, in the
+        same order; the info for an object which is missing or not accessible is
+        None. Infos are remembered for the rest of the request.
+        """
+        missing_refs = [ref for ref in dict.fromkeys(refs) if ref not in self.object_infos]
+
+        if len(missing_refs) > 0:
+            # Errors are ignored so that one missing or inaccessible object does not
+            # fail the batch; its info is returned as null instead.
+            params = {
+                'includeMetadata': 1,
+                'ignoreErrors': 1,
+                'objects': [{'ref': ref} for ref in missing_refs]
+            }
+            try:
+                infos = self.get_workspace_client().call_func('get_object_info3', [params], result_path=[0, 'infos'])
+            except WidgetError as werr:
+                raise werr
+            except Exception as ex:
+                raise WidgetError(
+                    title="Error",
+                    code="error-fetching-object",
+                    message=str(ex)) from ex
+            self.object_infos.update(zip(missing_refs, infos))
+
+        return [self.object_infos[ref] for ref in refs]
+
+    def check_object_info(self, object_info, allowed_types, check_size=True):
+        """
+        Ensures that an object is suitable for a widget, raising a WidgetError if it is
+        too large or not one of the allowed types.
+        """
+        if check_size and object_info['size'] > self.MAX_OBJECT_SIZE:
             raise WidgetError(
                 title="Error",
                 code="file-too-big",
@@ -183,7 +539,6 @@ class WidgetBase:
 
         type_id_versionless = '.'.join([type_module, type_name])
 
-        # if type_module != "KBaseStructure" and type_name != "ProteinStructures":
         if type_id_versionless not in allowed_types:
             raise WidgetError(
                 title="Error",
@@ -191,14 +546,86 @@ class WidgetBase:
                 message=f"Expected an object of type {', '.join(allowed_types)}, but got {type_id_versionless} (v{type_version_major}.{type_version_minor})"
             )
 
-        workspace_id = object_info['workspace_id']
+    def get_objects_data(self, workspace, object_infos, included=None):
+        """
+        Gets the objects, with infostruct, for a list of object infos, returning a dict
+        of absolute ref to object. An object which could not be fetched is omitted. If
+        included paths are given, only those parts of each object are fetched.
+
+        The object info call is always made first, as it enforces the user's access to
+        the object, and resolves the ref to an absolute one. An object at an absolute
+        ref never changes, so the object itself may be shared between users and
+        requests.
+        """
+        object_cache = self.widget_support.object_cache
+
+        # A projected object is cached separately from the whole object, and from
+        # other projections.
+        projection = None if included is None else tuple(included)
+
+        data_objects = {}
+        missing_infos = {}
+        for object_info in object_infos:
+            absolute_ref = object_ref(object_info)
+            if absolute_ref in data_objects or absolute_ref in missing_infos:
+                continue
+            data_object = object_cache.get((absolute_ref, projection))
+            if data_object is None:
+                missing_infos[absolute_ref] = object_info
+            else:
+                data_objects[absolute_ref] = data_object
 
-        workspace_info = workspace_info_to_dict(workspace.call_func('get_workspace_info', [{"id": workspace_id}])[0])
+        if len(missing_infos) == 0:
+            return data_objects
+
+        object_specs = []
+        for absolute_ref in missing_infos.keys():
+            object_spec = {'ref': absolute_ref}
+            if included is not None:
+                object_spec['included'] = list(included)
+            object_specs.append(object_spec)
 
         params = {
-            'objects': [{'ref': ref}],
+            'objects': object_specs,
+            'ignoreErrors': 1,
             'infostruct': 1
         }
-        data_object = workspace.call_func('get_objects2', [params])[0]['data'][0]
 
-        return [data_object, workspace_info]
\ No newline at end of file
+        if included is None:
+            # Whole objects have already been checked against the size limit; the
+            # response may also carry up to as much again for the object infos and
+            # provenance.
+            max_response_bytes = sum(object_info['size'] for object_info in missing_infos.values())
+            max_response_bytes += self.MAX_OBJECT_SIZE * len(object_specs)
+        else:
+            max_response_bytes = self.MAX_OBJECT_SIZE * len(object_specs)
+
+        fetched, response_size = workspace.call_func(
+            'get_objects2', [params], max_response_bytes=max_response_bytes, result_path=[0, 'data'], with_size=True
+        )
+
+        for (absolute_ref, object_info), data_object in zip(missing_infos.items(), fetched):
+            if data_object is None:
+                continue
+            if included is None:
+                size = object_info['size']
+            else:
+                # The size of a projected object is not otherwise known; its share of
+                # the response, which was measured as it was read, stands in for it.
+                size = response_size // len(fetched)
+            object_cache.set((absolute_ref, projection), data_object, size)
+            data_objects[absolute_ref] = data_object
+
+        return data_objects
+
+    def get_workspace_info(self, workspace, workspace_id):
+        """
+        Gets the workspace info, which is briefly cached per user, as it includes the
+        user's permission and the workspace may change.
+        """
+        cache_key = (token_identity(self.token), workspace_id)
+        workspace_info = self.widget_support.workspace_info_cache.get(cache_key)
+        if workspace_info is None:
+            workspace_info = workspace_info_to_dict(workspace.call_func('get_workspace_info', [{"id": workspace_id}])[0])
+            self.widget_support.workspace_info_cache.set(cache_key, workspace_info)
+        return workspace_info
\ No newline at end of file
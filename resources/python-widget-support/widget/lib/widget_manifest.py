@@ -0,0 +1,276 @@
+"""
+Compiles the widget config, widget/widgets.yml, into a manifest,
+widget/widgets.manifest.json, which the service loads at startup instead of parsing
+the YAML.
+
+The config is validated as it is compiled, so that mistakes are found when the service is
+built rather than when it starts, and the manifest holds everything the widgets need to
+know about their files: the resolved package and path of each widget, its title, and
+an index of the files served by assets and static widgets, with their content hashes.
+
+The manifest records the digest of the config it was compiled from; if the config has
+changed since, or the manifest is missing or of another version, the YAML is used
+instead. It is compiled when widget support is added to a service, and by "make compile".
+
+Usage, from the service directory:
+
+    PYTHONPATH=lib python -m widget.lib.widget_manifest
+"""
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+
+from widget.lib.static_index import HASH_LENGTH
+from widget.lib.widget_error import WidgetError
+
+MANIFEST_VERSION = 1
+
+# The service directory, which contains lib/widget and widget/.
+SERVICE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..'))
+
+CONFIG_PATH = os.path.join(SERVICE_PATH, 'widget/widgets.yml')
+MANIFEST_PATH = os.path.join(SERVICE_PATH, 'widget/widgets.manifest.json')
+
+WIDGET_NAME_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_\-]*$')
+
+#
+# The keys allowed for each type of widget.
+#
+COMMON_KEYS = {'name', 'type', 'title', 'description'}
+WIDGET_KEYS = {
+    'assets': COMMON_KEYS | {'path', 'cache_control'},
+    'static': COMMON_KEYS | {'path', 'cache_control'},
+    'python': COMMON_KEYS | {'package', 'included', 'streaming', 'output_cache'},
+}
+
+
+def get_digest(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def get_root(widget):
+    """
+    The directory, relative to the service directory, holding a widget's files: its
+    static files, or the package of a python widget.
+    """
+    if widget['type'] == 'assets':
+        return f"widget/{widget.get('path') or widget['name']}"
+    if widget['type'] == 'static':
+        return f"widget/widgets/{widget.get('path') or widget['name']}"
+    return f"lib/widget/widgets/{widget.get('package') or widget['name']}"
+
+
+def index_files(root_path, content_hashes):
+    """
+    The files within a directory, as [relative path, size, mtime_ns, content hash], the
+    hash being as used in asset urls, or None if not wanted.
+    """
+    files = []
+    for dir_path, _, file_names in os.walk(root_path):
+        for file_name in sorted(file_names):
+            path = os.path.join(dir_path, file_name)
+            stat = os.stat(path)
+            content_hash = None
+            if content_hashes:
+                with open(path, 'rb') as fin:
+                    content_hash = get_digest(fin.read())[:HASH_LENGTH]
+            relative_path = os.path.relpath(path, root_path).replace(os.sep, '/')
+            files.append([relative_path, stat.st_size, stat.st_mtime_ns, content_hash])
+    return sorted(files)
+
+
+def validate_widget(widget, index, problems):
+    problem_count = len(problems)
+    if not isinstance(widget, dict):
+        problems.append(f"widget {index + 1} is not a mapping")
+        return
+
+    name = widget.get('name')
+    label = f"widget \"{name}\"" if isinstance(name, str) else f"widget {index + 1}"
+    if not isinstance(name, str) or WIDGET_NAME_RE.match(name) is None:
+        problems.append(f"{label} must have a name of letters, digits, \"_\" and \"-\"")
+
+    widget_type = widget.get('type')
+    if widget_type not in WIDGET_KEYS:
+        problems.append(f"{label} has the type {widget_type!r}; expected one of {', '.join(WIDGET_KEYS)}")
+        return
+
+    for key in sorted(set(widget) - WIDGET_KEYS[widget_type]):
+        problems.append(f"{label} has the unknown key \"{key}\" for a {widget_type} widget")
+
+    for key in ('title', 'description', 'path', 'package', 'cache_control'):
+        if key in widget and not isinstance(widget[key], str):
+            problems.append(f"{label} must have a string \"{key}\"")
+
+    if 'streaming' in widget and not isinstance(widget['streaming'], bool):
+        problems.append(f"{label} must have true or false for \"streaming\"")
+
+    included = widget.get('included')
+    if included is not None and (not isinstance(included, list) or
+                                 not all(isinstance(path, str) and path.startswith('/') for path in included)):
+        problems.append(f"{label} must have a list of object paths, such as \"/name\", for \"included\"")
+
+    output_cache = widget.get('output_cache')
+    if output_cache is not None:
+        if not isinstance(output_cache, dict) or set(output_cache) - {'ttl', 'max_bytes'}:
+            problems.append(f"{label} must have a mapping of \"ttl\" and \"max_bytes\" for \"output_cache\"")
+        elif not all(isinstance(value, (int, float)) and value > 0 for value in output_cache.values()):
+            problems.append(f"{label} must have positive numbers for \"output_cache\"")
+
+    if widget.get('streaming') and output_cache is not None:
+        # A cached page is rendered whole, and so is never streamed.
+        problems.append(f"{label} may not have both \"streaming\" and \"output_cache\"")
+
+    # The files are looked for only once the keys naming them are known to be valid.
+    if len(problems) > problem_count:
+        return
+
+    root_path = os.path.join(SERVICE_PATH, get_root(widget))
+    if not os.path.isdir(root_path):
+        problems.append(f"{label} has no directory {get_root(widget)}")
+    elif widget_type == 'python' and not os.path.isfile(os.path.join(root_path, 'widget.py')):
+        problems.append(f"{label} has no module {get_root(widget)}/widget.py")
+
+
+def get_warm_up_names(warm_up):
+    """
+    The names of the python widgets to warm up, from the "startup.warm_up" setting: a
+    list of names, or a single name. Any other value raises a WidgetError.
+    """
+    if warm_up is None:
+        return []
+    if isinstance(warm_up, str):
+        return [warm_up]
+    if isinstance(warm_up, list) and all(isinstance(name, str) for name in warm_up):
+        return warm_up
+    raise WidgetError(
+        title = "Invalid Widget Config",
+        code = "invalid-widget-config",
+        message = "\"startup.warm_up\" must be a widget name or a list of widget names"
+    )
+
+
+def validate_config(config):
+    """
+    Raises a WidgetError describing every problem found in the config.
+    """
+    problems = []
+    if not isinstance(config, dict) or not isinstance(config.get('widgets'), list):
+        problems.append("the config must be a mapping with a list of \"widgets\"")
+    else:
+        names = set()
+        for index, widget in enumerate(config['widgets']):
+            validate_widget(widget, index, problems)
+            name = widget.get('name') if isinstance(widget, dict) else None
+            if name in names:
+                problems.append(f"widget \"{name}\" is configured more than once")
+            names.add(name)
+
+        settings = config.get('settings')
+        if settings is not None and not isinstance(settings, dict):
+            problems.append("\"settings\" must be a mapping")
+        elif settings is not None:
+            python_widgets = {
+                widget.get('name') for widget in config['widgets']
+                if isinstance(widget, dict) and widget.get('type') == 'python'
+            }
+            startup = settings.get('startup')
+            try:
+                warm_up = get_warm_up_names(startup.get('warm_up') if isinstance(startup, dict) else None)
+            except WidgetError as werr:
+                problems.append(werr.message)
+                warm_up = []
+            for name in warm_up:
+                if name not in python_widgets:
+                    problems.append(f"the widget \"{name}\" to warm up is not a configured python widget")
+
+    if problems:
+        raise WidgetError(
+            title = "Invalid Widget Config",
+            code = "invalid-widget-config",
+            message = '\n'.join(problems)
+        )
+
+
+def compile_manifest(config_content):
+    """
+    The manifest for the content of the widget config, which is validated first.
+    """
+    # PyYAML is imported only when compiling, so that loading the manifest does not
+    # need it.
+    import yaml
+
+    config = yaml.safe_load(config_content)
+    validate_config(config)
+
+    widgets = []
+    for widget in config['widgets']:
+        compiled = dict(widget)
+        compiled['title'] = widget.get('title') or widget['name'].title()
+        compiled['root'] = get_root(widget)
+        if widget['type'] == 'python':
+            compiled['package'] = widget.get('package') or widget['name']
+        else:
+            compiled['path'] = widget.get('path') or widget['name']
+            compiled['files'] = index_files(
+                os.path.join(SERVICE_PATH, compiled['root']),
+                content_hashes=widget['type'] == 'assets'
+            )
+        widgets.append(compiled)
+
+    return {
+        'version': MANIFEST_VERSION,
+        'config_digest': get_digest(config_content),
+        'compiled': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'settings': config.get('settings'),
+        'widgets': widgets,
+    }
+
+
+def load_manifest():
+    """
+    The compiled widget config and None, or None and the reason the manifest may not
+    be used: there is no manifest, or it is not of this version, or it was compiled
+    from a config other than the current one.
+    """
+    try:
+        with open(MANIFEST_PATH, 'r', encoding='utf-8') as fin:
+            manifest = json.load(fin)
+    except FileNotFoundError:
+        return None, f"there is no manifest {MANIFEST_PATH}"
+    except (OSError, ValueError) as ex:
+        return None, f"the manifest {MANIFEST_PATH} could not be read: {ex}"
+
+    try:
+        with open(CONFIG_PATH, 'rb') as fin:
+            config_digest = get_digest(fin.read())
+    except OSError as ex:
+        return None, f"the config {CONFIG_PATH} could not be read: {ex}"
+
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None, f"the manifest is of version {manifest.get('version')}, not {MANIFEST_VERSION}"
+    if manifest.get('config_digest') != config_digest:
+        return None, (f"the manifest was compiled from a config with the digest {manifest.get('config_digest')}, "
+                      f"but {CONFIG_PATH} has the digest {config_digest}")
+    return manifest, None
+
+
+def main():
+    with open(CONFIG_PATH, 'rb') as fin:
+        config_content = fin.read()
+    try:
+        manifest = compile_manifest(config_content)
+    except WidgetError as werr:
+        print(f"{werr.title} in {CONFIG_PATH}:\n{werr.message}", file=sys.stderr)
+        sys.exit(1)
+
+    with open(MANIFEST_PATH, 'w', encoding='utf-8') as fout:
+        json.dump(manifest, fout, separators=(',', ':'))
+    print(f"Compiled {len(manifest['widgets'])} widgets to {MANIFEST_PATH}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,49 @@
+import json
 import os
 import re
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
 
-import yaml
 from widget.handlers.assets import Assets
+from widget.handlers.metrics import MetricsWidget
 from widget.handlers.python_widget import PythonWidget
 from widget.handlers.static_widget import StaticWidget
+from widget.lib.cache import LRUCache, TTLCache
+from widget.lib.metrics import Metrics
+from widget.lib.resilience import RetryPolicy, Upstreams
+from widget.lib.rpc_fixtures import RpcRecorder, RpcReplay
+from widget.lib.session_pool import SessionPool
+from widget.lib.single_flight import SingleFlight
+from widget.lib.template_registry import TemplateRegistry
+from widget.lib.timing import RequestTiming, when_sent
 from widget.lib.widget_error import WidgetError
+from widget.lib.widget_manifest import CONFIG_PATH, get_warm_up_names, load_manifest
 
 
 def not_found(widget_name):
     status = '404 Not Found'
     content_type = 'text/plain; charset=utf-8'
     content = f"Widget Not Found: {widget_name}".encode('utf-8')
-    return status, content_type, content
+    return status, content_type, content, []
 
 GLOBAL_WIDGET_SUPPORT = None
 
+#
+# Browsers revalidate static widget files on each use, via ETag or Last-Modified, so
+# changes are seen immediately; shared assets may be reused for a short while.
+#
+DEFAULT_CACHE_CONTROL = {
+    "assets": "public, max-age=600",
+    "static": "no-cache"
+}
+
+#
+# Requests for files are many and cheap, so are not logged, though their metrics are
+# recorded.
+#
+UNLOGGED_WIDGET_TYPES = {"assets", "static"}
+
 
 class WidgetSupport(object):
     WIDGETS = {}
@@ -79,36 +107,336 @@ class WidgetSupport(object):
             self.service_origin = origin
             self.service_url = origin + self.base_path
 
+        #
+        # Compiled templates are shared by all requests for a widget package. In
+        # DEVELOPMENT mode templates are reloaded when they change on disk.
+        #
+        self.template_registry = TemplateRegistry(
+            auto_reload=self.runtime_mode == "DEVELOPMENT",
+            bytecode_cache_dir=self.get_setting('templates.bytecode_cache_dir')
+        )
+
+        #
+        # Keep-alive http sessions for calls to KBase services, shared by all requests.
+        #
+        self.session_pool = SessionPool(
+            pool_size=self.get_setting('http.pool_size', 10),
+            idle_timeout=self.get_setting('http.idle_timeout', 60)
+        )
+
+        #
+        # Read calls which fail because a service is unreachable are retried, and may
+        # be hedged if slow; calls to a service which keeps failing fail fast.
+        #
+        self.retry_policy = RetryPolicy(
+            max_retries=self.get_setting('http.retries.max', 2),
+            backoff=self.get_setting('http.retries.backoff', 100),
+            max_backoff=self.get_setting('http.retries.max_backoff', 2000),
+            hedge_percentile=self.get_setting('http.hedge.percentile'),
+            hedge_min_samples=self.get_setting('http.hedge.min_samples', 20)
+        )
+        self.upstreams = Upstreams(
+            failure_threshold=self.get_setting('http.circuit_breaker.failures', 5),
+            reset_timeout=self.get_setting('http.circuit_breaker.reset_timeout', 30)
+        )
+        if self.retry_policy.hedge_percentile is not None:
+            self.hedge_executor = ThreadPoolExecutor(
+                max_workers=self.get_setting('http.hedge.max_workers', 8),
+                thread_name_prefix='widget-hedge'
+            )
+        else:
+            self.hedge_executor = None
+
+        # The largest response, in bytes, accepted from a KBase service call, unless
+        # the call sets its own limit.
+        self.max_response_bytes = self.get_setting('http.max_response_bytes', 50_000_000)
+
+        # The time, in milliseconds, within which the calls made to render a widget
+        # must complete.
+        self.render_budget = self.get_setting('timeouts.render_budget', 30000)
+
+        #
+        # Identical read calls made at the same time, with the same token, share a
+        # single request.
+        #
+        if self.get_setting('http.coalesce', True):
+            self.single_flight = SingleFlight()
+        else:
+            self.single_flight = None
+
+        #
+        # Workspace objects at an absolute ref are immutable, so may be cached for as
+        # long as there is room; workspace info may change, so is cached only briefly.
+        #
+        self.object_cache = LRUCache(
+            max_bytes=self.get_setting('cache.objects.max_bytes', 100_000_000)
+        )
+        self.workspace_info_cache = TTLCache(
+            ttl=self.get_setting('cache.workspace_info.ttl', 30),
+            max_entries=self.get_setting('cache.workspace_info.max_entries', 1000)
+        )
+
+        #
+        # A bounded pool of threads shared by all widgets for making independent calls
+        # at the same time.
+        #
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.get_setting('concurrency.max_workers', 8),
+            thread_name_prefix='widget-call'
+        )
+
+        #
+        # Each request is timed by phase, reported in a Server-Timing header and a
+        # log line; by default only in DEVELOPMENT mode, as the header tells anyone
+        # how the service spends its time, and the log is verbose.
+        #
+        self.server_timing = self.get_setting('instrumentation.server_timing', self.runtime_mode == "DEVELOPMENT")
+        self.log_requests = self.get_setting('instrumentation.log_requests', self.runtime_mode == "DEVELOPMENT")
+
+        # Request and service call metrics, served at /widgets/_metrics. They are off
+        # unless enabled, as the route is not authenticated and describes the
+        # services called and their state.
+        if self.get_setting('instrumentation.metrics', False):
+            self.metrics = Metrics()
+        else:
+            self.metrics = None
+
+        #
+        # Service calls may be recorded to a fixture file, or served from one instead
+        # of the services, to run widgets against real data without the network; only
+        # in DEVELOPMENT mode, as recorded responses hold users' data.
+        #
+        self.rpc_recorder = None
+        self.rpc_replay = None
+        if self.runtime_mode == "DEVELOPMENT":
+            replay_path = self.get_setting('fixtures.replay')
+            if replay_path is not None:
+                self.rpc_replay = RpcReplay(replay_path, latency=self.get_setting('fixtures.replay_latency'))
+            elif self.get_setting('fixtures.record') is not None:
+                self.rpc_recorder = RpcRecorder(self.get_setting('fixtures.record'))
+
+        # The assets widget, which provides the asset manifest; set when the widgets are
+        # initialized.
+        self.assets = None
+
         self.initialize_widgets()
 
     def load_config(self):
-        with open(os.path.join(os.path.dirname(__file__), '../../../widget/widgets.yml'), 'r', encoding="utf-8") as fin:
+        """
+        The widget config: the manifest compiled from widgets.yml when the service was
+        built, if it is up to date, otherwise widgets.yml itself. Why the manifest was
+        not used is printed, and what it holds is included in the startup report.
+        """
+        manifest, problem = load_manifest()
+        if manifest is not None:
+            self.config_source = "manifest"
+            self.manifest_report = {
+                'config_digest': manifest['config_digest'],
+                'compiled': manifest.get('compiled'),
+                'files': sum(len(widget.get('files') or []) for widget in manifest['widgets'])
+            }
+            return manifest
+
+        print(f"!! The widget manifest is not used, as {problem}; the config is loaded from {CONFIG_PATH}",
+              flush=True)
+        self.manifest_report = None
+
+        # PyYAML is imported only when there is no manifest.
+        import yaml
+
+        self.config_source = "yaml"
+        with open(CONFIG_PATH, 'r', encoding="utf-8") as fin:
             return yaml.safe_load(fin)
 
+    def get_setting(self, setting_path, default_value=None):
+        """
+        Gets a runtime setting from the optional top level "settings" section of the
+        widgets config, using a dotted path, e.g. "templates.bytecode_cache_dir".
+        """
+        data = self.widget_config.get('settings') or {}
+
+        for attrib in setting_path.split('.'):
+            if not isinstance(data, dict) or attrib not in data:
+                return default_value
+            data = data.get(attrib)
+
+        return data
+
     def initialize_widgets(self):
+        """
+        Creates the configured widgets, then loads those listed in the
+        "startup.warm_up" setting, and prints a report of the time each took.
+
+        Python widgets are otherwise loaded, importing their module and compiling their
+        templates, on their first request, so that the service starts answering
+        sooner.
+        """
+        started = time.perf_counter()
+        self.startup_report = []
         for widget in self.widget_config['widgets']:
-            if widget['type'] == "assets":
-                self.add_assets_widget(widget['name'])
-            elif widget['type'] == "static":
-                self.add_static_widget(
-                    widget['name'],
-                    path=widget.get('path') or widget['name'],
-                    title=widget.get('title'),
-                    description=widget.get('description')
-                    )
-            elif widget['type'] == "python":
-                self.add_python_widget(
-                    widget['name'], 
-                    package=widget.get('package') or widget['name'], 
-                    title=widget.get('title'),
-                    description=widget.get('description')
+            widget_started = time.perf_counter()
+            self.add_widget(widget)
+            entry = {
+                'widget': widget['name'],
+                'type': widget['type'],
+                'init_ms': round((time.perf_counter() - widget_started) * 1000, 1)
+            }
+            # Files added after the manifest was compiled are served, but are worth
+            # knowing about, as the manifest should then be compiled later in the build.
+            static_index = getattr(self.WIDGETS[widget['name']], 'static_index', None)
+            if static_index is not None and static_index.unindexed_paths:
+                entry['unindexed_files'] = len(static_index.unindexed_paths)
+                print(f"!! Widget {widget['name']} serves files not in the widget manifest, e.g. "
+                      f"{static_index.unindexed_paths[0]}; compile the manifest after they are added", flush=True)
+            self.startup_report.append(entry)
+
+        if self.metrics is not None:
+            self.WIDGETS['_metrics'] = MetricsWidget('_metrics', self)
+
+        self.warm_up(get_warm_up_names(self.get_setting('startup.warm_up')))
+        self.check_python_widgets()
+
+        self.print_startup_report(time.perf_counter() - started)
+
+    def add_widget(self, widget):
+        """
+        Creates a widget from its config.
+        """
+        if widget['type'] == "assets":
+            self.add_assets_widget(
+                widget['name'],
+                cache_control=self.get_cache_control(widget),
+                files=widget.get('files')
+            )
+        elif widget['type'] == "static":
+            self.add_static_widget(
+                widget['name'],
+                path=widget.get('path') or widget['name'],
+                title=widget.get('title'),
+                description=widget.get('description'),
+                cache_control=self.get_cache_control(widget),
+                files=widget.get('files')
                 )
-            else:
+        elif widget['type'] == "python":
+            self.add_python_widget(
+                widget['name'], 
+                package=widget.get('package') or widget['name'], 
+                title=widget.get('title'),
+                description=widget.get('description'),
+                included=widget.get('included'),
+                streaming=self.get_streaming(widget),
+                gzip_min_bytes=self.get_gzip_min_bytes(),
+                output_cache=self.create_output_cache(widget)
+            )
+        else:
+            raise WidgetError(
+                title= "Invalid Widget Type in Config",
+                code= "invalid-widget-config",
+                message = f"The widget type {widget['type']} is not supported."
+            )
+
+    def warm_up(self, widget_names):
+        """
+        Loads python widgets ahead of their first request.
+        """
+        for name in widget_names:
+            widget = self.WIDGETS.get(name)
+            if widget is None or widget.WIDGET_TYPE != "python":
                 raise WidgetError(
-                    title= "Invalid Widget Type in Config",
+                    title= "Invalid Widget in Config",
                     code= "invalid-widget-config",
-                    message = f"The widget type {widget['type']} is not supported."
+                    message = f"The widget {name} to warm up is not a configured python widget."
                 )
+            widget.load()
+
+    def check_python_widgets(self):
+        """
+        Reports, at startup, any python widget not loaded then whose module cannot be
+        found, as it would otherwise fail only when first requested.
+        """
+        for name, widget in self.WIDGETS.items():
+            if widget.WIDGET_TYPE != "python" or widget.widget_mod is not None:
+                continue
+            if not widget.has_module():
+                print(f"!! Widget {name} has no module {widget.get_module_name()}; requests for it will fail",
+                      flush=True)
+
+    def print_startup_report(self, duration):
+        """
+        Prints the time taken to create each widget and, for python widgets loaded at
+        startup, to import its module and compile its templates, as a line of JSON.
+        """
+        for entry in self.startup_report:
+            load_times = getattr(self.WIDGETS.get(entry['widget']), 'load_times', None)
+            if load_times is not None:
+                entry['import_ms'] = round(load_times['import'] * 1000, 1)
+                entry['templates_ms'] = round(load_times['templates'] * 1000, 1)
+        print(json.dumps({
+            'event': 'widget-startup',
+            'config': self.config_source,
+            'manifest': self.manifest_report,
+            'total_ms': round(duration * 1000, 1),
+            'widgets': self.startup_report
+        }), flush=True)
+
+    def get_cache_control(self, widget):
+        """
+        The Cache-Control for files served by an assets or static widget; set by the
+        widget's "cache_control", or else by the "cache_control" setting for the
+        widget type.
+        """
+        if 'cache_control' in widget:
+            return widget['cache_control']
+        return self.get_setting(f"cache_control.{widget['type']}", DEFAULT_CACHE_CONTROL[widget['type']])
+
+    def get_streaming(self, widget):
+        """
+        Whether a python widget's page is streamed. A cached page must be rendered
+        whole, so a widget with an "output_cache" is not streamed, whatever its
+        "streaming"; the manifest compiler rejects a config which sets both.
+        """
+        streaming = widget.get('streaming', False)
+        if streaming and widget.get('output_cache') is not None:
+            print(f"!! Widget {widget['name']} has both streaming and output_cache; its page is cached, not streamed",
+                  flush=True)
+            return False
+        return streaming
+
+    def create_output_cache(self, widget):
+        """
+        The cache of rendered pages for a python widget which opts in with an
+        "output_cache" entry, or None. Output is not cached in DEVELOPMENT mode, so
+        that template changes are seen immediately.
+        """
+        output_cache = widget.get('output_cache')
+        if output_cache is None or self.runtime_mode == "DEVELOPMENT":
+            return None
+        return LRUCache(
+            max_bytes=output_cache.get('max_bytes', 10_000_000),
+            ttl=output_cache.get('ttl', 300)
+        )
+
+    def get_gzip_min_bytes(self):
+        """
+        The size from which static files and rendered pages are sent gzip compressed to
+        browsers which accept it, or None if compression is disabled.
+        """
+        if not self.get_setting('compression.enabled', True):
+            return None
+        return self.get_setting('compression.gzip_min_bytes', 1024)
+
+    def get_static_index_options(self, files=None):
+        """
+        Options for the index of files served by assets and static widgets, with the
+        files indexed by the manifest, if any. In DEVELOPMENT mode the index is
+        refreshed as files are added or edited.
+        """
+        return {
+            "cache_max_file_bytes": self.get_setting('static.cache_max_file_bytes', 65536),
+            "gzip_min_bytes": self.get_gzip_min_bytes(),
+            "refresh": self.runtime_mode == "DEVELOPMENT",
+            "files": files
+        }
 
     def get_widget_config(self):
         return {
@@ -126,19 +454,22 @@ class WidgetSupport(object):
     def get_widget(self, name):
         return self.WIDGETS[name]
 
-    def add_assets_widget(self, name, title=None, path=None):
+    def add_assets_widget(self, name, title=None, path=None, cache_control=None, files=None):
         widget_instance = Assets(
             service_package_name = self.service_package_name,
             name = name,
             path = path or name,
             title = title or name.title(),
             service_config = self.service_config,
-            widget_config = self.get_widget_config()
+            widget_config = self.get_widget_config(),
+            cache_control = cache_control,
+            static_index_options = self.get_static_index_options(files)
         )
 
         self.WIDGETS[name] = widget_instance
+        self.assets = widget_instance
 
-    def add_static_widget(self, name, title=None, path=None, description=None):
+    def add_static_widget(self, name, title=None, path=None, description=None, cache_control=None, files=None):
 
         widget_instance = StaticWidget(
             service_package_name = self.service_package_name,
@@ -147,12 +478,15 @@ class WidgetSupport(object):
             title = title or name.title(),
             description = description,
             service_config = self.service_config,
-            widget_config = self.get_widget_config()
+            widget_config = self.get_widget_config(),
+            cache_control = cache_control,
+            static_index_options = self.get_static_index_options(files)
         )
 
         self.WIDGETS[name] = widget_instance
 
-    def add_python_widget(self, name, package=None, title=None, path=None, description=None):
+    def add_python_widget(self, name, package=None, title=None, path=None, description=None, included=None, streaming=False, gzip_min_bytes=None, output_cache=None):
+        package = package or name
 
         widget_instance = PythonWidget(
             service_package_name = self.service_package_name,
@@ -162,7 +496,12 @@ class WidgetSupport(object):
             description = description, 
             service_config = self.service_config,
             widget_package_name = package,
-            widget_config = self.get_widget_config()
+            widget_config = self.get_widget_config(),
+            widget_support = self,
+            included = included,
+            streaming = streaming,
+            gzip_min_bytes = gzip_min_bytes,
+            output_cache = output_cache
         )
 
         self.WIDGETS[name] = widget_instance
@@ -177,20 +516,116 @@ class WidgetSupport(object):
             return not_found(widget_name)
 
     def handle_widget(self, request_env):
-        path = request_env['PATH_INFO']
-        result = re.match(r'^/widgets/(.*?)(?:/(.*))?$', path)
+        timing = RequestTiming()
+        # Handlers find the request's timing in the environment, alongside the other
+        # per-request facilities provided by the server.
+        request_env['widget.timing'] = timing
+
+        with timing.phase('route'):
+            path = request_env['PATH_INFO']
+            result = re.match(r'^/widgets/(.*?)(?:/(.*))?$', path)
 
-        widget_name = result.group(1)
-        widget_path = result.group(2)
+            widget_name = result.group(1)
+            widget_path = result.group(2)
 
-        status, content_type, content = self.run_widget(widget_name, widget_path, request_env)
+        status, content_type, content, extra_headers = self.run_widget(widget_name, widget_path, request_env)
 
-        response_headers = [
-            ('content-type', content_type),
-            ('content-length', str(len(content)))]
+        response_headers = [('content-type', content_type)]
+        response_headers.extend(extra_headers)
+
+        # Content is either bytes, or an iterable of bytes chunks from a streaming
+        # render, whose length is not known up front; the server will then use a
+        # chunked response. A 304 response has no content, and must not claim a
+        # length other than that of the full response.
+        if isinstance(content, bytes) and not status.startswith('304'):
+            response_headers.append(('content-length', str(len(content))))
+
+        if self.server_timing:
+            response_headers.append(('server-timing', timing.server_timing()))
+
+        if self.log_requests or self.metrics is not None:
+            content = self.complete_request(timing, request_env, widget_name, status, response_headers, content)
 
         return status, response_headers, content
 
+    def complete_request(self, timing, request_env, widget_name, status, response_headers, content):
+        """
+        Logs the request with its timing, unless it is for a file, and records its
+        metrics; streamed content is logged once it has been sent. The query string is not logged, as it may carry
+        a token.
+        """
+        widget = self.WIDGETS.get(widget_name)
+        fields = {
+            'method': request_env.get('REQUEST_METHOD'),
+            'path': request_env.get('PATH_INFO'),
+            'widget': widget_name,
+            'type': None if widget is None else widget.WIDGET_TYPE,
+            'status': int(status.split(' ')[0]),
+        }
+
+        def complete(size):
+            fields['bytes'] = size
+            if self.log_requests and fields['type'] not in UNLOGGED_WIDGET_TYPES:
+                timing.log(**fields)
+            if self.metrics is not None:
+                self.record_request(fields, timing.elapsed())
+
+        if isinstance(content, types.GeneratorType):
+            return when_sent(content, complete)
+
+        # Content such as a file wrapper is passed to the server untouched, so it may
+        # be sent efficiently.
+        content_length = dict(response_headers).get('content-length')
+        complete(None if content_length is None else int(content_length))
+        return content
+
+    def record_request(self, fields, duration):
+        # Requests for unknown widgets are counted together, so that arbitrary paths
+        # do not each create a metric.
+        if fields['type'] is None:
+            labels = (('widget', ''), ('type', 'none'))
+        else:
+            labels = (('widget', fields['widget']), ('type', fields['type']))
+        self.metrics.inc('widget_requests_total', labels + (('status', str(fields['status'])),))
+        self.metrics.observe('widget_request_duration_seconds', labels, duration)
+        if fields['bytes'] is not None:
+            self.metrics.inc('widget_response_bytes_total', labels, fields['bytes'])
+
+    def render_metrics(self):
+        """
+        The metrics, including those sampled from the caches and service clients.
+        """
+        cache_stats = [
+            ((('cache', 'objects'),), self.object_cache.stats()),
+            ((('cache', 'workspace_info'),), self.workspace_info_cache.stats()),
+        ]
+        for name, widget in self.WIDGETS.items():
+            output_cache = getattr(widget, 'output_cache', None)
+            if output_cache is not None:
+                cache_stats.append(((('cache', 'output'), ('widget', name)), output_cache.stats()))
+
+        sampled = [
+            ('widget_cache_hits_total', 'counter', 'Cache hits.',
+             [(labels, stats['hits']) for labels, stats in cache_stats]),
+            ('widget_cache_misses_total', 'counter', 'Cache misses.',
+             [(labels, stats['misses']) for labels, stats in cache_stats]),
+            ('widget_cache_evictions_total', 'counter', 'Entries dropped to make room.',
+             [(labels, stats['evictions']) for labels, stats in cache_stats]),
+            ('widget_cache_entries', 'gauge', 'Entries in the cache.',
+             [(labels, stats['entries']) for labels, stats in cache_stats]),
+            ('widget_cache_bytes', 'gauge', 'Size of the entries in the cache.',
+             [(labels, stats['bytes']) for labels, stats in cache_stats if 'bytes' in stats]),
+            ('widget_upstream_circuit_open', 'gauge', 'Whether calls to a service are being refused.',
+             [((('url', upstream.url),), int(upstream.breaker.state != upstream.breaker.CLOSED))
+              for upstream in self.upstreams.list()]),
+        ]
+        if self.single_flight is not None:
+            single_flight_stats = self.single_flight.stats()
+            sampled.append(('widget_rpc_coalesced_total', 'counter', 'Service calls which waited for an identical call in progress.',
+                            [((), single_flight_stats['coalesced'])]))
+
+        return self.metrics.render(sampled)
+
     def set_global(self):
         global GLOBAL_WIDGET_SUPPORT
         GLOBAL_WIDGET_SUPPORT = self
@@ -1,3 +1,6 @@
+import hashlib
+
+
 def object_info_to_dict(object_info):
     [
         object_id,
@@ -27,6 +30,21 @@ def object_info_to_dict(object_info):
         'metadata': metadata,
     }
 
+def object_ref(object_info):
+    """
+    The absolute ref (wsid/objid/version) for an object info dict.
+    """
+    return f"{object_info['workspace_id']}/{object_info['object_id']}/{object_info['version']}"
+
+def token_identity(token):
+    """
+    A stable identity for an auth token, suitable for use in cache keys without
+    retaining the token itself.
+    """
+    if token is None:
+        return None
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
 def workspace_info_to_dict(workspace_info):
     [
         workspace_id,
@@ -2,6 +2,13 @@ from widget.lib.widget_base import WidgetBase
 
 
 class Widget(WidgetBase):
+    def cache_key(self):
+        """
+        The page depends only on the object version and the user's permission.
+        """
+        if not self.has_param('ref'):
+            return None
+        return self.object_cache_key(self.get_param('ref'))
 
     def context(self) -> dict:
         """
@@ -0,0 +1,560 @@
+"""
+Bundles the Javascript modules of the widget runtime, so that a widget page loads one
+file rather than a waterfall of ES module imports.
+
+For each entry point (e.g. js/lib.js within the assets directory), the entry module
+and all modules it imports by relative path are combined into a single ES module,
+js/lib.bundle.js, with comments and redundant whitespace removed, along with a source
+map, js/lib.bundle.js.map, relating each line of the bundle to its original module.
+
+It is pure Python (standard library only), so that no Node.js is required to build a
+service. It is run when widget support is added to a service, and by "make compile".
+
+Usage:
+
+    python widget/scripts/bundle_assets.py ASSETS_DIRECTORY [ENTRY_POINT ...]
+
+The entry point defaults to js/lib.js.
+"""
+import json
+import posixpath
+import re
+import sys
+from pathlib import Path
+
+DEFAULT_ENTRY_POINTS = ['js/lib.js']
+
+IDENTIFIER = r'[A-Za-z_$][\w$]*'
+
+# Keywords after which a "/" begins a regular expression rather than a division.
+REGEX_PRECEDING_KEYWORDS = {
+    'return', 'typeof', 'instanceof', 'case', 'do', 'else', 'in', 'of', 'new',
+    'delete', 'void', 'throw', 'yield', 'await'
+}
+
+# Characters after which a "/" begins a regular expression rather than a division.
+REGEX_PRECEDING_CHARACTERS = set('(,=:[!&|?{};+-*%<>~^')
+
+IMPORT_FROM_RE = re.compile(r'^import\s+(.+?)\s+from\s*([\'"])(.+?)\2\s*;?$')
+IMPORT_BARE_RE = re.compile(r'^import\s*([\'"])(.+?)\1\s*;?$')
+EXPORT_DEFAULT_DECLARATION_RE = re.compile(
+    rf'^export\s+default\s+((?:async\s+)?function\s*\*?\s*({IDENTIFIER})|class\s+({IDENTIFIER}))'
+)
+EXPORT_DEFAULT_RE = re.compile(r'^export\s+default\s+')
+EXPORT_DECLARATION_RE = re.compile(
+    rf'^export\s+((?:async\s+)?function\s*\*?\s*({IDENTIFIER})|class\s+({IDENTIFIER})|(?:const|let|var)\s+({IDENTIFIER}))'
+)
+EXPORT_LIST_RE = re.compile(r'^export\s*\{(.*)\}\s*(?:from\s*([\'"])(.+?)\2)?\s*;?$')
+EXPORT_ALL_RE = re.compile(r'^export\s*\*\s*from\s*([\'"])(.+?)\1\s*;?$')
+
+BASE64_DIGITS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+
+
+class BundleError(Exception):
+    pass
+
+
+#
+# Minification
+#
+
+class Line(object):
+    """
+    A line of stripped source, remembering the original line it came from, and whether
+    it begins or ends within a template literal, whose whitespace must be preserved.
+    """
+    def __init__(self, original_line):
+        self.parts = []
+        self.original_line = original_line
+        self.starts_in_literal = False
+        self.ends_in_literal = False
+
+    def text(self):
+        text = ''.join(self.parts)
+        if not self.starts_in_literal:
+            text = text.lstrip()
+        if not self.ends_in_literal:
+            text = text.rstrip()
+        return text
+
+    def last_character(self):
+        for part in reversed(self.parts):
+            stripped = part.rstrip()
+            if stripped != '':
+                return stripped[-1]
+        return None
+
+    def last_word(self):
+        match = re.search(r'([A-Za-z_$][\w$]*)\s*$', ''.join(self.parts))
+        return match.group(1) if match else None
+
+
+def strip_source(source):
+    """
+    Removes comments, indentation, blank lines and runs of spaces from Javascript
+    source, leaving strings, template literals and regular expressions intact.
+
+    Line breaks are kept, so the code is not subject to different semicolon
+    insertion. Returns a list of (text, original line number) pairs, numbered from 0.
+    """
+    lines = [Line(0)]
+    # Each entry is either "template", or the brace depth within a template literal's
+    # ${} expression.
+    modes = []
+    length = len(source)
+    i = 0
+
+    def new_line(in_literal):
+        lines[-1].ends_in_literal = in_literal
+        line = Line(lines[-1].original_line + 1)
+        line.starts_in_literal = in_literal
+        lines.append(line)
+
+    def previous_allows_regex():
+        # Look back over lines already emitted, skipping any which are now empty.
+        for line in reversed(lines):
+            character = line.last_character()
+            if character is None:
+                continue
+            if character in REGEX_PRECEDING_CHARACTERS:
+                return True
+            return line.last_word() in REGEX_PRECEDING_KEYWORDS
+        return True
+
+    while i < length:
+        character = source[i]
+        in_template = len(modes) > 0 and modes[-1] == 'template'
+
+        if in_template:
+            if character == '\\':
+                lines[-1].parts.append(source[i:i + 2])
+                if source[i + 1:i + 2] == '\n':
+                    new_line(True)
+                i += 2
+            elif character == '`':
+                lines[-1].parts.append(character)
+                modes.pop()
+                i += 1
+            elif source.startswith('${', i):
+                lines[-1].parts.append('${')
+                modes.append(0)
+                i += 2
+            elif character == '\n':
+                new_line(True)
+                i += 1
+            else:
+                lines[-1].parts.append(character)
+                i += 1
+            continue
+
+        if character == '\n':
+            new_line(False)
+            i += 1
+        elif character in ' \t\r':
+            parts = lines[-1].parts
+            if len(parts) > 0 and not parts[-1].endswith(' '):
+                parts.append(' ')
+            i += 1
+        elif source.startswith('//', i):
+            end = source.find('\n', i)
+            i = length if end == -1 else end
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            if end == -1:
+                raise BundleError('Unterminated comment')
+            # Line breaks within the comment are kept, so that line numbers still
+            # correspond with the original.
+            for _ in range(source.count('\n', i, end)):
+                new_line(False)
+            parts = lines[-1].parts
+            if len(parts) == 0 or not parts[-1].endswith(' '):
+                parts.append(' ')
+            i = end + 2
+        elif character in '\'"':
+            end = i + 1
+            while end < length and source[end] != character:
+                if source[end] == '\\':
+                    end += 1
+                elif source[end] == '\n':
+                    raise BundleError(f'Unterminated string on line {lines[-1].original_line + 1}')
+                end += 1
+            lines[-1].parts.append(source[i:end + 1])
+            i = end + 1
+        elif character == '`':
+            lines[-1].parts.append(character)
+            modes.append('template')
+            i += 1
+        elif character == '/' and previous_allows_regex():
+            end = i + 1
+            in_class = False
+            while end < length:
+                if source[end] == '\\':
+                    end += 2
+                    continue
+                if source[end] == '\n':
+                    raise BundleError(f'Unterminated regular expression on line {lines[-1].original_line + 1}')
+                if source[end] == '[':
+                    in_class = True
+                elif source[end] == ']':
+                    in_class = False
+                elif source[end] == '/' and not in_class:
+                    break
+                end += 1
+            end += 1
+            while end < length and (source[end].isalnum() or source[end] == '_'):
+                end += 1
+            lines[-1].parts.append(source[i:end])
+            i = end
+        else:
+            if len(modes) > 0:
+                if character == '{':
+                    modes[-1] += 1
+                elif character == '}':
+                    if modes[-1] == 0:
+                        # The end of a ${} expression; back to the template literal.
+                        modes.pop()
+                    else:
+                        modes[-1] -= 1
+            lines[-1].parts.append(character)
+            i += 1
+
+    result = []
+    for line in lines:
+        text = line.text()
+        if text == '' and not (line.starts_in_literal or line.ends_in_literal):
+            continue
+        result.append((text, line.original_line))
+    return result
+
+
+#
+# Module transformation
+#
+
+def resolve_specifier(module_id, specifier):
+    if not (specifier.startswith('./') or specifier.startswith('../')):
+        raise BundleError(f'Only relative imports may be bundled, in {module_id}: {specifier}')
+    resolved = posixpath.normpath(posixpath.join(posixpath.dirname(module_id), specifier))
+    if resolved.startswith('../'):
+        raise BundleError(f'Import outside of the assets directory, in {module_id}: {specifier}')
+    return resolved
+
+
+def parse_names(names_text):
+    """
+    Parses "a, b as c" into [("a", "a"), ("b", "c")], i.e. (imported, local) pairs.
+    """
+    names = []
+    for name in names_text.split(','):
+        name = name.strip()
+        if name == '':
+            continue
+        imported, _, local = name.partition(' as ')
+        names.append((imported.strip(), (local or imported).strip()))
+    return names
+
+
+def transform_import(module_id, clause, specifier):
+    """
+    Converts an import clause into a statement which obtains the bindings from the
+    bundle's module registry, returning it and the resolved module id.
+    """
+    dependency = resolve_specifier(module_id, specifier)
+    required = f'__require({json.dumps(dependency)})'
+
+    clause = clause.strip()
+    statements = []
+
+    default_match = re.match(rf'^({IDENTIFIER})\s*(?:,\s*(.*))?$', clause)
+    if default_match is not None:
+        statements.append(f'const {default_match.group(1)} = {required}.default;')
+        clause = (default_match.group(2) or '').strip()
+
+    if clause.startswith('*'):
+        namespace_match = re.match(rf'^\*\s*as\s+({IDENTIFIER})$', clause)
+        if namespace_match is None:
+            raise BundleError(f'Unsupported import in {module_id}: {clause}')
+        statements.append(f'const {namespace_match.group(1)} = {required};')
+    elif clause.startswith('{'):
+        if not clause.endswith('}'):
+            raise BundleError(f'Unsupported import in {module_id}: {clause}')
+        bindings = ', '.join(
+            imported if imported == local else f'{imported}: {local}'
+            for imported, local in parse_names(clause[1:-1])
+        )
+        statements.append(f'const {{{bindings}}} = {required};')
+    elif clause != '':
+        raise BundleError(f'Unsupported import in {module_id}: {clause}')
+
+    return ' '.join(statements), dependency
+
+
+def join_statements(lines):
+    """
+    Joins multi-line import and export lists, e.g. "import {\\n a,\\n b\\n} from ...",
+    onto their first line, so that each may be transformed as a single line.
+    """
+    joined = []
+    pending = None
+    for text, original_line in lines:
+        if pending is not None:
+            pending[0] = f'{pending[0]} {text}'
+            if '}' in text:
+                joined.append(tuple(pending))
+                pending = None
+            continue
+        if re.match(r'^(import|export)\b', text) and '{' in text and '}' not in text:
+            pending = [text, original_line]
+            continue
+        joined.append((text, original_line))
+    if pending is not None:
+        raise BundleError(f'Unterminated import or export list on line {pending[1] + 1}')
+    return joined
+
+
+def transform_module(module_id, source):
+    """
+    Rewrites a module's imports and exports in terms of the bundle's module registry,
+    returning the transformed lines, as (text, original line) pairs, the ids of the
+    modules it imports, and the names it exports.
+    """
+    lines = join_statements(strip_source(source))
+
+    transformed = []
+    dependencies = []
+    exports = []
+    trailing = []
+
+    for text, original_line in lines:
+        match = IMPORT_FROM_RE.match(text)
+        if match is not None:
+            statement, dependency = transform_import(module_id, match.group(1), match.group(3))
+            transformed.append((statement, original_line))
+            dependencies.append(dependency)
+            continue
+
+        match = IMPORT_BARE_RE.match(text)
+        if match is not None:
+            dependency = resolve_specifier(module_id, match.group(2))
+            transformed.append((f'__require({json.dumps(dependency)});', original_line))
+            dependencies.append(dependency)
+            continue
+
+        match = EXPORT_DEFAULT_DECLARATION_RE.match(text)
+        if match is not None:
+            name = match.group(2) or match.group(3)
+            transformed.append((text[len('export'):].lstrip()[len('default'):].lstrip(), original_line))
+            trailing.append(f'__exports.default = {name};')
+            exports.append('default')
+            continue
+
+        match = EXPORT_DEFAULT_RE.match(text)
+        if match is not None:
+            transformed.append((f'__exports.default = {text[match.end():]}', original_line))
+            exports.append('default')
+            continue
+
+        match = EXPORT_DECLARATION_RE.match(text)
+        if match is not None:
+            name = match.group(2) or match.group(3) or match.group(4)
+            transformed.append((text[len('export'):].lstrip(), original_line))
+            trailing.append(f'__exports.{name} = {name};')
+            exports.append(name)
+            continue
+
+        match = EXPORT_LIST_RE.match(text)
+        if match is not None:
+            names = parse_names(match.group(1))
+            if match.group(3) is not None:
+                dependency = resolve_specifier(module_id, match.group(3))
+                dependencies.append(dependency)
+                source_expression = f'__require({json.dumps(dependency)}).'
+            else:
+                source_expression = ''
+            statement = ' '.join(f'__exports.{exported} = {source_expression}{local};' for local, exported in names)
+            transformed.append((statement, original_line))
+            exports.extend(exported for _, exported in names)
+            continue
+
+        match = EXPORT_ALL_RE.match(text)
+        if match is not None:
+            dependency = resolve_specifier(module_id, match.group(2))
+            dependencies.append(dependency)
+            transformed.append((f'Object.assign(__exports, __require({json.dumps(dependency)}));', original_line))
+            continue
+
+        if re.match(r'^(import|export)\b', text):
+            raise BundleError(f'Unsupported statement in {module_id} on line {original_line + 1}: {text}')
+
+        transformed.append((text, original_line))
+
+    # Exported declarations are assigned after the module body, once they are defined.
+    transformed.extend((statement, None) for statement in trailing)
+
+    return transformed, dependencies, exports
+
+
+#
+# Source maps
+#
+
+def vlq_encode(value):
+    value = (-value << 1) | 1 if value < 0 else value << 1
+    encoded = ''
+    while True:
+        digit = value & 31
+        value >>= 5
+        if value > 0:
+            digit |= 32
+        encoded += BASE64_DIGITS[digit]
+        if value == 0:
+            return encoded
+
+
+def make_mappings(line_sources):
+    """
+    Creates the "mappings" of a version 3 source map, mapping the start of each
+    bundle line to the start of the line it came from. Each entry of line_sources is
+    a (source index, original line) pair, or None for lines added by bundling.
+    """
+    mappings = []
+    previous_source = 0
+    previous_line = 0
+    for line_source in line_sources:
+        if line_source is None:
+            mappings.append('')
+            continue
+        source_index, original_line = line_source
+        mappings.append(
+            vlq_encode(0) +
+            vlq_encode(source_index - previous_source) +
+            vlq_encode(original_line - previous_line) +
+            vlq_encode(0)
+        )
+        previous_source = source_index
+        previous_line = original_line
+    return ';'.join(mappings)
+
+
+#
+# Bundling
+#
+
+def get_bundle_path(entry_point):
+    """
+    js/lib.js -> js/lib.bundle.js
+    """
+    head, _, extension = entry_point.rpartition('.')
+    return f'{head}.bundle.{extension}'
+
+
+def collect_modules(assets_path, entry_point):
+    """
+    Loads and transforms the entry module and, depth first, every module it imports,
+    returning them in an order in which dependencies precede their importers.
+    """
+    modules = {}
+    order = []
+
+    def visit(module_id):
+        if module_id in modules:
+            return
+        module_path = assets_path.joinpath(module_id)
+        if not module_path.is_file():
+            raise BundleError(f'Module not found: {module_id}')
+        source = module_path.read_text(encoding='utf-8')
+        modules[module_id] = transform_module(module_id, source)
+        for dependency in modules[module_id][1]:
+            visit(dependency)
+        order.append(module_id)
+
+    visit(entry_point)
+    return [(module_id, modules[module_id]) for module_id in order]
+
+
+def bundle(assets_path, entry_point):
+    """
+    Bundles an entry point, returning the bundle source and its source map.
+    """
+    assets_path = Path(assets_path)
+    bundle_path = get_bundle_path(entry_point)
+    modules = collect_modules(assets_path, entry_point)
+
+    output = []
+    line_sources = []
+
+    def emit(text, line_source=None):
+        output.append(text)
+        line_sources.append(line_source)
+
+    emit('const __modules = {};')
+    for source_index, (module_id, (lines, _, _)) in enumerate(modules):
+        emit(f'__modules[{json.dumps(module_id)}] = function (__exports, __require) {{')
+        for text, original_line in lines:
+            emit(text, None if original_line is None else (source_index, original_line))
+        emit('};')
+
+    emit('const __cache = {};')
+    emit('function __require(id) {')
+    emit('if (!(id in __cache)) {')
+    emit('const exports = __cache[id] = {};')
+    emit('__modules[id](exports, __require);')
+    emit('}')
+    emit('return __cache[id];')
+    emit('}')
+
+    # The bundle exports whatever the entry module exports.
+    entry_exports = modules[-1][1][2]
+    emit(f'const __entry = __require({json.dumps(entry_point)});')
+    named_exports = [name for name in entry_exports if name != 'default']
+    if len(named_exports) > 0:
+        emit(f'export const {{{", ".join(named_exports)}}} = __entry;')
+    if 'default' in entry_exports:
+        emit('export default __entry.default;')
+
+    emit(f'//# sourceMappingURL={posixpath.basename(bundle_path)}.map')
+
+    bundle_dir = posixpath.dirname(bundle_path)
+    source_map = {
+        'version': 3,
+        'file': posixpath.basename(bundle_path),
+        'sources': [posixpath.relpath(module_id, bundle_dir or '.') for module_id, _ in modules],
+        'names': [],
+        'mappings': make_mappings(line_sources),
+    }
+
+    return '\n'.join(output) + '\n', json.dumps(source_map)
+
+
+def bundle_assets(assets_directory, entry_points=None):
+    """
+    Writes the bundle and source map for each entry point, returning the bundle paths.
+    """
+    assets_path = Path(assets_directory)
+    bundle_paths = []
+    for entry_point in entry_points or DEFAULT_ENTRY_POINTS:
+        bundle_source, source_map = bundle(assets_path, entry_point)
+        bundle_path = get_bundle_path(entry_point)
+        assets_path.joinpath(bundle_path).write_text(bundle_source, encoding='utf-8')
+        assets_path.joinpath(f'{bundle_path}.map').write_text(source_map, encoding='utf-8')
+        bundle_paths.append(bundle_path)
+    return bundle_paths
+
+
+def main():
+    if len(sys.argv) < 2:
+        print('bundle_assets.py ASSETS_DIRECTORY [ENTRY_POINT ...]')
+        sys.exit(1)
+
+    try:
+        bundle_paths = bundle_assets(sys.argv[1], sys.argv[2:])
+    except (BundleError, OSError) as err:
+        print(f'Error bundling assets: {err}')
+        sys.exit(1)
+
+    for bundle_path in bundle_paths:
+        print(f'Bundled {bundle_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,8 @@
 import os
 import re
 import shutil
+import subprocess
+import sys
 from datetime import datetime
 from pathlib import Path
 from string import Template
@@ -430,6 +432,34 @@ class WidgetSupport(object):
         shutil.copytree(source_dir, dest_dir)
 
 
+    def bundle_assets(self):
+        """
+        Builds the bundled and minified Javascript runtime from the static widget
+        support assets; it is rebuilt by "make compile" as well.
+        """
+        script_path = self.get_module_path('widget/scripts/bundle_assets.py')
+        assets_dir = self.get_module_path('widget/assets')
+        try:
+            subprocess.run([sys.executable, str(script_path), str(assets_dir)],
+                           check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError as cpe:
+            error_exit(f"Error bundling widget assets: {cpe.stdout.decode('utf-8', 'replace')}")
+
+    def compile_widget_manifest(self):
+        """
+        Validates the widget config and compiles it into the manifest loaded by the
+        service at startup; it is recompiled by "make compile" as well.
+        """
+        env = dict(os.environ)
+        env['PYTHONPATH'] = str(self.get_module_path('lib'))
+        try:
+            subprocess.run([sys.executable, '-m', 'widget.lib.widget_manifest'],
+                           cwd=str(self.get_module_path('.')), env=env, check=True,
+                           stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError as cpe:
+            error_exit(f"Error compiling widget manifest: {cpe.stdout.decode('utf-8', 'replace')}")
+
+
     def get_server_file_path(self):
         server_filename = f"{self.sdk_module_name}Server.py"
         server_file_path = os.path.join(self.sdk_module_directory, 'lib', self.sdk_module_name, server_filename)
@@ -617,6 +647,13 @@ class WidgetSupport(object):
         self.copy_static_widget_support()
         success_feedback('Static widget support copied')
 
+        self.bundle_assets()
+        success_feedback('Widget assets bundled')
+
+        # The manifest indexes the assets, so is compiled after they are bundled.
+        self.compile_widget_manifest()
+        success_feedback('Widget manifest compiled')
+
         # add docs
         self.copy_docs()
         success_feedback('Widget docs copied')
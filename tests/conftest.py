@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The widget runtime is copied into a service as lib/widget, and imported from there
+# as "widget"; here it is imported from the resources it is copied from.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'resources', 'python-widget-support'))
@@ -0,0 +1,164 @@
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+SCRIPTS_PATH = os.path.join(os.path.dirname(__file__), '..', 'resources', 'static-widget-support', 'widget', 'scripts')
+ASSETS_PATH = os.path.join(os.path.dirname(__file__), '..', 'resources', 'static-widget-support', 'widget', 'assets')
+
+# The script is run by path in a service, so is not importable as a module.
+spec = importlib.util.spec_from_file_location('bundle_assets', os.path.join(SCRIPTS_PATH, 'bundle_assets.py'))
+bundle_assets = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(bundle_assets)
+
+BundleError = bundle_assets.BundleError
+
+
+def strip(source):
+    return [text for text, _ in bundle_assets.strip_source(source)]
+
+
+def test_comments_and_whitespace_are_removed():
+    source = '// header\n\n  const a  =  1; // one\n/* a\n   block */\n\tconst b = a /* inline */ + 2;\n'
+    assert strip(source) == ['const a = 1;', 'const b = a + 2;']
+
+
+def test_original_lines_are_kept():
+    source = '// header\n\nconst a = 1;\n/*\n\n*/\nconst b = 2;\n'
+    assert bundle_assets.strip_source(source) == [('const a = 1;', 2), ('const b = 2;', 6)]
+
+
+def test_strings_template_literals_and_regexes_are_left_intact():
+    source = (
+        "const a = '// not a comment';\n"
+        "const b = `  line one\n    line two ${ c  +  d } `;\n"
+        "const e = /\\/\\/  [/]+/g.test(x);\n"
+        "const f = g / h / i;\n"
+    )
+    assert strip(source) == [
+        "const a = '// not a comment';",
+        "const b = `  line one",
+        "    line two ${ c + d } `;",
+        "const e = /\\/\\/  [/]+/g.test(x);",
+        "const f = g / h / i;",
+    ]
+
+
+def test_unterminated_string_is_an_error():
+    with pytest.raises(BundleError):
+        bundle_assets.strip_source("const a = 'oops\n';")
+
+
+def test_imports_and_exports_are_rewritten():
+    source = (
+        "import def, { a, b as c } from './dep.js';\n"
+        "import * as ns from '../other.js';\n"
+        "export function f() {}\n"
+        "export default class K {}\n"
+        "export { a as z };\n"
+        "export * from './all.js';\n"
+    )
+    lines, dependencies, exports = bundle_assets.transform_module('js/lib.js', source)
+    texts = [text for text, _ in lines]
+    assert texts == [
+        'const def = __require("js/dep.js").default; const {a, b: c} = __require("js/dep.js");',
+        'const ns = __require("other.js");',
+        'function f() {}',
+        'class K {}',
+        '__exports.z = a;',
+        'Object.assign(__exports, __require("js/all.js"));',
+        '__exports.f = f;',
+        '__exports.default = K;',
+    ]
+    assert dependencies == ['js/dep.js', 'other.js', 'js/all.js']
+    assert exports == ['f', 'default', 'z']
+
+
+def test_multi_line_import_lists_are_joined():
+    lines, dependencies, _ = bundle_assets.transform_module('lib.js', "import {\n  a,\n  b\n} from './dep.js';\n")
+    assert [text for text, _ in lines] == ['const {a, b} = __require("dep.js");']
+
+
+@pytest.mark.parametrize('source', [
+    "import a from 'package';\n",
+    "import a from '../../outside.js';\n",
+    "export let {a, b} = c;\n",
+])
+def test_unsupported_imports_and_exports_are_errors(source):
+    with pytest.raises(BundleError):
+        bundle_assets.transform_module('js/lib.js', source)
+
+
+@pytest.mark.parametrize('value, encoded', [(0, 'A'), (1, 'C'), (-1, 'D'), (15, 'e'), (16, 'gB'), (-100, 'pG')])
+def test_vlq_encode(value, encoded):
+    assert bundle_assets.vlq_encode(value) == encoded
+
+
+def test_bundle_path():
+    assert bundle_assets.get_bundle_path('js/lib.js') == 'js/lib.bundle.js'
+
+
+@pytest.fixture
+def assets(tmp_path):
+    (tmp_path / 'js').mkdir()
+    (tmp_path / 'js' / 'lib.js').write_text(
+        "import { double } from './math.js';\n"
+        "import Greeter from './greeter.js';\n"
+        "export const result = double(21);\n"
+        "export { Greeter };\n"
+    )
+    (tmp_path / 'js' / 'math.js').write_text(
+        "// Arithmetic\n"
+        "export function double(x) {\n"
+        "    return x * 2;\n"
+        "}\n"
+    )
+    (tmp_path / 'js' / 'greeter.js').write_text(
+        "import { double } from './math.js';\n"
+        "export default class Greeter {\n"
+        "    greet(name) { return `hello ${name} ${double(1)}`; }\n"
+        "}\n"
+    )
+    return tmp_path
+
+
+def test_bundle_orders_dependencies_first_and_maps_lines(assets):
+    bundle_paths = bundle_assets.bundle_assets(assets)
+    assert bundle_paths == ['js/lib.bundle.js']
+
+    source = (assets / 'js' / 'lib.bundle.js').read_text()
+    source_map = json.loads((assets / 'js' / 'lib.bundle.js.map').read_text())
+    assert source_map['file'] == 'lib.bundle.js'
+    assert source_map['sources'] == ['math.js', 'greeter.js', 'lib.js']
+    assert source.count('__modules["js/math.js"]') == 1
+    assert source.rstrip().endswith('//# sourceMappingURL=lib.bundle.js.map')
+    assert len(source_map['mappings'].split(';')) == len(source.rstrip('\n').split('\n'))
+
+
+def test_missing_module_is_an_error(assets):
+    (assets / 'js' / 'math.js').unlink()
+    with pytest.raises(BundleError):
+        bundle_assets.bundle(assets, 'js/lib.js')
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='node is not installed')
+def test_bundle_runs(assets):
+    bundle_assets.bundle_assets(assets)
+    script = (
+        "import('./js/lib.bundle.js').then(({ result, Greeter }) => "
+        "console.log(JSON.stringify([result, new Greeter().greet('you')])));"
+    )
+    (assets / 'run.mjs').write_text(script)
+    (assets / 'js' / 'package.json').write_text('{"type": "module"}')
+    output = subprocess.run(['node', 'run.mjs'], cwd=assets, capture_output=True, text=True, check=True).stdout
+    assert json.loads(output) == [42, 'hello you 2']
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='node is not installed')
+def test_runtime_assets_bundle(tmp_path):
+    shutil.copytree(os.path.join(ASSETS_PATH, 'js'), tmp_path / 'js')
+    bundle_assets.bundle_assets(tmp_path)
+    subprocess.run(['node', '--check', str(tmp_path / 'js' / 'lib.bundle.js')], check=True)
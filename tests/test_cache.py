@@ -0,0 +1,115 @@
+import pytest
+
+from widget.lib import cache
+from widget.lib.cache import LRUCache, TTLCache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache, 'time', clock)
+    return clock
+
+
+def test_lru_counts_the_bytes_of_its_values():
+    lru = LRUCache(max_bytes=100)
+    lru.set('a', 'A', 30)
+    lru.set('b', 'B', 50)
+    assert lru.stats()['bytes'] == 80
+
+    # Replacing a value counts only its new size.
+    lru.set('a', 'A2', 10)
+    assert lru.get('a') == 'A2'
+    assert lru.stats()['bytes'] == 60
+    assert lru.stats()['entries'] == 2
+
+
+def test_lru_evicts_the_least_recently_used():
+    lru = LRUCache(max_bytes=100)
+    lru.set('a', 'A', 40)
+    lru.set('b', 'B', 40)
+    assert lru.get('a') == 'A'
+
+    lru.set('c', 'C', 40)
+    assert lru.get('b') is None
+    assert lru.get('a') == 'A'
+    assert lru.get('c') == 'C'
+    assert lru.stats()['bytes'] == 80
+    assert lru.stats()['evictions'] == 1
+
+
+def test_lru_evicts_as_many_as_needed():
+    lru = LRUCache(max_bytes=100)
+    for key in 'abcd':
+        lru.set(key, key, 25)
+    lru.set('e', 'e', 60)
+    assert [key for key in 'abcde' if lru.get(key) is not None] == ['d', 'e']
+    assert lru.stats()['bytes'] == 85
+
+
+def test_lru_does_not_cache_a_value_which_could_never_fit():
+    lru = LRUCache(max_bytes=100)
+    lru.set('a', 'A', 50)
+    lru.set('big', 'BIG', 101)
+    assert lru.get('big') is None
+    assert lru.get('a') == 'A'
+    assert lru.stats()['bytes'] == 50
+
+
+def test_lru_counts_hits_and_misses():
+    lru = LRUCache(max_bytes=100)
+    lru.set('a', 'A', 1)
+    lru.get('a')
+    lru.get('a')
+    lru.get('b')
+    stats = lru.stats()
+    assert (stats['hits'], stats['misses']) == (2, 1)
+
+
+def test_ttl_cache_entries_expire(clock):
+    ttl_cache = TTLCache(ttl=60)
+    ttl_cache.set('a', 'A')
+    clock.now += 59
+    assert ttl_cache.get('a') == 'A'
+    clock.now += 1
+    assert ttl_cache.get('a') is None
+    assert ttl_cache.stats()['entries'] == 0
+
+
+def test_ttl_cache_drops_the_oldest_entry_when_full():
+    ttl_cache = TTLCache(ttl=60, max_entries=2)
+    ttl_cache.set('a', 'A')
+    ttl_cache.set('b', 'B')
+    ttl_cache.set('c', 'C')
+    assert ttl_cache.get('a') is None
+    assert ttl_cache.get('b') == 'B'
+    assert ttl_cache.get('c') == 'C'
+    assert ttl_cache.stats()['evictions'] == 1
+
+
+def test_lru_entries_expire_after_the_ttl(clock):
+    lru = LRUCache(max_bytes=100, ttl=300)
+    lru.set('a', 'A', 40)
+    clock.now += 299
+    assert lru.get('a') == 'A'
+    clock.now += 1
+    assert lru.get('a') is None
+    # An expired entry no longer counts towards the size.
+    assert lru.stats()['bytes'] == 0
+
+
+def test_lru_ttl_restarts_when_a_value_is_replaced(clock):
+    lru = LRUCache(max_bytes=100, ttl=300)
+    lru.set('a', 'A', 40)
+    clock.now += 200
+    lru.set('a', 'A2', 40)
+    clock.now += 200
+    assert lru.get('a') == 'A2'
@@ -0,0 +1,82 @@
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from widget.lib.widget_base import WidgetBase
+from widget.lib.widget_error import WidgetError
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='widget-call')
+    yield executor
+    executor.shutdown(wait=True)
+
+
+def make_widget(executor, render_budget=None):
+    # Only what call_concurrently uses is set up.
+    widget = WidgetBase.__new__(WidgetBase)
+    widget.widget_support = types.SimpleNamespace(executor=executor)
+    widget.deadline = None if render_budget is None else time.monotonic() + render_budget
+    return widget
+
+
+def test_results_are_in_the_order_of_the_calls(executor):
+    widget = make_widget(executor)
+    calls = [lambda value=value: value for value in range(10)]
+    assert widget.call_concurrently(calls) == list(range(10))
+    assert widget.call_concurrently([]) == []
+
+
+def test_calls_run_at_the_same_time(executor):
+    widget = make_widget(executor)
+    barrier = threading.Barrier(3, timeout=5)
+    assert len(widget.call_concurrently([barrier.wait] * 3)) == 3
+
+
+def test_nested_calls_do_not_wait_on_the_pool(executor):
+    widget = make_widget(executor, render_budget=5)
+
+    def outer(value):
+        return lambda: widget.call_concurrently([lambda: value, lambda: value * 10])
+
+    assert widget.call_concurrently([outer(1), outer(2), outer(3), outer(4)], timeout=5000) == [
+        [1, 10], [2, 20], [3, 30], [4, 40]
+    ]
+
+
+def test_the_first_error_is_raised(executor):
+    widget = make_widget(executor)
+
+    def fail(message):
+        def call():
+            raise WidgetError(title='Call Error', code='call-error', message=message)
+        return call
+
+    with pytest.raises(WidgetError) as info:
+        widget.call_concurrently([lambda: 1, fail('first'), fail('second')])
+    assert info.value.message == 'first'
+
+
+def test_a_slow_call_on_the_pool_times_out(executor):
+    widget = make_widget(executor)
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+
+    def first():
+        # The slow call is started by the pool before it is waited for.
+        started.wait(5)
+
+    try:
+        with pytest.raises(WidgetError) as info:
+            widget.call_concurrently([first, slow], timeout=50)
+        assert info.value.code == 'timeout-error'
+    finally:
+        release.set()
@@ -0,0 +1,51 @@
+import gzip
+
+import pytest
+
+from widget.lib import compression
+from widget.lib.cache import LRUCache
+from widget.lib.compression import accepts_gzip, gzip_bytes, gzip_cached, gzip_chunks, is_compressible
+
+
+@pytest.mark.parametrize('accept_encoding, expected', [
+    (None, False),
+    ('gzip', True),
+    ('gzip, deflate, br', True),
+    ('deflate, GZIP', True),
+    ('*', True),
+    ('gzip;q=0.5', True),
+    ('gzip;q=0', False),
+    ('gzip; q=0', False),
+    ('gzip;q=zero', False),
+    ('deflate, br', False),
+])
+def test_accepts_gzip(accept_encoding, expected):
+    request_env = {} if accept_encoding is None else {'HTTP_ACCEPT_ENCODING': accept_encoding}
+    assert accepts_gzip(request_env) is expected
+
+
+def test_is_compressible():
+    assert is_compressible('text/html; charset=utf-8')
+    assert is_compressible('application/json')
+    assert not is_compressible('image/png')
+    assert not is_compressible(None)
+
+
+def test_gzip_output_depends_only_on_the_content():
+    content = b'<p>hello</p>' * 100
+    assert gzip.decompress(gzip_bytes(content)) == content
+    assert gzip_bytes(content) == gzip_bytes(content)
+
+
+def test_gzip_chunks_decompress_to_the_content():
+    chunks = [b'<html>', b'<p>hello</p>' * 50, b'', b'</html>']
+    assert gzip.decompress(b''.join(gzip_chunks(chunks))) == b''.join(chunks)
+
+
+def test_gzip_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(compression, 'GZIP_CACHE', LRUCache(max_bytes=1000))
+    for index in range(100):
+        content = str(index).encode('ascii') * 1000
+        assert gzip.decompress(gzip_cached(content)) == content
+    assert compression.GZIP_CACHE.stats()['bytes'] <= 1000
+    assert compression.GZIP_CACHE.stats()['evictions'] > 0
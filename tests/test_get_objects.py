@@ -0,0 +1,174 @@
+import threading
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from widget.lib.cache import LRUCache, TTLCache
+from widget.lib.widget_base import WidgetBase
+from widget.lib.widget_error import WidgetError
+
+ALLOWED_TYPES = ['KBaseGenomes.Genome']
+
+# The size of the get_objects2 response, per object.
+RESPONSE_SIZE = 5000
+
+
+def object_info(workspace_id, object_id, type_id='KBaseGenomes.Genome-17.0', size=100):
+    return [object_id, f"object_{object_id}", type_id, '2024-01-01T00:00:00+0000', 1, 'someone',
+            workspace_id, f"workspace_{workspace_id}", 'checksum', size, {}]
+
+
+def workspace_info(workspace_id):
+    return [workspace_id, f"workspace_{workspace_id}", 'someone', '2024-01-01T00:00:00+0000', 10, 'r', 'n', 'unlocked', {}]
+
+
+class FakeWorkspace(object):
+    """
+    Answers Workspace calls from the given infos, by ref, recording each call; the
+    results are those at the result path, as GenericClient returns them.
+    """
+    def __init__(self, infos, missing_data=(), error=None):
+        self.infos = infos
+        self.missing_data = set(missing_data)
+        self.error = error
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def call_func(self, func_name, params, timeout=None, max_response_bytes=None, result_path=None, with_size=False):
+        with self.lock:
+            self.calls.append((func_name, params))
+        if self.error is not None:
+            raise self.error
+        if func_name == 'get_object_info3':
+            assert params[0]['ignoreErrors'] == 1
+            return [self.infos[spec['ref']] for spec in params[0]['objects']]
+        if func_name == 'get_objects2':
+            assert with_size
+            data = [
+                None if spec['ref'] in self.missing_data else {'data': {'ref': spec['ref']}, 'info': None}
+                for spec in params[0]['objects']
+            ]
+            return data, RESPONSE_SIZE * len(data)
+        if func_name == 'get_workspace_info':
+            return [workspace_info(params[0]['id'])]
+        raise AssertionError(f"unexpected call {func_name}")
+
+    def get_calls(self, func_name):
+        return [params for name, params in self.calls if name == func_name]
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='widget-call')
+    yield executor
+    executor.shutdown(wait=True)
+
+
+def make_widget_support(executor):
+    return types.SimpleNamespace(
+        executor=executor,
+        object_cache=LRUCache(max_bytes=1_000_000),
+        workspace_info_cache=TTLCache(ttl=30)
+    )
+
+
+def make_widget(executor, workspace, widget_support=None):
+    # Only what get_objects uses is set up.
+    widget = WidgetBase.__new__(WidgetBase)
+    widget.widget_support = widget_support or make_widget_support(executor)
+    widget.token = 'token'
+    widget.included = None
+    widget.deadline = None
+    widget.object_infos = {}
+    widget.get_workspace_client = lambda: workspace
+    return widget
+
+
+def test_results_are_in_the_order_of_the_refs(executor):
+    workspace = FakeWorkspace({
+        'a': object_info(1, 1),
+        'b': object_info(2, 1),
+        'c': object_info(1, 2),
+    })
+    results = make_widget(executor, workspace).get_objects(['c', 'a', 'b'], ALLOWED_TYPES)
+    assert [result['ref'] for result in results] == ['c', 'a', 'b']
+    assert [result['object']['data']['ref'] for result in results] == ['1/2/1', '1/1/1', '2/1/1']
+    assert [result['workspace_info']['workspace_id'] for result in results] == [1, 1, 2]
+    assert all(result['error'] is None for result in results)
+
+    # All the objects are fetched with a single call.
+    assert len(workspace.get_calls('get_object_info3')) == 1
+    assert len(workspace.get_calls('get_objects2')) == 1
+
+
+def test_workspace_info_is_fetched_once_per_workspace(executor):
+    workspace = FakeWorkspace({ref: object_info(1, object_id) for object_id, ref in enumerate('abc', 1)})
+    make_widget(executor, workspace).get_objects(['a', 'b', 'c'], ALLOWED_TYPES)
+    assert workspace.get_calls('get_workspace_info') == [[{'id': 1}]]
+
+
+def test_unavailable_objects_have_an_error_each(executor):
+    workspace = FakeWorkspace({
+        'missing': None,
+        'wrong_type': object_info(1, 2, type_id='KBaseFBA.FBAModel-1.0'),
+        'too_big': object_info(1, 3, size=WidgetBase.MAX_OBJECT_SIZE + 1),
+        'unfetched': object_info(1, 4),
+        'good': object_info(1, 5),
+    }, missing_data=['1/4/1'])
+    results = make_widget(executor, workspace).get_objects(
+        ['missing', 'wrong_type', 'too_big', 'unfetched', 'good'], ALLOWED_TYPES
+    )
+    codes = [None if result['error'] is None else result['error'].code for result in results]
+    assert codes == ['object-not-found', 'incorrect-type', 'file-too-big', 'object-not-found', None]
+    assert [result['object'] is None for result in results] == [True, True, True, True, False]
+    assert results[0]['error'].message == 'The object missing was not found, or is not accessible'
+
+    # Objects which are not available are not fetched.
+    assert workspace.get_calls('get_objects2')[0][0]['objects'] == [{'ref': '1/4/1'}, {'ref': '1/5/1'}]
+
+
+def test_nothing_more_is_fetched_if_no_object_is_available(executor):
+    workspace = FakeWorkspace({'missing': None})
+    results = make_widget(executor, workspace).get_objects(['missing'], ALLOWED_TYPES)
+    assert results[0]['error'].code == 'object-not-found'
+    assert [name for name, _ in workspace.calls] == ['get_object_info3']
+
+
+def test_a_failed_batch_is_an_error_fetching_objects(executor):
+    workspace = FakeWorkspace({}, error=ValueError('connection reset'))
+    with pytest.raises(WidgetError) as info:
+        make_widget(executor, workspace).get_objects(['a', 'b'], ALLOWED_TYPES)
+    assert info.value.code == 'error-fetching-object'
+    assert info.value.message == 'connection reset'
+
+
+def test_a_failed_call_keeps_its_error(executor):
+    error = WidgetError(title='Call Error', code='call-error', message='Workspace is down')
+    workspace = FakeWorkspace({}, error=error)
+    with pytest.raises(WidgetError) as info:
+        make_widget(executor, workspace).get_objects(['a'], ALLOWED_TYPES)
+    assert info.value is error
+
+
+def test_fetched_objects_are_cached(executor):
+    workspace = FakeWorkspace({'a': object_info(1, 1)})
+    widget_support = make_widget_support(executor)
+    make_widget(executor, workspace, widget_support).get_objects(['a'], ALLOWED_TYPES)
+    # Another request still looks up the info, which enforces the user's access, but
+    # not the object.
+    results = make_widget(executor, workspace, widget_support).get_objects(['a'], ALLOWED_TYPES)
+    assert results[0]['object']['data']['ref'] == '1/1/1'
+    assert len(workspace.get_calls('get_object_info3')) == 2
+    assert len(workspace.get_calls('get_objects2')) == 1
+
+
+def test_cached_objects_are_sized_by_their_info_or_their_share_of_the_response(executor):
+    workspace = FakeWorkspace({'a': object_info(1, 1, size=300), 'b': object_info(1, 2, size=400)})
+    widget_support = make_widget_support(executor)
+    make_widget(executor, workspace, widget_support).get_objects(['a', 'b'], ALLOWED_TYPES)
+    assert widget_support.object_cache.stats()['bytes'] == 700
+
+    widget_support = make_widget_support(executor)
+    make_widget(executor, workspace, widget_support).get_objects(['a', 'b'], ALLOWED_TYPES, included=['/id'])
+    assert widget_support.object_cache.stats()['bytes'] == 2 * RESPONSE_SIZE
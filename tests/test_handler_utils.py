@@ -0,0 +1,110 @@
+import types
+from email.utils import formatdate
+
+import pytest
+
+from widget.lib.handler_utils import (RangeNotSatisfiable, is_not_modified, is_range_current, make_etag,
+                                      parse_range)
+
+MTIME = 1700000000.5
+ETAG = make_etag(1700000000500000000, 1234)
+
+
+def test_etag_depends_on_mtime_size_and_encoding():
+    assert ETAG == make_etag(1700000000500000000, 1234)
+    assert ETAG != make_etag(1700000000500000001, 1234)
+    assert ETAG != make_etag(1700000000500000000, 1235)
+    assert ETAG != make_etag(1700000000500000000, 1234, 'gzip')
+    assert ETAG.startswith('"') and ETAG.endswith('"')
+
+
+def test_matching_etag_is_not_modified():
+    assert is_not_modified({'HTTP_IF_NONE_MATCH': ETAG}, ETAG, MTIME)
+    assert not is_not_modified({'HTTP_IF_NONE_MATCH': '"other"'}, ETAG, MTIME)
+
+
+def test_weak_etag_matches():
+    assert is_not_modified({'HTTP_IF_NONE_MATCH': f'W/{ETAG}'}, ETAG, MTIME)
+
+
+def test_any_etag_in_a_list_matches():
+    assert is_not_modified({'HTTP_IF_NONE_MATCH': f'"a", W/"b" ,{ETAG}'}, ETAG, MTIME)
+    assert not is_not_modified({'HTTP_IF_NONE_MATCH': '"a", W/"b"'}, ETAG, MTIME)
+
+
+def test_star_matches_anything():
+    assert is_not_modified({'HTTP_IF_NONE_MATCH': '*'}, ETAG, MTIME)
+
+
+def test_if_none_match_takes_precedence_over_if_modified_since():
+    request_env = {
+        'HTTP_IF_NONE_MATCH': '"other"',
+        'HTTP_IF_MODIFIED_SINCE': formatdate(MTIME + 60, usegmt=True)
+    }
+    assert not is_not_modified(request_env, ETAG, MTIME)
+
+
+def test_if_modified_since_is_compared_to_the_second():
+    assert is_not_modified({'HTTP_IF_MODIFIED_SINCE': formatdate(int(MTIME), usegmt=True)}, ETAG, MTIME)
+    assert not is_not_modified({'HTTP_IF_MODIFIED_SINCE': formatdate(MTIME - 1, usegmt=True)}, ETAG, MTIME)
+
+
+def test_if_modified_since_is_ignored_without_an_mtime():
+    assert not is_not_modified({'HTTP_IF_MODIFIED_SINCE': formatdate(MTIME + 60, usegmt=True)}, ETAG, None)
+
+
+def test_invalid_if_modified_since_is_modified():
+    assert not is_not_modified({'HTTP_IF_MODIFIED_SINCE': 'yesterday'}, ETAG, MTIME)
+
+
+def test_unconditional_request_is_modified():
+    assert not is_not_modified({}, ETAG, MTIME)
+
+
+@pytest.mark.parametrize('range_header, expected', [
+    ('bytes=0-99', (0, 99)),
+    ('bytes=100-199', (100, 199)),
+    ('bytes=900-', (900, 999)),
+    # An end beyond the file is the end of the file.
+    ('bytes=900-5000', (900, 999)),
+    ('bytes=999-999', (999, 999)),
+    # Suffix ranges are the last N bytes, or the whole file if it is shorter.
+    ('bytes=-100', (900, 999)),
+    ('bytes=-1', (999, 999)),
+    ('bytes=-5000', (0, 999)),
+])
+def test_range(range_header, expected):
+    assert parse_range(range_header, 1000) == expected
+
+
+@pytest.mark.parametrize('range_header', [
+    'items=0-99',
+    'bytes=0-99,200-299',
+    'bytes=100',
+    'bytes=abc-',
+    'bytes=0-abc',
+    # An end before the start is invalid, and so ignored.
+    'bytes=200-100',
+])
+def test_range_which_is_ignored(range_header):
+    assert parse_range(range_header, 1000) is None
+
+
+@pytest.mark.parametrize('range_header, size', [
+    ('bytes=1000-', 1000),
+    ('bytes=1000-2000', 1000),
+    ('bytes=-0', 1000),
+    ('bytes=0-', 0),
+    ('bytes=-10', 0),
+])
+def test_range_not_satisfiable(range_header, size):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(range_header, size)
+
+
+def test_range_is_current_for_the_etag_or_last_modified():
+    static_file = types.SimpleNamespace(etag=ETAG, last_modified=formatdate(MTIME, usegmt=True))
+    assert is_range_current({}, static_file)
+    assert is_range_current({'HTTP_IF_RANGE': ETAG}, static_file)
+    assert is_range_current({'HTTP_IF_RANGE': static_file.last_modified}, static_file)
+    assert not is_range_current({'HTTP_IF_RANGE': '"other"'}, static_file)
@@ -0,0 +1,104 @@
+import types
+
+import pytest
+
+from widget.lib import json_stream
+from widget.lib.json_stream import BoundedReader, can_stream_path, get_path, loads, stream_result_path
+from widget.lib.widget_error import WidgetError
+
+RESPONSE = b'{"version": "1.1", "result": [{"data": [{"info": [1, "name"], "data": {"size": 2.5}}]}]}'
+
+
+def chunks_of(content, size):
+    return [content[offset:offset + size] for offset in range(0, len(content), size)]
+
+
+def test_loads():
+    assert loads(RESPONSE)['result'][0]['data'][0]['info'] == [1, 'name']
+
+
+def test_bounded_reader_reads_everything_within_the_limit():
+    reader = BoundedReader(chunks_of(RESPONSE, 7), max_bytes=len(RESPONSE))
+    assert reader.read() == RESPONSE
+
+
+def test_bounded_reader_reads_by_size():
+    reader = BoundedReader([b'', b'abc', b'defgh', b'', b'ij'])
+    assert reader.read(2) == b'ab'
+    assert reader.read(4) == b'cdef'
+    assert reader.read(10) == b'ghij'
+    assert reader.read(10) == b''
+
+
+def test_bounded_reader_stops_as_soon_as_the_limit_is_exceeded():
+    read = []
+
+    def chunks():
+        for chunk in chunks_of(RESPONSE, 10):
+            read.append(chunk)
+            yield chunk
+
+    reader = BoundedReader(chunks(), max_bytes=25)
+    with pytest.raises(WidgetError) as info:
+        reader.read()
+    assert info.value.code == 'response-too-big'
+    assert len(read) == 3
+
+
+def test_get_path():
+    result = loads(RESPONSE)['result']
+    assert get_path(result, [0, 'data', 0, 'data', 'size']) == 2.5
+    assert get_path(result, []) is result
+    with pytest.raises(KeyError):
+        get_path(result, [0, 'missing'])
+
+
+def test_only_first_list_elements_can_be_streamed(monkeypatch):
+    monkeypatch.setattr(json_stream, 'ijson', object())
+    assert can_stream_path([0, 'data', 0, 'data'])
+    assert not can_stream_path([0, 'data', 1, 'data'])
+
+
+def test_nothing_is_streamed_without_ijson(monkeypatch):
+    monkeypatch.setattr(json_stream, 'ijson', None)
+    assert not can_stream_path([0, 'data'])
+
+
+@pytest.mark.skipif(json_stream.ijson is None, reason='ijson is not installed')
+def test_stream_result_path():
+    reader = BoundedReader(chunks_of(RESPONSE, 5))
+    assert stream_result_path(reader, [0, 'data', 0, 'data']) == {'size': 2.5}
+
+
+@pytest.mark.skipif(json_stream.ijson is None, reason='ijson is not installed')
+def test_stream_result_path_which_is_missing():
+    with pytest.raises(WidgetError) as info:
+        stream_result_path(BoundedReader([RESPONSE]), [0, 'missing'])
+    assert info.value.code == 'incorrect-result-error'
+
+
+@pytest.mark.skipif(json_stream.ijson is None, reason='ijson is not installed')
+@pytest.mark.parametrize('content', [RESPONSE[:40], b'{"version": "1.1", "result": [{"data": [nope]}]}'])
+def test_stream_result_path_of_invalid_json(content):
+    with pytest.raises(WidgetError) as info:
+        stream_result_path(BoundedReader(chunks_of(content, 5)), [0, 'data'])
+    assert info.value.code == 'incorrect-result-error'
+    assert info.value.message.startswith('The response is not valid JSON: ')
+
+
+def test_stream_result_path_error_is_that_of_the_json_path(monkeypatch):
+    class JSONError(Exception):
+        pass
+
+    class IncompleteJSONError(JSONError):
+        pass
+
+    def items(reader, prefix, use_float=False):
+        raise IncompleteJSONError('parse error: premature EOF')
+        yield
+
+    monkeypatch.setattr(json_stream, 'ijson', types.SimpleNamespace(JSONError=JSONError, items=items))
+    with pytest.raises(WidgetError) as info:
+        stream_result_path(BoundedReader([RESPONSE[:40]]), [0, 'data'])
+    assert info.value.code == 'incorrect-result-error'
+    assert info.value.message == 'The response is not valid JSON: parse error: premature EOF'
@@ -0,0 +1,60 @@
+import gc
+import threading
+
+from widget.lib.metrics import DURATION_BUCKETS, Metrics
+
+LABELS = (('widget', 'viewer'), ('status', '200'))
+
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_counters_are_added_across_threads():
+    metrics = Metrics()
+    run_threads(10, lambda: [metrics.inc('widget_requests_total', LABELS) for _ in range(100)])
+    metrics.inc('widget_requests_total', LABELS, 5)
+    counters, _ = metrics.collect()
+    assert counters[('widget_requests_total', LABELS)] == 1005
+
+
+def test_shards_of_finished_threads_are_retired():
+    metrics = Metrics()
+    run_threads(50, lambda: metrics.inc('widget_requests_total', LABELS))
+    gc.collect()
+    assert len(metrics.shards) == 0
+
+    counters, _ = metrics.collect()
+    assert counters[('widget_requests_total', LABELS)] == 50
+
+
+def test_histogram_buckets():
+    metrics = Metrics()
+    for value in (0.001, 0.005, 0.3, 100):
+        metrics.observe('widget_request_duration_seconds', LABELS, value)
+    _, histograms = metrics.collect()
+    histogram = histograms[('widget_request_duration_seconds', LABELS)]
+    assert histogram[DURATION_BUCKETS.index(0.005)] == 2
+    assert histogram[DURATION_BUCKETS.index(0.5)] == 1
+    assert sum(histogram[:len(DURATION_BUCKETS)]) == 3
+    assert histogram[-1] == 4
+    assert abs(histogram[-2] - 100.306) < 1e-9
+
+
+def test_render():
+    metrics = Metrics()
+    metrics.inc('widget_requests_total', LABELS, 2)
+    metrics.observe('widget_request_duration_seconds', LABELS, 0.02)
+    text = metrics.render(sampled=[('widget_cache_entries', 'gauge', 'Cached entries.', [((('cache', 'objects'),), 3)])])
+    lines = text.splitlines()
+    assert 'widget_requests_total{widget="viewer",status="200"} 2' in lines
+    assert 'widget_request_duration_seconds_bucket{widget="viewer",status="200",le="0.01"} 0' in lines
+    assert 'widget_request_duration_seconds_bucket{widget="viewer",status="200",le="0.025"} 1' in lines
+    assert 'widget_request_duration_seconds_bucket{widget="viewer",status="200",le="+Inf"} 1' in lines
+    assert 'widget_request_duration_seconds_count{widget="viewer",status="200"} 1' in lines
+    assert '# TYPE widget_cache_entries gauge' in lines
+    assert 'widget_cache_entries{cache="objects"} 3' in lines
@@ -0,0 +1,139 @@
+import types
+
+import pytest
+
+from widget.handlers.python_widget import PythonWidget
+
+PAGE = b'<html>' + b'x' * 100 + b'</html>'
+
+
+class FakeWidget(object):
+    """
+    A widget whose validator and page are set by the test.
+    """
+    validator_value = ('1/2/3', 'r')
+    renders = 0
+
+    def __init__(self, **kwargs):
+        self.failed = False
+
+    def validator(self):
+        if isinstance(self.validator_value, Exception):
+            raise self.validator_value
+        return self.validator_value
+
+    def cache_key(self):
+        return None
+
+    def render(self):
+        FakeWidget.renders += 1
+        return PAGE
+
+
+@pytest.fixture(autouse=True)
+def reset_widget():
+    FakeWidget.validator_value = ('1/2/3', 'r')
+    FakeWidget.renders = 0
+
+
+def make_handler(runtime_mode='PRODUCTION', gzip_min_bytes=None, service_instance_hash='abc', templates_mtime=1):
+    widget_support = types.SimpleNamespace(
+        service_instance_hash=service_instance_hash,
+        template_registry=types.SimpleNamespace(get_templates_mtime=lambda package: templates_mtime)
+    )
+    handler = PythonWidget(
+        service_package_name='service', name='viewer', title='Viewer', description='',
+        service_config={}, widget_config={'runtime_mode': runtime_mode}, widget_package_name='viewer',
+        path=None, widget_support=widget_support, gzip_min_bytes=gzip_min_bytes
+    )
+    handler.widget_mod = types.SimpleNamespace(Widget=FakeWidget)
+    return handler
+
+
+def get_etag(handler, **request_env):
+    status, _, content, headers = handler.handle(None, request_env)
+    assert status == '200 OK' and content == PAGE
+    etag = dict(headers).get('etag')
+    if etag is not None:
+        assert dict(headers)['cache-control'] == 'private, no-cache'
+    return etag
+
+
+def test_matching_etag_is_not_modified():
+    handler = make_handler()
+    etag = get_etag(handler)
+    assert etag.startswith('W/"')
+
+    status, _, content, headers = handler.handle(None, {'HTTP_IF_NONE_MATCH': etag})
+    assert status == '304 Not Modified'
+    assert content == b''
+    assert dict(headers)['etag'] == etag
+    assert 'vary' not in dict(headers)
+    # The page is not rendered to revalidate it.
+    assert FakeWidget.renders == 1
+
+    assert get_etag(handler, HTTP_IF_NONE_MATCH='W/"other"') == etag
+
+
+def test_not_modified_varies_by_encoding_when_compressing():
+    handler = make_handler(gzip_min_bytes=10)
+    status, _, _, headers = handler.handle(None, {})
+    etag = dict(headers)['etag']
+    status, _, _, headers = handler.handle(None, {'HTTP_IF_NONE_MATCH': etag, 'HTTP_ACCEPT_ENCODING': 'gzip'})
+    assert status == '304 Not Modified'
+    assert dict(headers)['vary'] == 'Accept-Encoding'
+    assert 'content-encoding' not in dict(headers)
+
+
+def test_no_etag_in_development():
+    assert get_etag(make_handler(runtime_mode='DEVELOPMENT')) is None
+
+
+@pytest.mark.parametrize('validator_value', [None, ValueError('no object')])
+def test_no_etag_without_a_validator(validator_value):
+    FakeWidget.validator_value = validator_value
+    handler = make_handler()
+    assert get_etag(handler) is None
+    assert get_etag(handler, HTTP_IF_NONE_MATCH='*') is None
+
+
+def test_etag_changes_with_the_validator_service_and_templates():
+    etag = get_etag(make_handler())
+    assert get_etag(make_handler()) == etag
+    assert get_etag(make_handler(templates_mtime=2)) != etag
+    assert get_etag(make_handler(service_instance_hash='def')) != etag
+    FakeWidget.validator_value = ('1/2/4', 'r')
+    assert get_etag(make_handler()) != etag
+
+
+def test_error_page_has_no_etag():
+    class FailingWidget(FakeWidget):
+        def render(self):
+            self.failed = True
+            return b'error'
+
+    handler = make_handler()
+    handler.widget_mod = types.SimpleNamespace(Widget=FailingWidget)
+    status, _, content, headers = handler.handle(None, {})
+    assert (status, content) == ('200 OK', b'error')
+    assert 'etag' not in dict(headers)
+
+
+def test_widget_which_cannot_be_loaded_is_an_error(capsys):
+    handler = make_handler()
+    handler.widget_package_name = 'no_such_widget'
+    handler.widget_mod = None
+    assert not handler.has_module()
+
+    status, content_type, content, _ = handler.handle(None, {})
+    assert status == '500 Internal Server Error'
+    assert content_type.startswith('text/plain')
+    assert content == b'The widget viewer could not be loaded'
+    assert '!! Widget viewer could not be loaded' in capsys.readouterr().out
+    assert handler.widget_mod is None
+
+
+def test_widget_module_is_found_without_loading_it():
+    handler = make_handler()
+    handler.widget_package_name = 'minimal_example'
+    assert handler.has_module()
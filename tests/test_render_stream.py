@@ -0,0 +1,70 @@
+import types
+
+import jinja2
+
+from widget.lib.timing import RequestTiming
+from widget.lib.widget_base import WidgetBase
+from widget.lib.widget_error import WidgetError
+
+TEMPLATES = {
+    'index.html': '<ul>{% for item in items %}<li>{{ item }}</li>{% endfor %}</ul>',
+    'error.html': '<p>{{ error.code }}: {{ error.message }}</p>',
+}
+
+
+class ListWidget(WidgetBase):
+    items = [f"item é {index}" for index in range(5000)]
+
+    def context(self):
+        return {'items': self.items}
+
+
+class FailingWidget(WidgetBase):
+    def context(self):
+        raise WidgetError(title='Error', code='object-not-found', message='no such object')
+
+
+def make_widget(widget_class):
+    # Only what rendering uses is set up.
+    widget = widget_class.__new__(widget_class)
+    widget.env = jinja2.Environment(loader=jinja2.DictLoader(TEMPLATES))
+    widget.widget_support = types.SimpleNamespace(assets=None)
+    widget.widget_config = {'service_url': 'http://service'}
+    widget.service_config = {}
+    widget.widget_package_name = 'viewer'
+    widget.token = None
+    widget.timing = RequestTiming()
+    widget.failed = False
+    return widget
+
+
+def test_streamed_page_is_the_rendered_page():
+    page = make_widget(ListWidget).render_page()
+    chunks = list(make_widget(ListWidget).render_stream())
+    assert b''.join(chunks) == page
+    assert len(page) > 4 * WidgetBase.STREAM_CHUNK_SIZE
+
+
+def test_chunks_are_coalesced():
+    chunks = list(make_widget(ListWidget).stream_page())
+    assert len(chunks) > 1
+    # Only the last chunk may be smaller.
+    assert all(len(chunk) >= WidgetBase.STREAM_CHUNK_SIZE for chunk in chunks[:-1])
+    assert 0 < len(chunks[-1])
+
+
+def test_small_page_is_one_chunk():
+    widget = make_widget(ListWidget)
+    widget.items = ['one', 'two']
+    assert list(widget.stream_page()) == [b'<ul><li>one</li><li>two</li></ul>']
+
+
+def test_context_error_is_rendered_before_streaming():
+    widget = make_widget(FailingWidget)
+    # The error is found when the stream is created, before any chunk is consumed,
+    # and so may still be sent as the whole page.
+    content = widget.render_stream()
+    assert widget.failed
+    assert isinstance(content, list)
+    assert content == [b'<p>object-not-found: no such object</p>']
+    assert content[0] == make_widget(FailingWidget).render()
@@ -0,0 +1,182 @@
+import json
+
+import pytest
+from requests.exceptions import ConnectionError
+
+from widget.lib.generic_client import GenericClient
+from widget.lib.resilience import CircuitBreaker, LatencyTracker, RetryPolicy, Upstreams
+from widget.lib.widget_error import WidgetError
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.content = json.dumps(body).encode('utf-8')
+        self.headers = {'content-length': str(len(self.content))}
+
+    def iter_content(self, chunk_size):
+        yield self.content
+
+    def close(self):
+        pass
+
+
+class FakeSession(object):
+    """
+    Answers each post with the next of the given outcomes: a status code, with a
+    JSON-RPC error for 500, or an exception to raise.
+    """
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.posts = 0
+
+    def post(self, url, json=None, timeout=None, headers=None, stream=False):
+        self.posts += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        if outcome == 500:
+            return FakeResponse(outcome, {'version': '1.1', 'error': {'message': 'no such object'}})
+        return FakeResponse(outcome, {'version': '1.1', 'result': ['ok']})
+
+
+def make_client(session, upstream=None, max_retries=2):
+    return GenericClient(
+        'Workspace', 'http://workspace', session=session, upstream=upstream,
+        retry_policy=RetryPolicy(max_retries=max_retries, backoff=1, max_backoff=2)
+    )
+
+
+def test_backoff_is_jittered_and_capped():
+    policy = RetryPolicy(backoff=100, max_backoff=300)
+    for attempt, ceiling in ((1, 0.1), (2, 0.2), (3, 0.3), (10, 0.3)):
+        delays = [policy.get_backoff(attempt) for _ in range(200)]
+        assert all(0 <= delay <= ceiling for delay in delays)
+        assert len(set(delays)) > 1
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_breaker_allows_a_trial_call_after_the_reset_timeout():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    breaker.opened_at -= 30
+
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Only the one trial call is allowed while it is in progress.
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_breaker_reopens_when_the_trial_call_fails():
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=30)
+    for _ in range(5):
+        breaker.record_failure()
+    breaker.opened_at -= 30
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_latency_percentile():
+    tracker = LatencyTracker(window=100)
+    assert tracker.percentile(50) is None
+    for duration in range(1, 101):
+        tracker.record(duration / 1000)
+    assert tracker.percentile(50) == 0.051
+    assert tracker.percentile(95) == 0.096
+    assert tracker.percentile(100) == 0.1
+    assert tracker.percentile(50, min_samples=101) is None
+
+
+def test_latency_window_keeps_recent_calls():
+    tracker = LatencyTracker(window=10)
+    for duration in range(20):
+        tracker.record(duration)
+    assert tracker.percentile(0) == 10
+
+
+def test_upstreams_are_shared_by_url():
+    upstreams = Upstreams(failure_threshold=2)
+    assert upstreams.get('http://a') is upstreams.get('http://a')
+    assert upstreams.get('http://a') is not upstreams.get('http://b')
+    assert upstreams.get('http://a').breaker.failure_threshold == 2
+    assert upstreams.get('http://a').get_latency('get_objects2') is upstreams.get('http://a').get_latency('get_objects2')
+
+
+def test_read_call_is_retried_when_unavailable():
+    session = FakeSession(ConnectionError('refused'), 503, 200)
+    assert make_client(session).call_func('get_objects2', [{}]) == ['ok']
+    assert session.posts == 3
+
+
+def test_call_returns_the_size_of_the_response_if_asked():
+    session = FakeSession(200)
+    result, size = make_client(session).call_func('get_objects2', [{}], with_size=True)
+    assert result == ['ok']
+    assert size == len(json.dumps({'version': '1.1', 'result': ['ok']}))
+
+
+def test_read_call_fails_when_retries_are_exhausted():
+    session = FakeSession(503, 503, 503, 200)
+    with pytest.raises(WidgetError) as info:
+        make_client(session).call_func('get_objects2', [{}])
+    assert info.value.code == 'service-unavailable'
+    assert session.posts == 3
+
+
+def test_write_call_is_not_retried():
+    session = FakeSession(ConnectionError('refused'), 200)
+    with pytest.raises(WidgetError) as info:
+        make_client(session).call_func('save_objects', [{}])
+    assert info.value.code == 'connection-error'
+    assert session.posts == 1
+
+
+def test_other_errors_are_not_retried():
+    session = FakeSession(500, 200)
+    with pytest.raises(WidgetError) as info:
+        make_client(session).call_func('get_objects2', [{}])
+    assert info.value.code == 'call-error'
+    assert session.posts == 1
+
+
+def test_open_breaker_fails_calls_without_sending_them():
+    upstream = Upstreams(failure_threshold=2).get('http://workspace')
+    session = FakeSession(503, 503, 200)
+    with pytest.raises(WidgetError):
+        make_client(session, upstream=upstream, max_retries=1).call_func('get_objects2', [{}])
+    assert upstream.breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(WidgetError) as info:
+        make_client(session, upstream=upstream).call_func('get_objects2', [{}])
+    assert info.value.code == 'circuit-open'
+    assert session.posts == 2
+
+
+def test_errors_from_a_reachable_service_close_the_breaker():
+    upstream = Upstreams(failure_threshold=2).get('http://workspace')
+    session = FakeSession(503, 500)
+    with pytest.raises(WidgetError):
+        make_client(session, upstream=upstream, max_retries=1).call_func('get_objects2', [{}])
+    assert upstream.breaker.state == CircuitBreaker.CLOSED
+    assert upstream.breaker.failures == 0
@@ -0,0 +1,101 @@
+import gzip
+import json
+import time
+
+import pytest
+
+from widget.lib.rpc_fixtures import RECORDED_LATENCY, TOKEN_PLACEHOLDER, RpcRecorder, RpcReplay
+from widget.lib.widget_error import WidgetError
+
+TOKEN = 'SECRETTOKEN'
+
+
+class StreamedResponse(object):
+    """
+    A response read only by iter_content, as a streamed requests response is.
+    """
+    def __init__(self, status_code, content, chunk_size=10):
+        self.status_code = status_code
+        self.chunks = [content[offset:offset + chunk_size] for offset in range(0, len(content), chunk_size)]
+        self.read_chunks = 0
+        self.closed = False
+
+    @property
+    def content(self):
+        raise AssertionError('the whole response must not be read at once')
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            self.read_chunks += 1
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+def body(result):
+    return json.dumps({'version': '1.1', 'result': result}).encode('utf-8')
+
+
+def test_recorded_calls_are_replayed_without_the_token(tmp_path):
+    path = str(tmp_path / 'fixture.jsonl.gz')
+    recorder = RpcRecorder(path)
+    params = [{'objects': [{'ref': '1/2/3'}], 'token': TOKEN}]
+    response = StreamedResponse(200, body([{'owner': TOKEN}]))
+    recorded = recorder.record('Workspace.get_objects2', params, TOKEN, response, time.monotonic())
+    assert recorded.content == body([{'owner': TOKEN}])
+    assert response.closed
+
+    with gzip.open(path, 'rb') as fin:
+        assert TOKEN.encode('utf-8') not in fin.read()
+
+    # Any user's identical call is answered from the fixture.
+    replay = RpcReplay(path)
+    replayed = replay.get_response('Workspace.get_objects2', [{'objects': [{'ref': '1/2/3'}], 'token': 'OTHER'}], 'OTHER')
+    assert replayed.status_code == 200
+    assert json.loads(replayed.content) == {'version': '1.1', 'result': [{'owner': TOKEN_PLACEHOLDER}]}
+
+
+def test_calls_recorded_more_than_once_are_replayed_in_turn(tmp_path):
+    path = str(tmp_path / 'fixture.jsonl.gz')
+    recorder = RpcRecorder(path)
+    for result in ('first', 'second'):
+        recorder.record('Workspace.ver', [], None, StreamedResponse(200, body([result])), time.monotonic())
+
+    replay = RpcReplay(path)
+    results = [json.loads(replay.get_response('Workspace.ver', [], None).content)['result'] for _ in range(3)]
+    assert results == [['first'], ['second'], ['second']]
+
+
+def test_a_call_which_was_not_recorded_fails(tmp_path):
+    path = str(tmp_path / 'fixture.jsonl.gz')
+    RpcRecorder(path).record('Workspace.ver', [], None, StreamedResponse(200, body(['0.1'])), time.monotonic())
+    with pytest.raises(WidgetError) as info:
+        RpcReplay(path).get_response('Workspace.ver', [1], None)
+    assert info.value.code == 'replay-missing-call'
+
+
+def test_a_response_over_the_limit_is_abandoned_and_not_recorded(tmp_path):
+    path = tmp_path / 'fixture.jsonl.gz'
+    response = StreamedResponse(200, b'x' * 1000)
+    with pytest.raises(WidgetError) as info:
+        RpcRecorder(str(path)).record('Workspace.get_objects2', [], None, response, time.monotonic(), max_bytes=100)
+    assert info.value.code == 'response-too-big'
+    assert response.read_chunks == 11
+    assert response.closed
+    assert not path.exists()
+
+
+def test_recorded_latency_is_reproduced(tmp_path, monkeypatch):
+    path = str(tmp_path / 'fixture.jsonl.gz')
+    # The call is recorded as having taken half a second.
+    RpcRecorder(path).record('Workspace.ver', [], None, StreamedResponse(200, body(['0.1'])), time.monotonic() - 0.5)
+    sleeps = []
+    monkeypatch.setattr('widget.lib.rpc_fixtures.time.sleep', sleeps.append)
+
+    RpcReplay(path, latency=RECORDED_LATENCY).get_response('Workspace.ver', [], None)
+    RpcReplay(path, latency=250).get_response('Workspace.ver', [], None)
+    RpcReplay(path).get_response('Workspace.ver', [], None)
+    assert len(sleeps) == 2
+    assert 0.5 <= sleeps[0] < 1
+    assert sleeps[1] == 0.25
@@ -0,0 +1,63 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from widget.lib.session_pool import SessionPool
+
+
+class CookieHandler(BaseHTTPRequestHandler):
+    """
+    Sets a cookie on every response, and answers with the cookies it was sent.
+    """
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('content-length', 0)))
+        body = (self.headers.get('cookie') or '').encode('utf-8')
+        self.send_response(200)
+        self.send_header('set-cookie', 'session=user-one; Path=/')
+        self.send_header('content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def url():
+    server = HTTPServer(('127.0.0.1', 0), CookieHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_sessions_are_shared_by_url():
+    pool = SessionPool()
+    assert pool.get_session('http://a') is pool.get_session('http://a')
+    assert pool.get_session('http://a') is not pool.get_session('http://b')
+    pool.close()
+
+
+def test_idle_sessions_are_replaced():
+    pool = SessionPool(idle_timeout=-1)
+    session = pool.get_session('http://a')
+    assert pool.get_session('http://a') is not session
+    pool.close()
+
+
+def test_sessions_keep_no_cookies(url):
+    pool = SessionPool()
+    session = pool.get_session(url)
+    session.post(url, data=b'{}')
+    response = session.post(url, data=b'{}')
+    assert response.content == b''
+    assert len(session.cookies) == 0
+    pool.close()
+
+
+def test_sessions_make_no_retries():
+    session = SessionPool().get_session('http://a')
+    assert session.get_adapter('http://a').max_retries.total == 0
+    assert session.get_adapter('https://a').max_retries.total == 0
@@ -0,0 +1,104 @@
+import threading
+import time
+
+import pytest
+
+from widget.lib.single_flight import SingleFlight
+from widget.lib.widget_error import WidgetError
+
+
+def start_followers(single_flight, key, count, outcomes):
+    """
+    Starts threads which make the same call as the leader, once it is in progress, and
+    keep what each receives.
+    """
+    def follow():
+        try:
+            outcomes.append(('result', single_flight.do(key, lambda: 'not coalesced', timeout=5)))
+        except Exception as ex:
+            outcomes.append(('error', ex))
+
+    threads = [threading.Thread(target=follow) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def wait_for_followers(single_flight, count):
+    while single_flight.stats()['coalesced'] < count:
+        time.sleep(0.001)
+
+
+def test_identical_calls_share_the_result():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    outcomes = []
+    followers = []
+
+    def call():
+        followers.extend(start_followers(single_flight, 'key', 4, outcomes))
+        wait_for_followers(single_flight, 4)
+        release.wait(5)
+        return ['result']
+
+    leader = threading.Thread(target=lambda: outcomes.append(('result', single_flight.do('key', call))))
+    leader.start()
+    release.set()
+    leader.join()
+    for thread in followers:
+        thread.join()
+
+    assert len(outcomes) == 5
+    assert all(outcome == ('result', ['result']) for outcome in outcomes)
+    assert single_flight.stats() == {'in_flight': 0, 'calls': 1, 'coalesced': 4}
+
+
+def test_an_error_is_raised_to_every_caller():
+    single_flight = SingleFlight()
+    error = WidgetError(title='Connection Error', code='connection-error', message='refused')
+    outcomes = []
+    followers = []
+
+    def call():
+        followers.extend(start_followers(single_flight, 'key', 3, outcomes))
+        wait_for_followers(single_flight, 3)
+        raise error
+
+    with pytest.raises(WidgetError) as info:
+        single_flight.do('key', call)
+    for thread in followers:
+        thread.join()
+
+    assert info.value is error
+    assert outcomes == [('error', error)] * 3
+    # A failed call is not remembered; the next call is made anew.
+    assert single_flight.do('key', lambda: 'again') == 'again'
+    assert single_flight.stats()['in_flight'] == 0
+
+
+def test_different_keys_are_not_coalesced():
+    single_flight = SingleFlight()
+    assert single_flight.do('a', lambda: 1) == 1
+    assert single_flight.do('b', lambda: 2) == 2
+    assert single_flight.stats() == {'in_flight': 0, 'calls': 2, 'coalesced': 0}
+
+
+def test_a_waiting_caller_times_out():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    started = threading.Event()
+
+    def call():
+        started.set()
+        release.wait(5)
+
+    leader = threading.Thread(target=lambda: single_flight.do('key', call))
+    leader.start()
+    started.wait(5)
+    try:
+        with pytest.raises(WidgetError) as info:
+            single_flight.do('key', lambda: None, timeout=0.01)
+        assert info.value.code == 'connection-error'
+    finally:
+        release.set()
+        leader.join()
@@ -0,0 +1,111 @@
+import os
+
+import pytest
+
+from widget.lib.static_index import StaticIndex, make_hashed_path
+
+STYLE = b'body { color: black; }\n' * 100
+
+
+@pytest.fixture
+def root(tmp_path):
+    (tmp_path / 'css').mkdir()
+    (tmp_path / 'css' / 'style.css').write_bytes(STYLE)
+    (tmp_path / 'index.html').write_bytes(b'<html></html>')
+    (tmp_path / 'README').write_bytes(b'no extension')
+    (tmp_path / 'large.js').write_bytes(b'x' * 1000)
+    return tmp_path
+
+
+def test_files_are_found_by_relative_path(root):
+    index = StaticIndex(root)
+    static_file = index.get('css/style.css')
+    assert static_file.media_type == 'text/css'
+    assert static_file.size == len(STYLE)
+    assert static_file.content == STYLE
+    assert index.get('index.html').media_type == 'text/html'
+
+
+def test_paths_outside_the_directory_are_not_found(root):
+    (root.parent / 'secret.txt').write_bytes(b'secret')
+    index = StaticIndex(root)
+    assert index.get('../secret.txt') is None
+    assert index.get('css/../../secret.txt') is None
+    assert index.get('missing.css') is None
+
+
+def test_files_without_a_media_type_are_indexed_but_not_read(root):
+    static_file = StaticIndex(root).get('README')
+    assert static_file.media_type is None
+    assert static_file.content is None
+
+
+def test_large_files_are_not_kept_in_memory(root):
+    index = StaticIndex(root, cache_max_file_bytes=500)
+    assert index.get('large.js').content is None
+    assert index.get('index.html').content == b'<html></html>'
+
+
+def test_changes_are_not_seen_without_refresh(root):
+    index = StaticIndex(root)
+    (root / 'new.css').write_bytes(b'p {}')
+    assert index.get('new.css') is None
+
+
+def test_changes_are_seen_with_refresh(root):
+    index = StaticIndex(root, refresh=True)
+    (root / 'new.css').write_bytes(b'p {}')
+    assert index.get('new.css').content == b'p {}'
+
+    path = root / 'index.html'
+    stat = path.stat()
+    path.write_bytes(b'<html>edited</html>')
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert index.get('index.html').content == b'<html>edited</html>'
+
+
+def test_misses_do_not_scan_again_unless_a_directory_changed(root):
+    index = StaticIndex(root, refresh=True)
+    scans = []
+    scan = index.scan
+    index.scan = lambda: scans.append(1) or scan()
+
+    assert index.get('favicon.ico') is None
+    assert index.get('css/style.css.map') is None
+    assert len(scans) == 0
+
+    (root / 'css' / 'new.css').write_bytes(b'p {}')
+    assert index.get('css/new.css').content == b'p {}'
+    assert index.get('favicon.ico') is None
+    assert len(scans) == 1
+
+
+def test_gzip_variant_for_large_compressible_files(root):
+    index = StaticIndex(root, gzip_min_bytes=1024)
+    style = index.get('css/style.css')
+    assert style.gzip_content is not None and len(style.gzip_content) < style.size
+    assert style.gzip_etag != style.etag
+    # Too small to be worth compressing.
+    assert index.get('index.html').gzip_content is None
+
+
+def test_hashed_path_inserts_the_hash_before_the_extension():
+    assert make_hashed_path('js/lib.js', '0123456789ab') == 'js/lib.0123456789ab.js'
+    assert make_hashed_path('js/lib.min.js', '0123456789ab') == 'js/lib.min.0123456789ab.js'
+    assert make_hashed_path('README', '0123456789ab') == 'README.0123456789ab'
+    assert make_hashed_path('v1.2/README', '0123456789ab') == 'v1.2/README.0123456789ab'
+
+
+def test_files_are_also_found_by_hashed_path(root):
+    index = StaticIndex(root, content_hashes=True)
+    hashed_path = index.get_hashed_path('css/style.css')
+    assert hashed_path.startswith('css/style.') and hashed_path.endswith('.css')
+    assert index.get(hashed_path) is index.get('css/style.css')
+    assert StaticIndex(root).get_hashed_path('css/style.css') is None
+
+
+def test_hashed_path_changes_with_the_content(root):
+    before = StaticIndex(root, content_hashes=True).get_hashed_path('css/style.css')
+    (root / 'css' / 'style.css').write_bytes(STYLE + b'p {}\n')
+    after = StaticIndex(root, content_hashes=True).get_hashed_path('css/style.css')
+    assert before != after
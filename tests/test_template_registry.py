@@ -0,0 +1,39 @@
+import threading
+import time
+
+from widget.lib.template_registry import TemplateRegistry
+
+
+def test_templates_are_compiled():
+    registry = TemplateRegistry()
+    env = registry.register('minimal_example')
+    assert registry.get_environment('minimal_example') is env
+    assert registry.register('minimal_example') is env
+    assert registry.get_templates_mtime('minimal_example') > 0
+    assert env.get_template('index.html') is env.get_template('index.html')
+
+
+def test_a_package_registered_at_the_same_time_is_compiled_once():
+    registry = TemplateRegistry()
+    created = []
+    create_environment = registry.create_environment
+
+    def slow_create_environment(widget_package_name):
+        created.append(widget_package_name)
+        time.sleep(0.05)
+        return create_environment(widget_package_name)
+
+    registry.create_environment = slow_create_environment
+    environments = []
+    threads = [
+        threading.Thread(target=lambda: environments.append(registry.register('minimal_example')))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert created == ['minimal_example']
+    assert len(environments) == 5
+    assert all(env is environments[0] for env in environments)
@@ -0,0 +1,193 @@
+import json
+
+import pytest
+
+from widget.lib import widget_manifest
+from widget.lib.static_index import StaticIndex
+from widget.lib.widget_error import WidgetError
+from widget.lib.widget_manifest import MANIFEST_VERSION, compile_manifest, get_warm_up_names, validate_config
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    """
+    A service directory with a python widget, a static widget and assets.
+    """
+    (tmp_path / 'lib/widget/widgets/viewer').mkdir(parents=True)
+    (tmp_path / 'lib/widget/widgets/viewer/widget.py').write_text('')
+    (tmp_path / 'widget/widgets/static_viewer').mkdir(parents=True)
+    (tmp_path / 'widget/widgets/static_viewer/index.html').write_text('<html></html>')
+    (tmp_path / 'widget/assets/css').mkdir(parents=True)
+    (tmp_path / 'widget/assets/css/style.css').write_text('body {}')
+
+    monkeypatch.setattr(widget_manifest, 'SERVICE_PATH', str(tmp_path))
+    monkeypatch.setattr(widget_manifest, 'CONFIG_PATH', str(tmp_path / 'widget/widgets.yml'))
+    monkeypatch.setattr(widget_manifest, 'MANIFEST_PATH', str(tmp_path / 'widget/widgets.manifest.json'))
+    return tmp_path
+
+
+def make_config(*widgets, settings=None):
+    config = {
+        'widgets': [
+            {'name': 'assets', 'type': 'assets'},
+            {'name': 'static_viewer', 'type': 'static'},
+            {'name': 'viewer', 'type': 'python'},
+        ] + list(widgets)
+    }
+    if settings is not None:
+        config['settings'] = settings
+    return config
+
+
+def get_problems(config):
+    with pytest.raises(WidgetError) as info:
+        validate_config(config)
+    assert info.value.code == 'invalid-widget-config'
+    return info.value.message.split('\n')
+
+
+def test_valid_config(service):
+    validate_config(make_config(settings={'startup': {'warm_up': ['viewer']}}))
+
+
+@pytest.mark.parametrize('config', [None, [], {}, {'widgets': {'name': 'viewer'}}])
+def test_config_without_a_list_of_widgets(service, config):
+    assert get_problems(config) == ['the config must be a mapping with a list of "widgets"']
+
+
+@pytest.mark.parametrize('widget, problem', [
+    ('viewer', 'widget 4 is not a mapping'),
+    ({'name': 'bad name', 'type': 'python'}, 'widget "bad name" must have a name of letters, digits, "_" and "-"'),
+    ({'name': 'other', 'type': 'dynamic'}, 'widget "other" has the type \'dynamic\'; expected one of assets, static, python'),
+    ({'name': 'other', 'type': 'static', 'package': 'x'}, 'widget "other" has the unknown key "package" for a static widget'),
+    ({'name': 'other', 'type': 'python', 'title': 3}, 'widget "other" must have a string "title"'),
+    ({'name': 'other', 'type': 'python', 'streaming': 'yes'}, 'widget "other" must have true or false for "streaming"'),
+    ({'name': 'other', 'type': 'python', 'included': ['name']},
+     'widget "other" must have a list of object paths, such as "/name", for "included"'),
+    ({'name': 'other', 'type': 'python', 'output_cache': {'size': 1}},
+     'widget "other" must have a mapping of "ttl" and "max_bytes" for "output_cache"'),
+    ({'name': 'other', 'type': 'python', 'output_cache': {'ttl': 0}}, 'widget "other" must have positive numbers for "output_cache"'),
+    ({'name': 'other', 'type': 'python', 'streaming': True, 'output_cache': {'ttl': 60}},
+     'widget "other" may not have both "streaming" and "output_cache"'),
+    ({'name': 'other', 'type': 'python'}, 'widget "other" has no directory lib/widget/widgets/other'),
+    ({'name': 'other', 'type': 'static'}, 'widget "other" has no directory widget/widgets/other'),
+    ({'name': 'viewer', 'type': 'python'}, 'widget "viewer" is configured more than once'),
+])
+def test_invalid_widget(service, widget, problem):
+    assert get_problems(make_config(widget)) == [problem]
+
+
+def test_python_widget_without_a_module(service):
+    (service / 'lib/widget/widgets/other').mkdir()
+    assert get_problems(make_config({'name': 'other', 'type': 'python'})) == [
+        'widget "other" has no module lib/widget/widgets/other/widget.py'
+    ]
+
+
+def test_every_problem_is_reported(service):
+    problems = get_problems(make_config(
+        {'name': 'one', 'type': 'python', 'title': 1},
+        {'name': 'two', 'type': 'static', 'cache_control': 60},
+        settings={'startup': {'warm_up': 'static_viewer'}}
+    ))
+    assert problems == [
+        'widget "one" must have a string "title"',
+        'widget "two" must have a string "cache_control"',
+        'the widget "static_viewer" to warm up is not a configured python widget',
+    ]
+
+
+@pytest.mark.parametrize('settings, problem', [
+    ([], '"settings" must be a mapping'),
+    ({'startup': {'warm_up': ['missing']}}, 'the widget "missing" to warm up is not a configured python widget'),
+    ({'startup': {'warm_up': 3}}, '"startup.warm_up" must be a widget name or a list of widget names'),
+    ({'startup': {'warm_up': [['viewer']]}}, '"startup.warm_up" must be a widget name or a list of widget names'),
+])
+def test_invalid_settings(service, settings, problem):
+    assert get_problems(make_config(settings=settings)) == [problem]
+
+
+@pytest.mark.parametrize('warm_up, names', [
+    (None, []),
+    ('viewer', ['viewer']),
+    (['viewer', 'other'], ['viewer', 'other']),
+])
+def test_warm_up_names(warm_up, names):
+    assert get_warm_up_names(warm_up) == names
+
+
+def test_compile_manifest(service):
+    config_content = (
+        b'widgets:\n'
+        b'  - name: assets\n'
+        b'    type: assets\n'
+        b'  - name: static_viewer\n'
+        b'    type: static\n'
+        b'  - name: viewer_py\n'
+        b'    type: python\n'
+        b'    package: viewer\n'
+        b'settings:\n'
+        b'  startup:\n'
+        b'    warm_up: viewer_py\n'
+    )
+    manifest = compile_manifest(config_content)
+    assert manifest['version'] == MANIFEST_VERSION
+    assert manifest['settings'] == {'startup': {'warm_up': 'viewer_py'}}
+
+    assets, static, python = manifest['widgets']
+    assert assets['root'] == 'widget/assets'
+    assert [path for path, _, _, _ in assets['files']] == ['css/style.css']
+    # Only assets are served by content-hashed path.
+    assert assets['files'][0][3] is not None
+    assert static['files'][0][0] == 'index.html' and static['files'][0][3] is None
+    assert python['title'] == 'Viewer_Py'
+    assert python['package'] == 'viewer'
+    assert python['root'] == 'lib/widget/widgets/viewer'
+
+
+def test_manifest_is_used_only_for_the_config_it_was_compiled_from(service):
+    config_content = b'widgets:\n  - name: viewer\n    type: python\n'
+    (service / 'widget/widgets.yml').write_bytes(config_content)
+    (service / 'widget/widgets.manifest.json').write_text(json.dumps(compile_manifest(config_content)))
+    manifest, problem = widget_manifest.load_manifest()
+    assert manifest['widgets'][0]['name'] == 'viewer'
+    assert problem is None
+
+    (service / 'widget/widgets.yml').write_bytes(config_content + b'    title: Changed\n')
+    manifest, problem = widget_manifest.load_manifest()
+    assert manifest is None
+    assert problem.startswith('the manifest was compiled from a config with the digest ')
+
+
+def test_manifest_of_another_version_is_not_used(service):
+    config_content = b'widgets:\n  - name: viewer\n    type: python\n'
+    manifest = compile_manifest(config_content)
+    manifest['version'] = MANIFEST_VERSION + 1
+    (service / 'widget/widgets.yml').write_bytes(config_content)
+    (service / 'widget/widgets.manifest.json').write_text(json.dumps(manifest))
+    assert widget_manifest.load_manifest() == (None, f"the manifest is of version {MANIFEST_VERSION + 1}, not {MANIFEST_VERSION}")
+
+
+def test_missing_manifest_is_not_used(service):
+    (service / 'widget/widgets.yml').write_bytes(b'widgets: []\n')
+    manifest, problem = widget_manifest.load_manifest()
+    assert manifest is None
+    assert problem.startswith('there is no manifest ')
+
+
+def test_static_index_loads_the_indexed_files(service):
+    assets_path = service / 'widget/assets'
+    files = widget_manifest.index_files(str(assets_path), content_hashes=True)
+    (assets_path / 'css/new.css').write_text('p {}')
+
+    index = StaticIndex(assets_path, content_hashes=True, files=files)
+    assert index.get_hashed_path('css/style.css') == f"css/style.{files[0][3]}.css"
+    # A file added since the files were indexed is found too.
+    assert index.get('css/new.css').content == b'p {}'
+    assert index.get_hashed_path('css/new.css') is not None
+    assert index.unindexed_paths == ['css/new.css']
+
+    # A file changed since it was indexed is hashed again.
+    (assets_path / 'css/style.css').write_text('body { margin: 0; }')
+    index = StaticIndex(assets_path, content_hashes=True, files=files)
+    assert index.get_hashed_path('css/style.css') != f"css/style.{files[0][3]}.css"